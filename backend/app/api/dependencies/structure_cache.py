@@ -0,0 +1,13 @@
+from typing import Annotated
+
+from fastapi import Depends
+
+from api.dependencies.get_container import ContainerDependency
+from api.responses.structure_cache import StructureCache
+
+
+def _get_structure_cache(container: ContainerDependency) -> StructureCache:
+    return container.structure_cache
+
+
+StructureCacheDependency = Annotated[StructureCache, Depends(_get_structure_cache)]
@@ -44,3 +44,18 @@ class JobNotFoundError(ApiError):
 class TrajectoryNotFoundError(ApiError):
     status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
     detail = "Trajectory not found"
+
+
+class ModelNotSupportedError(ApiError):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    detail = "Model or dtype is not supported"
+
+
+class JobAlreadyFinishedError(ApiError):
+    status_code = status.HTTP_409_CONFLICT
+    detail = "Job is already finished, failed or stopped"
+
+
+class IntakeQueueFullError(ApiError):
+    status_code = status.HTTP_429_TOO_MANY_REQUESTS
+    detail = "Too many jobs are waiting for their structures, retry later"
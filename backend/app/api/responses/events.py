@@ -0,0 +1,66 @@
+from typing import Self
+
+from pydantic import BaseModel, Field
+
+from api.responses.job import StructureResponse
+from api.responses.structure_cache import StructureCache
+from services.relaxation.job import Job
+from services.relaxation.trajectory_store import JobTrajectory
+
+
+class StepEventResponse(BaseModel):
+    step: int = Field(..., description="Optimization step number, starting from 1")
+    energy: float = Field(..., description="Energy (eV/Å)")
+    force: float = Field(..., description="Max force (eV)")
+    progress: float = Field(..., description="Progress of the job after this step")
+    structure: StructureResponse | None = Field(..., description="Structure after this step, if requested")
+
+    @classmethod
+    def from_job(cls,
+                 job: Job,
+                 trajectory: JobTrajectory,
+                 step: int,
+                 cache: StructureCache,
+                 include_structure: bool) -> Self:
+        structure = None
+        if include_structure:
+            structure = StructureResponse(
+                format=cache.structure_format,
+                structure=cache.get(job["id"], step, trajectory.atoms(step)),
+            )
+
+        return cls(
+            step=step,
+            energy=job["energies"][step - 1],
+            force=job["forces"][step - 1],
+            progress=step / job["max_steps"],
+            structure=structure,
+        )
+
+
+class StatusEventResponse(BaseModel):
+    status: str = Field(..., description="Status of the job")
+    progress: float = Field(..., description="Progress of the job")
+
+    @classmethod
+    def from_job(cls, job: Job) -> Self:
+        return cls(status=job["status"], progress=job["progress"])
+
+
+class SummaryEventResponse(BaseModel):
+    status: str = Field(..., description="Final status of the job")
+    energies: list[float] = Field(..., description="Energy (eV/Å) of every step")
+
+    @classmethod
+    def from_job(cls, job: Job) -> Self:
+        return cls(status=job["status"], energies=job["energies"])
+
+
+def format_sse(event: str, data: BaseModel, event_id: int | None = None) -> str:
+    """Format the message according to the server-sent events spec"""
+    message = f"event: {event}\n"
+    if event_id is not None:
+        message += f"id: {event_id}\n"
+    message += f"data: {data.model_dump_json()}\n\n"
+
+    return message
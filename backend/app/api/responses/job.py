@@ -1,11 +1,18 @@
-import io
 from typing import Self
 
-from ase import Atoms
-from ase.io import write
 from pydantic import BaseModel, Field
 
+from api.responses.structure_cache import StructureCache
 from services.relaxation.job import Job
+from services.relaxation.scheduler import JobSchedule
+from services.relaxation.trajectory_store import JobTrajectory
+from utils.metrics import registry
+
+
+_SERIALIZATION_SECONDS = registry.histogram(
+    "api_job_response_serialization_seconds",
+    "Time to build the job response, including the structures of the steps",
+)
 
 
 class StructureResponse(BaseModel):
@@ -13,94 +20,189 @@ class StructureResponse(BaseModel):
     structure: str = Field(..., description="Structure in the given format")
 
 
+class StepResponse(StructureResponse):
+    step: int = Field(..., description="Optimization step number, starting from 1")
+
+
 class StructuresResponse(BaseModel):
     chemical_formula: str = Field(..., description="Chemical formula")
     bulk: StructureResponse = Field(..., description="Bulk structure in CIF format")
     slab: StructureResponse = Field(..., description="Slab structure in CIF format")
 
     @classmethod
-    def from_job(cls, job: Job) -> Self:
-        structure_format = "cif"
-
-        atoms = Atoms.fromdict(job["atoms"])
-        atoms_slab = Atoms.fromdict(job["atoms_slab"])
-
-        structures = {
-            'bulk': io.BytesIO(),
-            'slab': io.BytesIO()
-        }
-
-        write(structures['bulk'], atoms, format=structure_format)
-        write(structures['slab'], atoms_slab, format=structure_format)
-
-        bulk_str = structures['bulk'].getvalue().decode('utf-8')
-        slab_str = structures['slab'].getvalue().decode('utf-8')
-
+    def from_job(cls, job: Job, cache: StructureCache) -> Self:
         return cls(
             chemical_formula=job["chemical_formula"],
             bulk=StructureResponse(
-                format=structure_format,
-                structure=bulk_str,
+                format=cache.structure_format,
+                structure=cache.get(job["id"], "bulk", job["atoms"]),
             ),
             slab=StructureResponse(
-                format=structure_format,
-                structure=slab_str,
+                format=cache.structure_format,
+                structure=cache.get(job["id"], "slab", job["atoms_slab"]),
             )
         )
 
 
-def serialize_steps(job: Job) -> list[StructureResponse]:
-    structure_format = "cif"
+class StepsWindow:
+    """
+    Range of steps requested by the client.
+
+    Steps are numbered from 1 without gaps, so step N is stored at index N - 1 of energies and forces.
+    """
+    def __init__(self, since_step: int = 0, offset: int = 0, limit: int | None = None) -> None:
+        self.start = since_step + offset
+        self.stop = None if limit is None else self.start + limit
+
+    def steps(self, total_steps: int) -> range:
+        stop = total_steps if self.stop is None else min(self.stop, total_steps)
+        return range(self.start + 1, stop + 1)
+
+    def last_step(self, total_steps: int) -> int:
+        steps = self.steps(total_steps)
+        return steps[-1] if steps else min(self.start, total_steps)
+
+    def select(self, values: list[float], total_steps: int) -> list[float]:
+        steps = self.steps(total_steps)
+        return values[steps.start - 1:steps.stop - 1]
+
 
-    steps = []
-    for step, atoms in job["step_atoms"].items():
-        atoms = Atoms.fromdict(atoms)
-        structure = io.BytesIO()
-        write(structure, atoms, format=structure_format)
-        structure_str = structure.getvalue().decode('utf-8')
+def total_steps(job: Job) -> int:
+    # steps are appended by the message listener while we are serializing them,
+    #   so all parts of the response are limited by the number of steps taken once;
+    #   positions are written and energies are appended before forces, so they are never shorter
+    return len(job["forces"])
 
-        steps.append(StructureResponse(
-            format=structure_format,
-            structure=structure_str,
+
+def serialize_steps(job: Job,
+                    trajectory: JobTrajectory | None,
+                    cache: StructureCache,
+                    window: StepsWindow | None = None,
+                    total: int | None = None) -> list[StepResponse]:
+    """Trajectory is None if the structure of the job is not fetched yet, such jobs have no steps"""
+    window = window or StepsWindow()
+    total = total_steps(job) if total is None else total
+
+    steps: list[StepResponse] = []
+    if trajectory is None:
+        return steps
+
+    for step in window.steps(total):
+        steps.append(StepResponse(
+            step=step,
+            format=cache.structure_format,
+            structure=cache.get(job["id"], step, trajectory.atoms(step)),
         ))
 
     return steps
 
 
+class PrerelaxationResponse(BaseModel):
+    model: str = Field(..., description="Model the job is pre-relaxed with")
+    dtype: str = Field(..., description="Precision of the model")
+    fmax: float = Field(..., description="Maximum force (eV/Å) the pre-relaxation stops at")
+
+
 class JobOptimizationResponse(BaseModel):
     progress: float = Field(0.0, description="Progress in percents")
     fmax: float = Field(..., description="Maximum force (eV/Å)")
     max_steps: int = Field(..., description="Maximum number of steps")
+    max_seconds: float | None = Field(None, description="Wall time budget in seconds, null if there is no limit")
+    model: str = Field(..., description="Model the job is relaxed with")
+    dtype: str = Field(..., description="Precision of the model")
+    prerelaxation: PrerelaxationResponse | None = Field(None, description="Pre-relaxation stage, if the job has one")
     forces: list[float] = Field(..., description="Max force (eV)")
     energies: list[float] = Field(..., description="Energy (eV/Å)")
 
     @classmethod
-    def from_job(cls, job: Job) -> Self:
+    def from_job(cls, job: Job, window: StepsWindow | None = None, total: int | None = None) -> Self:
+        window = window or StepsWindow()
+        total = total_steps(job) if total is None else total
+        prerelaxation = job["prerelaxation"]
+
         return cls(
             progress=job["progress"],
             fmax=job["fmax"],
             max_steps=job["max_steps"],
-            energies=job["energies"],
-            forces=job["forces"]
+            max_seconds=job["max_seconds"],
+            model=job["model"],
+            dtype=job["dtype"],
+            prerelaxation=PrerelaxationResponse(**prerelaxation) if prerelaxation is not None else None,
+            energies=window.select(job["energies"], total),
+            forces=window.select(job["forces"], total),
         )
 
 class JobResponse(BaseModel):
     id: str = Field(..., description="Job ID")
+    material_id: str = Field(..., description="Materials Project material ID")
     status: str = Field(..., description="Status of the job")
+    error: str | None = Field(..., description="Reason why the job failed, if it is known")
     optimization: JobOptimizationResponse = Field(..., description="Optimization results")
-    structures: StructuresResponse = Field(..., description="Structures")
-    steps: list[StructureResponse] = Field(..., description="Optimization steps")
+    structures: StructuresResponse | None = Field(
+        ..., description="Structures, omitted if not requested or if the structure is not fetched yet"
+    )
+    steps: list[StepResponse] = Field(..., description="Optimization steps")
+    total_steps: int = Field(..., description="Number of steps done so far")
+    last_step: int = Field(..., description="Last returned step, pass it as since_step to get only newer steps")
+    queue_position: int | None = Field(None, description="Position in the queue (1 is next), null if not queued")
+    eta_seconds: float | None = Field(None, description="Estimated seconds until the job is finished, null if unknown")
+
+    @classmethod
+    def from_job(cls,
+                 job: Job,
+                 trajectory: JobTrajectory | None,
+                 cache: StructureCache,
+                 window: StepsWindow | None = None,
+                 include_structures: bool = True,
+                 schedule: JobSchedule | None = None) -> Self:
+        with _SERIALIZATION_SECONDS.time():
+            window = window or StepsWindow()
+            total = total_steps(job)
+
+            optimization = JobOptimizationResponse.from_job(job, window, total)
+            structures = None
+            if include_structures and job["atoms"] is not None:
+                structures = StructuresResponse.from_job(job, cache)
+            steps = serialize_steps(job, trajectory, cache, window, total)
+
+            return cls(
+                id=job["id"],
+                material_id=job["material_id"],
+                status=job["status"],
+                error=job["error"],
+                optimization=optimization,
+                structures=structures,
+                steps=steps,
+                total_steps=total,
+                last_step=window.last_step(total),
+                queue_position=schedule.queue_position if schedule else None,
+                eta_seconds=schedule.eta_seconds if schedule else None,
+            )
+
+
+class JobStepsResponse(BaseModel):
+    id: str = Field(..., description="Job ID")
+    status: str = Field(..., description="Status of the job")
+    energies: list[float] = Field(..., description="Energy (eV/Å) of the returned steps")
+    forces: list[float] = Field(..., description="Max force (eV) of the returned steps")
+    steps: list[StepResponse] = Field(..., description="Optimization steps")
+    total_steps: int = Field(..., description="Number of steps done so far")
+    last_step: int = Field(..., description="Last returned step, pass it as since_step to get only newer steps")
 
     @classmethod
-    def from_job(cls, job: Job) -> Self:
-        optimization = JobOptimizationResponse.from_job(job)
-        structures = StructuresResponse.from_job(job)
-        steps = serialize_steps(job)
+    def from_job(cls,
+                 job: Job,
+                 trajectory: JobTrajectory | None,
+                 cache: StructureCache,
+                 window: StepsWindow) -> Self:
+        total = total_steps(job)
 
         return cls(
             id=job["id"],
             status=job["status"],
-            optimization=optimization,
-            structures=structures,
-            steps=steps,
+            energies=window.select(job["energies"], total),
+            forces=window.select(job["forces"], total),
+            steps=serialize_steps(job, trajectory, cache, window, total),
+            total_steps=total,
+            last_step=window.last_step(total),
         )
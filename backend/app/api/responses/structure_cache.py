@@ -0,0 +1,78 @@
+import io
+from collections import OrderedDict
+from threading import Lock
+from typing import Any
+
+from ase import Atoms
+
+
+StructureKey = str | int
+
+
+class StructureCache:
+    """
+    Rendered structures of the jobs, keyed by job ID and structure key (bulk, slab or step number).
+
+    Bulk, slab and every written step never change, so each of them is rendered only once.
+    Jobs are evicted in LRU order when there are more than max_jobs of them
+        or when their structures take more than max_bytes, or explicitly with evict() when the job is removed.
+    A single job that takes more than max_bytes on its own loses its oldest structures instead.
+    """
+    def __init__(self, max_jobs: int, max_bytes: int, structure_format: str = "cif") -> None:
+        self.max_jobs = max_jobs
+        self.max_bytes = max_bytes
+        self.structure_format = structure_format
+
+        self._jobs: OrderedDict[str, dict[StructureKey, str]] = OrderedDict()
+        # size of all cached structures, rendered formats are ASCII, so characters are bytes
+        self._bytes = 0
+        self._lock = Lock()
+
+    def get(self, job_id: str, key: StructureKey, atoms: dict[str, Any]) -> str:
+        with self._lock:
+            if (structures := self._jobs.get(job_id)) is not None:
+                self._jobs.move_to_end(job_id)
+                if (structure := structures.get(key)) is not None:
+                    return structure
+
+        # rendering is slow, so it is done without the lock;
+        #   the worst case is the same structure rendered twice by concurrent requests
+        structure = self._render(atoms)
+
+        with self._lock:
+            structures = self._jobs.setdefault(job_id, {})
+            self._jobs.move_to_end(job_id)
+            if key not in structures:
+                structures[key] = structure
+                self._bytes += len(structure)
+
+            self._evict_overflow()
+
+        return structure
+
+    def evict(self, job_id: str) -> None:
+        with self._lock:
+            if (structures := self._jobs.pop(job_id, None)) is not None:
+                self._bytes -= sum(map(len, structures.values()))
+
+    def _evict_overflow(self) -> None:
+        while len(self._jobs) > 1 and (len(self._jobs) > self.max_jobs or self._bytes > self.max_bytes):
+            _, structures = self._jobs.popitem(last=False)
+            self._bytes -= sum(map(len, structures.values()))
+
+        # the most recently used job is over the budget on its own
+        if self._bytes > self.max_bytes and self._jobs:
+            structures = next(reversed(self._jobs.values()))
+            for key in list(structures):
+                if self._bytes <= self.max_bytes:
+                    break
+
+                self._bytes -= len(structures.pop(key))
+
+    def _render(self, atoms: dict[str, Any]) -> str:
+        # ase.io imports scipy, the API process imports it on the first rendered structure
+        from ase.io import write
+
+        buffer = io.BytesIO()
+        write(buffer, Atoms.fromdict(atoms), format=self.structure_format)
+        return buffer.getvalue().decode('utf-8')
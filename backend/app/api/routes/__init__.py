@@ -1,9 +1,17 @@
 from fastapi import APIRouter
 
+from .cancel_relaxation import router as cancel_job_router
 from .create_relaxation import router as optimize_router
+from .get_metrics import router as metrics_router
 from .get_relaxation import router as get_job_router
+from .get_usage import router as usage_router
+from .stream_relaxation import router as stream_job_router
 
 router = APIRouter()
 
 router.include_router(optimize_router)
 router.include_router(get_job_router)
+router.include_router(stream_job_router)
+router.include_router(cancel_job_router)
+router.include_router(usage_router)
+router.include_router(metrics_router)
@@ -0,0 +1,39 @@
+from fastapi import APIRouter
+
+from api.dependencies.relaxation_service import RelaxationServiceDependency
+from api.dependencies.structure_cache import StructureCacheDependency
+from api.responses.errors import JobAlreadyFinishedError, JobNotFoundError, TrajectoryNotFoundError
+from api.responses.job import JobResponse, StepsWindow
+from services.relaxation.repository.abstract import JobNotFound
+from services.relaxation.service import JobAlreadyFinished
+from services.relaxation.trajectory_store import TrajectoryNotFound
+
+router = APIRouter()
+
+
+@router.delete("/relaxations/{relaxation_id}", response_model=JobResponse)
+def cancel_relaxation(
+    relaxation_id: str,
+    service: RelaxationServiceDependency,
+    cache: StructureCacheDependency,
+) -> JobResponse:
+    """
+    Cancels the job: a queued job is removed from the queue, a running job is stopped after its current step.
+
+    The job and the steps taken until then are kept in the CANCELLED status, steps and structures are not included.
+    """
+    try:
+        job = service.cancel_job(relaxation_id)
+        return JobResponse.from_job(
+            job,
+            service.find_trajectory(job),
+            cache,
+            window=StepsWindow(limit=0),
+            include_structures=False,
+        )
+    except JobNotFound as e:
+        raise JobNotFoundError.raise_http(e)
+    except JobAlreadyFinished as e:
+        raise JobAlreadyFinishedError.raise_http(e)
+    except TrajectoryNotFound as e:
+        raise TrajectoryNotFoundError.raise_http(e)
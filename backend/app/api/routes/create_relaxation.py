@@ -1,11 +1,20 @@
-from fastapi import APIRouter
+from typing import Self
+
+from fastapi import APIRouter, status
 from pydantic import BaseModel, Field
 
 from api.dependencies.relaxation_service import RelaxationServiceDependency
-from api.responses.errors import ApiKeyOutdatedError, ApiKeyMalformedError, MaterialMalformedError, \
-    MaterialNotFoundError
-from api.responses.job import JobResponse
-from services.relaxation.service import ApiKeyOutdated, ApiKeyMalformed, MaterialMalformedName, MaterialNotFound
+from api.dependencies.structure_cache import StructureCacheDependency
+from api.responses.errors import ApiKeyOutdatedError, ApiKeyMalformedError, IntakeQueueFullError, \
+    MaterialMalformedError, MaterialNotFoundError, ModelNotSupportedError, TrajectoryNotFoundError
+from api.responses.job import JobResponse, StepsWindow
+from services.relaxation.intake import IntakeQueueFull
+from services.relaxation.job import Job
+from services.relaxation.scheduler import JobPriority
+from services.relaxation.trajectory_store import TrajectoryNotFound
+from services.structures.source.abstract import ApiKeyOutdated, ApiKeyMalformed, FetchError, \
+    MaterialMalformedName, MaterialNotFound
+from utils.calculator_factory import UnknownModel
 
 from api.dependencies.get_container import ContainerDependency
 
@@ -15,30 +24,132 @@ router = APIRouter()
 class RelaxationRequest(BaseModel):
     material_id: str = Field(..., description="Materials Project material ID")
     fmax: float = Field(0.05, description="Maximum force in eV/Å")
-    max_steps: int = Field(30, description="Maximum number of steps")
+    max_steps: int = Field(30, ge=1, description="Maximum number of steps")
+    max_seconds: float | None = Field(
+        None, gt=0, description="Wall time budget in seconds, longer jobs are stopped as TIMED_OUT; no limit if not set"
+    )
     mp_api_key: str | None = Field(default=None, description="Materials Project API key")
+    priority: JobPriority = Field(JobPriority.NORMAL, description="Jobs with higher priority are relaxed first")
+    model: str | None = Field(None, description="Model, e.g. small, medium, large, emt; the default model if not set")
+    dtype: str | None = Field(None, description="float32 (faster) or float64; the default of the model if not set")
+    prerelax_model: str | None = Field(
+        None, description="Cheaper model to pre-relax with before the model, e.g. small; no pre-relaxation if not set"
+    )
+    prerelax_dtype: str | None = Field(None, description="dtype of the pre-relaxation model, e.g. float32")
+    prerelax_fmax: float = Field(0.2, description="Maximum force in eV/Å the pre-relaxation stops at")
+
+
+class BatchRelaxationRequest(BaseModel):
+    material_ids: list[str] = Field(..., min_length=1, max_length=1000, description="Materials Project material IDs")
+    fmax: float = Field(0.05, description="Maximum force in eV/Å")
+    max_steps: int = Field(30, ge=1, description="Maximum number of steps")
+    max_seconds: float | None = Field(
+        None, gt=0, description="Wall time budget in seconds, longer jobs are stopped as TIMED_OUT; no limit if not set"
+    )
+    mp_api_key: str | None = Field(default=None, description="Materials Project API key")
+    priority: JobPriority = Field(JobPriority.NORMAL, description="Jobs with higher priority are relaxed first")
+    model: str | None = Field(None, description="Model, e.g. small, medium, large, emt; the default model if not set")
+    dtype: str | None = Field(None, description="float32 (faster) or float64; the default of the model if not set")
+    prerelax_model: str | None = Field(
+        None, description="Cheaper model to pre-relax with before the model, e.g. small; no pre-relaxation if not set"
+    )
+    prerelax_dtype: str | None = Field(None, description="dtype of the pre-relaxation model, e.g. float32")
+    prerelax_fmax: float = Field(0.2, description="Maximum force in eV/Å the pre-relaxation stops at")
+
+
+class BatchRelaxationItemResponse(BaseModel):
+    material_id: str = Field(..., description="Materials Project material ID")
+    job_id: str | None = Field(None, description="Job ID, if the job was created")
+    status: str | None = Field(None, description="Status of the job, if the job was created")
+    error: str | None = Field(None, description="Reason why the job was not created")
+
+    @classmethod
+    def from_result(cls, material_id: str, result: Job | FetchError) -> Self:
+        if isinstance(result, MaterialNotFound):
+            return cls(material_id=material_id, error=MaterialNotFoundError.detail)
+
+        if isinstance(result, MaterialMalformedName):
+            return cls(material_id=material_id, error=MaterialMalformedError.detail)
+
+        return cls(material_id=material_id, job_id=result["id"], status=result["status"])
+
+
+class BatchRelaxationResponse(BaseModel):
+    items: list[BatchRelaxationItemResponse] = Field(..., description="Results in the order of the request")
 
 
-@router.post("/relaxations", response_model=JobResponse)
+@router.post("/relaxations", response_model=JobResponse, status_code=status.HTTP_202_ACCEPTED)
 def create_relaxation(
     request: RelaxationRequest,
     service: RelaxationServiceDependency,
+    cache: StructureCacheDependency,
     container: ContainerDependency,
 ) -> JobResponse:
-    """The relaxation would be done in the background, poll for the results using job_id"""
+    """
+    The relaxation would be done in the background, poll for the results using job_id.
+
+    Job is returned in the FETCHING status before its structure is fetched, it fails if the material can't be fetched.
+    Steps and structures are not included, even if an identical job is returned.
+    """
     try:
         job = service.create_job(
             material_id=request.material_id,
             fmax=request.fmax,
             max_steps=request.max_steps,
+            max_seconds=request.max_seconds,
+            mpr_api_key=request.mp_api_key or container.settings.MPR_API_KEY,
+            priority=request.priority,
+            model=request.model,
+            dtype=request.dtype,
+            prerelax_model=request.prerelax_model,
+            prerelax_dtype=request.prerelax_dtype,
+            prerelax_fmax=request.prerelax_fmax,
+        )
+
+        return JobResponse.from_job(
+            job,
+            service.find_trajectory(job),
+            cache,
+            window=StepsWindow(limit=0),
+            include_structures=False,
+            schedule=service.get_schedule(job),
+        )
+    except TrajectoryNotFound as e:
+        raise TrajectoryNotFoundError.raise_http(e)
+    except UnknownModel as e:
+        raise ModelNotSupportedError.raise_http(e)
+    except IntakeQueueFull as e:
+        raise IntakeQueueFullError.raise_http(e)
+
+
+@router.post("/relaxations/batch", response_model=BatchRelaxationResponse)
+def create_relaxations_batch(
+    request: BatchRelaxationRequest,
+    service: RelaxationServiceDependency,
+    container: ContainerDependency,
+) -> BatchRelaxationResponse:
+    """Creates a relaxation for every material, materials that can't be fetched are reported per item"""
+    try:
+        results = service.create_jobs(
+            material_ids=request.material_ids,
+            fmax=request.fmax,
+            max_steps=request.max_steps,
+            max_seconds=request.max_seconds,
             mpr_api_key=request.mp_api_key or container.settings.MPR_API_KEY,
+            priority=request.priority,
+            model=request.model,
+            dtype=request.dtype,
+            prerelax_model=request.prerelax_model,
+            prerelax_dtype=request.prerelax_dtype,
+            prerelax_fmax=request.prerelax_fmax,
         )
 
-        return JobResponse.from_job(job)
-    except MaterialNotFound as e:
-        raise MaterialNotFoundError.raise_http(e)
-    except MaterialMalformedName as e:
-        raise MaterialMalformedError.raise_http(e)
+        return BatchRelaxationResponse(items=[
+            BatchRelaxationItemResponse.from_result(material_id, result)
+            for material_id, result in zip(request.material_ids, results)
+        ])
+    except UnknownModel as e:
+        raise ModelNotSupportedError.raise_http(e)
     except ApiKeyMalformed as e:
         raise ApiKeyMalformedError.raise_http(e)
     except ApiKeyOutdated as e:
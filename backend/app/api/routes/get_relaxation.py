@@ -1,10 +1,13 @@
-from fastapi import APIRouter, Response
+from fastapi import APIRouter, Header, Query, Response
+from fastapi.responses import FileResponse, StreamingResponse
 
 from api.dependencies.relaxation_service import RelaxationServiceDependency
+from api.dependencies.structure_cache import StructureCacheDependency
 from api.responses.errors import JobNotFoundError, TrajectoryNotFoundError
-from api.responses.job import JobResponse
+from api.responses.job import JobResponse, JobStepsResponse, StepsWindow
 from services.relaxation.repository.abstract import JobNotFound
-from services.relaxation.service import TrajectoryIsEmpty
+from services.relaxation.trajectory_export import TrajectoryExporter, TrajectoryFormat, TrajectoryIsEmpty
+from services.relaxation.trajectory_store import TrajectoryNotFound
 
 router = APIRouter()
 
@@ -13,31 +16,80 @@ router = APIRouter()
 def get_relaxation(
     relaxation_id: str,
     service: RelaxationServiceDependency,
+    cache: StructureCacheDependency,
+    since_step: int = Query(0, ge=0, description="Return only steps after this one"),
+    offset: int = Query(0, ge=0, description="Number of steps to skip after since_step"),
+    limit: int | None = Query(None, ge=1, description="Maximum number of steps to return"),
+    include_structures: bool = Query(True, description="Include bulk and slab structures"),
 ) -> JobResponse:
     """Returns the job with the given id"""
     try:
         job = service.get_job(relaxation_id)
-        return JobResponse.from_job(job)
+        return JobResponse.from_job(
+            job,
+            service.find_trajectory(job),
+            cache,
+            window=StepsWindow(since_step=since_step, offset=offset, limit=limit),
+            include_structures=include_structures,
+            schedule=service.get_schedule(job),
+        )
+    except JobNotFound as e:
+        raise JobNotFoundError.raise_http(e)
+    except TrajectoryNotFound as e:
+        raise TrajectoryNotFoundError.raise_http(e)
+
+
+@router.get("/relaxations/{relaxation_id}/steps", response_model=JobStepsResponse)
+def get_relaxation_steps(
+    relaxation_id: str,
+    service: RelaxationServiceDependency,
+    cache: StructureCacheDependency,
+    since_step: int = Query(0, ge=0, description="Return only steps after this one"),
+    offset: int = Query(0, ge=0, description="Number of steps to skip after since_step"),
+    limit: int = Query(50, ge=1, le=1000, description="Maximum number of steps to return"),
+) -> JobStepsResponse:
+    """Returns a range of optimization steps of the job with the given id"""
+    try:
+        job = service.get_job(relaxation_id)
+        return JobStepsResponse.from_job(
+            job,
+            service.find_trajectory(job),
+            cache,
+            window=StepsWindow(since_step=since_step, offset=offset, limit=limit),
+        )
     except JobNotFound as e:
         raise JobNotFoundError.raise_http(e)
+    except TrajectoryNotFound as e:
+        raise TrajectoryNotFoundError.raise_http(e)
 
 
 @router.get("/relaxations/{relaxation_id}/trajectory")
 def get_trajectory(
     relaxation_id: str,
     service: RelaxationServiceDependency,
+    structure_format: TrajectoryFormat | None = Query(
+        None, alias="format", description="Format of the trajectory, negotiated with the Accept header if omitted"
+    ),
+    compress: bool = Query(False, description="Compress the trajectory with gzip"),
+    accept: str | None = Header(None),
 ) -> Response:
-    """Returns the trajectory of the relaxation in XYZ format"""
+    """Returns the trajectory of the relaxation in XYZ, extended XYZ or NPZ (positions, energies, forces) format"""
     try:
         job = service.get_job(relaxation_id)
-        buffer = service.get_trajectory_xyz(job)
-        return Response(
-            content=buffer.getvalue(),
-            media_type="chemical/x-xyz",
-            headers={
-                "Content-Disposition": f"attachment; filename=trajectory_{relaxation_id}.xyz"
-            }
+        export = service.export_trajectory(
+            job,
+            structure_format or TrajectoryExporter.format_from_accept(accept),
+            compress=compress,
         )
+        headers = {
+            "Content-Disposition": f"attachment; filename={export.filename}"
+        }
+
+        if export.path is not None:
+            return FileResponse(export.path, media_type=export.media_type, headers=headers)
+
+        assert export.chunks is not None
+        return StreamingResponse(export.chunks, media_type=export.media_type, headers=headers)
     except JobNotFound as e:
         raise JobNotFoundError.raise_http(e)
     except TrajectoryIsEmpty as e:
@@ -0,0 +1,33 @@
+from fastapi import APIRouter
+from pydantic import BaseModel, Field
+
+from api.dependencies.relaxation_service import RelaxationServiceDependency
+
+router = APIRouter()
+
+
+class UsageResponse(BaseModel):
+    jobs: int = Field(..., description="Number of stored jobs")
+    final_jobs: int = Field(..., description="Number of finished and failed jobs, only they can be evicted")
+    disk_bytes: int = Field(..., description="Disk space used by the trajectories and their exports")
+    evicted_jobs: int = Field(..., description="Number of jobs evicted since the start")
+    max_jobs: int | None = Field(..., description="Maximum number of jobs, not limited if null")
+    max_disk_bytes: int | None = Field(..., description="Maximum disk space, not limited if null")
+    ttl: float | None = Field(..., description="Jobs not accessed for this many seconds are evicted")
+
+
+@router.get("/usage", response_model=UsageResponse)
+def get_usage(service: RelaxationServiceDependency) -> UsageResponse:
+    """Returns usage of the stored jobs as of the last retention pass and the retention limits"""
+    retention_manager = service.retention_manager
+    usage = retention_manager.usage()
+
+    return UsageResponse(
+        jobs=usage.jobs,
+        final_jobs=usage.final_jobs,
+        disk_bytes=usage.disk_bytes,
+        evicted_jobs=usage.evicted_jobs,
+        max_jobs=retention_manager.max_jobs,
+        max_disk_bytes=retention_manager.max_disk_bytes,
+        ttl=retention_manager.ttl,
+    )
@@ -0,0 +1,153 @@
+from typing import AsyncIterator
+
+from fastapi import APIRouter, Header, Query
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+
+from api.dependencies.relaxation_service import RelaxationServiceDependency
+from api.dependencies.structure_cache import StructureCacheDependency
+from api.responses.errors import JobNotFoundError, TrajectoryNotFoundError
+from api.responses.events import StatusEventResponse, StepEventResponse, SummaryEventResponse, format_sse
+from api.responses.job import StepsWindow, total_steps
+from api.responses.structure_cache import StructureCache
+from services.relaxation.events import JobEventType
+from services.relaxation.job import FINAL_STATUSES, Job, JobStatus
+from services.relaxation.repository.abstract import JobNotFound
+from services.relaxation.service import RelaxationService
+from services.relaxation.trajectory_store import JobTrajectory, TrajectoryNotFound
+
+router = APIRouter()
+
+# Proxies tend to close connections that are silent for too long
+_KEEP_ALIVE_INTERVAL = 15.0
+
+
+@router.get("/relaxations/{relaxation_id}/events")
+async def stream_relaxation(
+    relaxation_id: str,
+    service: RelaxationServiceDependency,
+    cache: StructureCacheDependency,
+    since_step: int = Query(0, ge=0, description="Stream only steps after this one"),
+    include_structures: bool = Query(True, description="Include the structure of every step"),
+    last_event_id: str | None = Header(None, description="Set by the browser on reconnect"),
+) -> StreamingResponse:
+    """
+    Streams progress of the job as server-sent events: one event per optimizer step and per status change.
+
+    Steps done before the connection (or reconnection, see Last-Event-ID) are replayed first.
+    """
+    try:
+        # the job is read from the repository and the trajectory from the disk, don't block the event loop
+        job = await run_in_threadpool(service.get_job, relaxation_id)
+        trajectory = await run_in_threadpool(service.find_trajectory, job)
+    except JobNotFound as e:
+        raise JobNotFoundError.raise_http(e)
+    except TrajectoryNotFound as e:
+        raise TrajectoryNotFoundError.raise_http(e)
+
+    if last_event_id and last_event_id.isdigit():
+        since_step = max(since_step, int(last_event_id))
+
+    return StreamingResponse(
+        _stream_job(relaxation_id, service, trajectory, cache, since_step, include_structures),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        },
+    )
+
+
+async def _stream_job(job_id: str,
+                      service: RelaxationService,
+                      trajectory: JobTrajectory | None,
+                      cache: StructureCache,
+                      since_step: int,
+                      include_structures: bool) -> AsyncIterator[str]:
+    # subscribe before reading the job, so no step is lost between the replay and live events
+    subscription = service.broadcaster.subscribe(job_id)
+    cursor = since_step
+
+    async def step_message(job: Job, step: int) -> str:
+        nonlocal trajectory
+        # the job had no trajectory when the stream started, its structure was being fetched
+        if trajectory is None:
+            trajectory = await run_in_threadpool(service.get_trajectory, job_id)
+
+        # rendering the structure may be slow, don't block the event loop
+        data = await run_in_threadpool(StepEventResponse.from_job, job, trajectory, step, cache, include_structures)
+        return format_sse("step", data, event_id=step)
+
+    async def follow_link(job: Job) -> Job:
+        """New job that turned out identical to another job is served by it, its events are streamed instead"""
+        nonlocal job_id, subscription, trajectory
+        if job["id"] == job_id:
+            return job
+
+        service.broadcaster.unsubscribe(subscription)
+        job_id = job["id"]
+        subscription = service.broadcaster.subscribe(job_id)
+        trajectory = None
+
+        # read again after subscribing, like the first read
+        return await run_in_threadpool(service.get_job, job_id)
+
+    async def replay(job: Job) -> AsyncIterator[str]:
+        """Steps after the cursor and the status, the stream ends with the job in a final status"""
+        nonlocal cursor
+        for step in StepsWindow(since_step=cursor).steps(total_steps(job)):
+            yield await step_message(job, step)
+            cursor = step
+
+        yield format_sse("status", StatusEventResponse.from_job(job))
+        if job["status"] == JobStatus.FINISHED:
+            yield format_sse("summary", SummaryEventResponse.from_job(job))
+
+    try:
+        job = await follow_link(await run_in_threadpool(service.get_job, job_id))
+
+        async for message in replay(job):
+            yield message
+        if job["status"] in FINAL_STATUSES:
+            return
+
+        while not subscription.overflowed:
+            event = await subscription.get(timeout=_KEEP_ALIVE_INTERVAL)
+            if event is None:
+                yield ": keep-alive\n\n"
+                continue
+
+            # every subscriber reads the job after every event, each read may hit the database
+            job = await run_in_threadpool(service.get_job, job_id)
+
+            if job["id"] != job_id:
+                job = await follow_link(job)
+                async for message in replay(job):
+                    yield message
+                if job["status"] in FINAL_STATUSES:
+                    return
+
+            elif event["type"] == JobEventType.STEP:
+                # already sent during the replay
+                if event["step"] <= cursor:
+                    continue
+
+                # events of several steps may be merged into the last one (see RepositoryEventPoller),
+                #   the skipped steps are read from the job
+                for step in StepsWindow(since_step=cursor).steps(min(event["step"], total_steps(job))):
+                    yield await step_message(job, step)
+                    cursor = step
+
+            elif event["type"] == JobEventType.STATUS:
+                yield format_sse("status", StatusEventResponse.from_job(job))
+                if event["status"] in FINAL_STATUSES:
+                    return
+
+            elif event["type"] == JobEventType.SUMMARY:
+                yield format_sse("summary", SummaryEventResponse.from_job(job))
+                return
+
+        # the client was too slow to keep up with the events,
+        #   it would reconnect and get the missed steps from the replay
+    finally:
+        service.broadcaster.unsubscribe(subscription)
@@ -6,32 +6,220 @@ from fastapi.middleware.cors import CORSMiddleware
 from starlette.requests import Request
 from starlette.responses import Response
 
+from api.responses.structure_cache import StructureCache
 from logger import logger
+from services.relaxation.broadcaster import JobEventBroadcaster
+from services.relaxation.dispatcher import JobDispatcher
+from services.relaxation.repository.abstract import AbstractRelaxationJobRepository
 from services.relaxation.repository.in_memory import InMemoryRelaxationJobRepository
+from services.relaxation.repository.sqlite import SQLiteRelaxationJobRepository
+from services.relaxation.retention import RetentionManager
 from services.relaxation.service import RelaxationService
+from services.relaxation.trajectory_export import TrajectoryExporter
+from services.relaxation.trajectory_store import TrajectoryStore
+from services.relaxation.transport.abstract import AbstractJobTransport
+from services.relaxation.transport.local import LocalJobTransport
+from services.relaxation.transport.tcp import TcpJobTransport
+from services.structures.source.abstract import AbstractStructureSource
+from services.structures.source.cached import CachedStructureSource
+from services.structures.source.local import LocalStructureSource
+from services.structures.source.materials_project import MaterialsProjectStructureSource
+from services.structures.store import SQLiteStructureStore
 from settings import Settings
-from utils.calculator_factory import MACECalculatorFactory
+from utils.calculator_factory import CalculatorRegistry, create_calculator_registry
 
 
 class AppContainer:
-    """All dependencies should be initialized here"""
+    """All dependencies of the API process should be initialized here"""
     def __init__(self) -> None:
         self.settings = Settings()
+        if self.settings.SERVICE_ROLE not in ("all", "web"):
+            raise ValueError(f"Role {self.settings.SERVICE_ROLE} does not serve the API, see commands.dispatcher")
 
-        calculator_factory = MACECalculatorFactory(
-            model=self.settings.MODEL,
+        calculator_registry = _create_calculator_registry(self.settings)
+        job_repository = _create_job_repository(self.settings)
+
+        structure_source: AbstractStructureSource
+        if self.settings.STRUCTURE_SOURCE == "local":
+            structure_source = LocalStructureSource(self.settings.LOCAL_STRUCTURES_DIR)
+        else:
+            structure_source = MaterialsProjectStructureSource(self.settings.MP_DATABASE_VERSION)
+
+        if self.settings.STRUCTURE_STORE_PATH:
+            structure_source = CachedStructureSource(
+                source=structure_source,
+                store=SQLiteStructureStore(
+                    path=self.settings.STRUCTURE_STORE_PATH,
+                    ttl=self.settings.STRUCTURE_STORE_TTL,
+                    max_entries=self.settings.STRUCTURE_STORE_MAX_ENTRIES,
+                ),
+            )
+
+        trajectory_store = _create_trajectory_store(self.settings)
+
+        self.structure_cache = StructureCache(
+            max_jobs=self.settings.STRUCTURE_CACHE_MAX_JOBS,
+            max_bytes=self.settings.STRUCTURE_CACHE_MAX_BYTES,
         )
 
-        job_repository = InMemoryRelaxationJobRepository()
+        trajectory_exporter = TrajectoryExporter(self.settings.TRAJECTORY_EXPORT_DIR, trajectory_store)
+
+        retention_manager = _create_retention_manager(
+            self.settings, job_repository, trajectory_store, trajectory_exporter
+        )
+        retention_manager.add_eviction_listener(self.structure_cache.evict)
+
+        broadcaster = JobEventBroadcaster()
+
+        # web processes leave the jobs to the dispatcher process
+        self.dispatcher: JobDispatcher | None = None
+        if self.settings.SERVICE_ROLE == "all":
+            self.dispatcher = _create_dispatcher(
+                self.settings, job_repository, calculator_registry, trajectory_store, retention_manager, broadcaster
+            )
 
         self.relaxation_service = RelaxationService(
             repository=job_repository,
-            calculator_factory=calculator_factory,
-            num_workers=self.settings.NUM_WORKERS,
+            structure_source=structure_source,
+            calculator_registry=calculator_registry,
+            trajectory_store=trajectory_store,
+            trajectory_exporter=trajectory_exporter,
+            retention_manager=retention_manager,
+            broadcaster=broadcaster,
+            dispatcher=self.dispatcher,
+            intake_concurrency=self.settings.INTAKE_CONCURRENCY,
+            intake_max_pending=self.settings.INTAKE_MAX_PENDING,
+            event_poll_interval=self.settings.EVENT_POLL_INTERVAL,
         )
 
     def shutdown(self) -> None:
         self.relaxation_service.shutdown()
+        if self.dispatcher is not None:
+            self.dispatcher.shutdown()
+
+
+class DispatcherContainer:
+    """Dependencies of the dispatcher process, see commands.dispatcher"""
+    def __init__(self) -> None:
+        self.settings = Settings()
+        if self.settings.SERVICE_ROLE != "dispatcher":
+            raise ValueError(f"Role {self.settings.SERVICE_ROLE} is not a dispatcher, set SERVICE_ROLE=dispatcher")
+
+        calculator_registry = _create_calculator_registry(self.settings)
+        job_repository = _create_job_repository(self.settings)
+        trajectory_store = _create_trajectory_store(self.settings)
+        trajectory_exporter = TrajectoryExporter(self.settings.TRAJECTORY_EXPORT_DIR, trajectory_store)
+        retention_manager = _create_retention_manager(
+            self.settings, job_repository, trajectory_store, trajectory_exporter
+        )
+
+        self.dispatcher = _create_dispatcher(
+            self.settings,
+            job_repository,
+            calculator_registry,
+            trajectory_store,
+            retention_manager,
+            # nobody streams the events in this process
+            JobEventBroadcaster(),
+            poll_interval=self.settings.DISPATCHER_POLL_INTERVAL,
+        )
+
+    def shutdown(self) -> None:
+        self.dispatcher.shutdown()
+
+
+def _create_calculator_registry(settings: Settings) -> CalculatorRegistry:
+    calculator_registry = create_calculator_registry(
+        default_model=settings.MODEL,
+        default_dtype=settings.DTYPE,
+    )
+
+    # web processes only validate the models of the new jobs, they have no workers to share the model with,
+    #   and "all" serves the API too, its startup is not held up by the model, the workers load it themselves
+    if settings.PRELOAD_MODEL and settings.SERVICE_ROLE == "dispatcher":
+        try:
+            calculator_registry.preload()
+        except Exception as e:
+            # workers load the model themselves
+            logger.exception(f"Error preloading model: {e}")
+
+    return calculator_registry
+
+
+def _create_job_repository(settings: Settings) -> AbstractRelaxationJobRepository:
+    if settings.REPOSITORY == "sqlite":
+        return SQLiteRelaxationJobRepository(
+            path=settings.DATABASE_PATH,
+            cache_size=settings.REPOSITORY_CACHE_SIZE,
+            shared=settings.SERVICE_ROLE != "all",
+        )
+
+    if settings.SERVICE_ROLE != "all":
+        raise ValueError(f"Role {settings.SERVICE_ROLE} shares the jobs with other processes, set REPOSITORY=sqlite")
+
+    return InMemoryRelaxationJobRepository()
+
+
+def _create_trajectory_store(settings: Settings) -> TrajectoryStore:
+    return TrajectoryStore(
+        directory=settings.TRAJECTORY_STORE_DIR,
+        max_open=settings.TRAJECTORY_STORE_MAX_OPEN,
+    )
+
+
+def _create_retention_manager(settings: Settings,
+                              job_repository: AbstractRelaxationJobRepository,
+                              trajectory_store: TrajectoryStore,
+                              trajectory_exporter: TrajectoryExporter) -> RetentionManager:
+    return RetentionManager(
+        repository=job_repository,
+        trajectory_store=trajectory_store,
+        trajectory_exporter=trajectory_exporter,
+        ttl=settings.RETENTION_TTL,
+        max_jobs=settings.RETENTION_MAX_JOBS,
+        max_disk_bytes=settings.RETENTION_MAX_DISK_BYTES,
+        interval=settings.RETENTION_INTERVAL,
+    )
+
+
+def _create_dispatcher(settings: Settings,
+                       job_repository: AbstractRelaxationJobRepository,
+                       calculator_registry: CalculatorRegistry,
+                       trajectory_store: TrajectoryStore,
+                       retention_manager: RetentionManager,
+                       broadcaster: JobEventBroadcaster,
+                       poll_interval: float | None = None) -> JobDispatcher:
+    return JobDispatcher(
+        repository=job_repository,
+        calculator_registry=calculator_registry,
+        trajectory_store=trajectory_store,
+        retention_manager=retention_manager,
+        broadcaster=broadcaster,
+        min_workers=settings.MIN_WORKERS,
+        max_workers=settings.MAX_WORKERS,
+        batch_size=settings.BATCH_SIZE,
+        checkpoint_interval=settings.CHECKPOINT_INTERVAL_STEPS,
+        drain_timeout=settings.DRAIN_TIMEOUT,
+        cpu_budget=settings.CPU_BUDGET,
+        worker_idle_timeout=settings.WORKER_IDLE_TIMEOUT,
+        worker_heartbeat_timeout=settings.WORKER_HEARTBEAT_TIMEOUT,
+        worker_max_models=settings.WORKER_MAX_MODELS,
+        poll_interval=poll_interval,
+        fetch_timeout=settings.FETCH_TIMEOUT,
+        transport=_create_job_transport(settings),
+    )
+
+
+def _create_job_transport(settings: Settings) -> AbstractJobTransport:
+    if settings.WORKER_TRANSPORT == "tcp":
+        return TcpJobTransport(
+            host=settings.BROKER_HOST,
+            port=settings.BROKER_PORT,
+            authkey=settings.BROKER_AUTHKEY,
+            lease_timeout=settings.WORKER_HEARTBEAT_TIMEOUT,
+        )
+
+    return LocalJobTransport()
 
 
 @asynccontextmanager
@@ -0,0 +1,390 @@
+"""
+Offline end-to-end benchmark of the relaxation pipeline.
+
+Runs the app with a stand-in calculator (EMT or LJ) and local structures, so it needs no model download,
+    no API key and no network. Clients submit jobs over HTTP and poll them until they are finished.
+
+Usage (from the app directory):
+    python -m commands.benchmark --jobs 50 --clients 8 --max-workers 4
+    python -m commands.benchmark --output results.json
+    python -m commands.benchmark --baseline results.json    # exits with 1 on a regression
+
+Reports job throughput, queue wait, poll latency by the number of steps of the polled job,
+    IPC bytes per step, memory of the server and the workers and the cold import time of the API.
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any
+
+from ase.build import bulk
+from ase.io import write
+
+from logger import logger
+from services.relaxation.job import FINAL_STATUSES
+
+
+# Upper bounds of the step count bins of the poll latency
+_POLL_STEP_BINS = (10, 50, 100, 250, 500, math.inf)
+
+# Modules the API process should not import, they are loaded by the workers
+_HEAVY_MODULES = ("torch", "mace", "pymatgen", "mp_api", "scipy")
+
+# Imports the app in a fresh interpreter, the app is not created yet
+_IMPORT_SCRIPT = f"""
+import sys, time
+start = time.perf_counter()
+import main, api.routes
+print(time.perf_counter() - start)
+print(",".join(name for name in {_HEAVY_MODULES!r} if name in sys.modules))
+"""
+
+# Metrics compared with the baseline, True if higher is better
+_REGRESSION_CHECKS = {
+    "jobs_per_second": True,
+    "steps_per_second": True,
+    "job_latency_p95": False,
+    "queue_wait_p95": False,
+    "poll_latency_p95": False,
+    "ipc_bytes_per_step": False,
+    "server_rss_end": False,
+    "workers_pss_peak": False,
+    "import_seconds": False,
+}
+
+
+@dataclass
+class _JobResult:
+    submitted_at: float
+    finished_at: float
+    status: str
+    steps: int
+    # (number of steps of the job, latency of the poll)
+    polls: list[tuple[int, float]] = field(default_factory=list)
+
+
+class _MemoryMonitor:
+    """Samples resident memory of the server and its workers"""
+    def __init__(self, worker_pids: Any, interval: float = 0.5) -> None:
+        self.worker_pids = worker_pids
+        self.interval = interval
+
+        self.server_start = _rss_bytes(os.getpid())
+        self.server_peak = self.server_start
+        self.workers_peak = 0
+        # proportional set size splits the shared pages (e.g. the shared model) between the processes
+        self.workers_pss_peak = 0
+
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            self.server_peak = max(self.server_peak, _rss_bytes(os.getpid()))
+            pids = self.worker_pids()
+            self.workers_peak = max(self.workers_peak, sum(_rss_bytes(pid) for pid in pids))
+            self.workers_pss_peak = max(self.workers_pss_peak, sum(_pss_bytes(pid) for pid in pids))
+
+
+def _rss_bytes(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as file:
+            for line in file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except (FileNotFoundError, ProcessLookupError):
+        pass
+
+    return 0
+
+
+def _pss_bytes(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as file:
+            for line in file:
+                if line.startswith("Pss:"):
+                    return int(line.split()[1]) * 1024
+    except (FileNotFoundError, ProcessLookupError, PermissionError):
+        pass
+
+    return 0
+
+
+def _measure_import() -> tuple[float, list[str]]:
+    """Seconds to import the app in a fresh interpreter and the heavy modules it imported"""
+    output = subprocess.run(
+        [sys.executable, "-c", _IMPORT_SCRIPT],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.splitlines()
+
+    return float(output[-2]), [name for name in output[-1].split(",") if name]
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return int(sock.getsockname()[1])
+
+
+def _request(url: str, body: dict[str, Any] | None = None) -> tuple[dict[str, Any], float]:
+    """Returns the JSON response and the latency"""
+    data = json.dumps(body).encode() if body is not None else None
+    request = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+
+    start = time.perf_counter()
+    with urllib.request.urlopen(request, timeout=60) as response:
+        payload = json.loads(response.read())
+
+    return payload, time.perf_counter() - start
+
+
+def _write_structures(directory: str, count: int, sizes: list[int], rattle: float) -> list[str]:
+    """Every job gets its own structure, so identical jobs are not merged"""
+    material_ids = []
+    for i in range(count):
+        size = sizes[i % len(sizes)]
+        atoms = bulk("Cu", "fcc", a=3.6, cubic=True) * (size, size, size)
+        atoms.rattle(stdev=rattle, seed=i)
+
+        material_id = f"bench-{i:05d}"
+        write(os.path.join(directory, f"{material_id}.vasp"), atoms, format="vasp")
+        material_ids.append(material_id)
+
+    return material_ids
+
+
+def _run_job(base_url: str, material_id: str, args: argparse.Namespace) -> _JobResult:
+    submitted_at = time.perf_counter()
+    job, _ = _request(
+        f"{base_url}/relaxations",
+        {"material_id": material_id, "fmax": args.fmax, "max_steps": args.max_steps},
+    )
+
+    polls = []
+    while job["status"] not in FINAL_STATUSES:
+        time.sleep(args.poll_interval)
+        job, latency = _request(f"{base_url}/relaxations/{job['id']}")
+        polls.append((job["total_steps"], latency))
+
+    return _JobResult(
+        submitted_at=submitted_at,
+        finished_at=time.perf_counter(),
+        status=job["status"],
+        steps=job["total_steps"],
+        polls=polls,
+    )
+
+
+def _percentile(values: list[float], q: float) -> float | None:
+    if not values:
+        return None
+
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def _mean(values: list[float]) -> float | None:
+    return sum(values) / len(values) if values else None
+
+
+def _summarize(results: list[_JobResult],
+               memory: _MemoryMonitor,
+               import_seconds: float,
+               import_heavy_modules: list[str]) -> dict[str, Any]:
+    from services.relaxation.metrics import (
+        EVENTS,
+        MESSAGE_BYTES,
+        MESSAGE_LATENCY_SECONDS,
+        QUEUE_WAIT_SECONDS,
+        STEP_MODEL_SECONDS,
+        STEP_OPTIMIZER_SECONDS,
+    )
+
+    wall_seconds = max(r.finished_at for r in results) - min(r.submitted_at for r in results)
+    finished = [r for r in results if r.status == "FINISHED"]
+    steps = sum(r.steps for r in results)
+    step_events = EVENTS.value("STEP")
+
+    poll_latency = {}
+    lower = 0.0
+    for upper in _POLL_STEP_BINS:
+        latencies = [latency for r in results for n, latency in r.polls if lower <= n < upper]
+        if latencies:
+            poll_latency[f"{lower:.0f}-{upper:.0f}"] = {
+                "count": len(latencies),
+                "mean": _mean(latencies),
+                "p95": _percentile(latencies, 0.95),
+            }
+        lower = upper
+
+    server_end = _rss_bytes(os.getpid())
+
+    return {
+        "jobs": len(results),
+        "finished": len(finished),
+        "failed": len(results) - len(finished),
+        "wall_seconds": wall_seconds,
+        "jobs_per_second": len(finished) / wall_seconds,
+        "steps_per_second": steps / wall_seconds,
+        "job_latency_p50": _percentile([r.finished_at - r.submitted_at for r in results], 0.5),
+        "job_latency_p95": _percentile([r.finished_at - r.submitted_at for r in results], 0.95),
+        "queue_wait_mean": QUEUE_WAIT_SECONDS.sum / QUEUE_WAIT_SECONDS.count if QUEUE_WAIT_SECONDS.count else None,
+        "queue_wait_p95": QUEUE_WAIT_SECONDS.quantile(0.95),
+        "poll_latency_p95": _percentile([latency for r in results for _, latency in r.polls], 0.95),
+        "poll_latency_by_steps": poll_latency,
+        "ipc_bytes_per_step": MESSAGE_BYTES.sum / step_events if step_events else None,
+        "ipc_latency_p95": MESSAGE_LATENCY_SECONDS.quantile(0.95),
+        "step_model_seconds_mean": STEP_MODEL_SECONDS.sum / max(STEP_MODEL_SECONDS.count, 1),
+        "step_optimizer_seconds_mean": STEP_OPTIMIZER_SECONDS.sum / max(STEP_OPTIMIZER_SECONDS.count, 1),
+        "server_rss_start": memory.server_start,
+        "server_rss_peak": max(memory.server_peak, server_end),
+        "server_rss_end": server_end,
+        "server_rss_growth": server_end - memory.server_start,
+        "workers_rss_peak": memory.workers_peak,
+        "workers_pss_peak": memory.workers_pss_peak,
+        "import_seconds": import_seconds,
+        "import_heavy_modules": import_heavy_modules,
+    }
+
+
+def _print_report(summary: dict[str, Any]) -> None:
+    print(f"Jobs: {summary['finished']}/{summary['jobs']} finished in {summary['wall_seconds']:.1f} s")
+    for key, value in summary.items():
+        if key in ("jobs", "finished", "wall_seconds", "poll_latency_by_steps"):
+            continue
+        if isinstance(value, float):
+            value = f"{value:,.4f}"
+        elif isinstance(value, int):
+            value = f"{value:,}"
+        print(f"  {key:<30} {value}")
+
+    print("Poll latency by the number of steps:")
+    for steps, stats in summary["poll_latency_by_steps"].items():
+        print(f"  {steps:<12} n={stats['count']:<6} mean={stats['mean']:.4f} s  p95={stats['p95']:.4f} s")
+
+
+def _find_regressions(summary: dict[str, Any], baseline: dict[str, Any], tolerance: float) -> list[str]:
+    regressions = []
+    for key, higher_is_better in _REGRESSION_CHECKS.items():
+        current, previous = summary.get(key), baseline.get(key)
+        if current is None or not previous:
+            continue
+
+        change = (current - previous) / previous
+        if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+            regressions.append(f"{key}: {previous:,.4f} -> {current:,.4f} ({change:+.0%})")
+
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark with a stand-in calculator")
+    parser.add_argument("--jobs", type=int, default=20, help="Number of jobs (default: %(default)s)")
+    parser.add_argument("--clients", type=int, default=4, help="Concurrent clients (default: %(default)s)")
+    parser.add_argument("--calculator", choices=("emt", "lj"), default="emt", help="Stand-in calculator")
+    parser.add_argument(
+        "--sizes",
+        default="2,3",
+        help="Supercell repeats of the 4-atom copper cell, jobs cycle through them (default: %(default)s)",
+    )
+    parser.add_argument("--rattle", type=float, default=0.1, help="Displacement of the atoms in Å")
+    parser.add_argument("--fmax", type=float, default=0.01, help="Maximum force in eV/Å (default: %(default)s)")
+    parser.add_argument("--max-steps", type=int, default=100, help="Maximum number of steps (default: %(default)s)")
+    parser.add_argument("--min-workers", type=int, default=1)
+    parser.add_argument("--max-workers", type=int, default=2)
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--poll-interval", type=float, default=0.2, help="Seconds between the polls of a job")
+    parser.add_argument("--output", help="Write the results as JSON, e.g. as a baseline for the next run")
+    parser.add_argument("--baseline", help="JSON results of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression (default: %(default)s)")
+    args = parser.parse_args()
+
+    # per-step logs would dominate the output and the timings
+    logger.setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory(prefix="relaxation-benchmark-") as directory:
+        structures_dir = os.path.join(directory, "structures")
+        os.makedirs(structures_dir)
+        material_ids = _write_structures(structures_dir, args.jobs, [int(s) for s in args.sizes.split(",")], args.rattle)
+
+        # settings are read when the app starts
+        os.environ.update({
+            "MODEL": args.calculator,
+            "STRUCTURE_SOURCE": "local",
+            "LOCAL_STRUCTURES_DIR": structures_dir,
+            "STRUCTURE_STORE_PATH": "",
+            "REPOSITORY": "memory",
+            "TRAJECTORY_STORE_DIR": os.path.join(directory, "trajectories"),
+            "TRAJECTORY_EXPORT_DIR": os.path.join(directory, "exports"),
+            "MIN_WORKERS": str(args.min_workers),
+            "MAX_WORKERS": str(args.max_workers),
+            "BATCH_SIZE": str(args.batch_size),
+        })
+
+        import_seconds, import_heavy_modules = _measure_import()
+
+        import uvicorn
+
+        from app import create_app
+
+        app = create_app()
+        port = _free_port()
+        server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+        server_thread = threading.Thread(target=server.run, daemon=True)
+        server_thread.start()
+        while not server.started:
+            time.sleep(0.05)
+
+        memory = _MemoryMonitor(lambda: app.state.container.dispatcher.worker_pool.pids)
+        memory.start()
+
+        base_url = f"http://127.0.0.1:{port}"
+        with ThreadPoolExecutor(max_workers=args.clients) as executor:
+            results = list(executor.map(lambda material_id: _run_job(base_url, material_id, args), material_ids))
+
+        memory.stop()
+        summary = _summarize(results, memory, import_seconds, import_heavy_modules)
+
+        server.should_exit = True
+        server_thread.join()
+
+    _print_report(summary)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(summary, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = _find_regressions(summary, json.load(file), args.tolerance)
+
+        for regression in regressions:
+            print(f"Regression: {regression}")
+
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+"""
+Dispatcher process of the split deployment: relaxes the jobs created by the web processes.
+
+Usage (from the app directory), all processes need the same sqlite repository and trajectory store:
+    SERVICE_ROLE=dispatcher REPOSITORY=sqlite python -m commands.dispatcher
+    SERVICE_ROLE=web REPOSITORY=sqlite uvicorn main:app --workers 8
+
+Only one dispatcher should run, it owns the workers and the models.
+Running jobs are checkpointed and stopped on SIGTERM or SIGINT, they are resumed by the next dispatcher.
+"""
+import signal
+import threading
+
+from app import DispatcherContainer
+from logger import logger
+
+
+def main() -> None:
+    stop_event = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stop_event.set())
+
+    logger.info("Creating dispatcher container")
+    container = DispatcherContainer()
+    logger.info("Dispatcher container created, waiting for jobs")
+
+    stop_event.wait()
+
+    logger.info("Shutting down dispatcher container")
+    container.shutdown()
+    logger.info("Dispatcher container shut down")
+
+
+if __name__ == "__main__":
+    main()
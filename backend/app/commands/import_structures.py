@@ -0,0 +1,69 @@
+"""
+Pre-seeds the structure store, so the service doesn't have to fetch these materials.
+
+Usage (from the app directory):
+    python -m commands.import_structures path/to/mp-149.cif path/to/structures_dir ...
+
+The file name (without extension) is used as the material ID, any format known to pymatgen works.
+Imported structures are pinned, they don't expire like the fetched ones.
+The structures are stored for the database version of the service (MP_DATABASE_VERSION),
+    "latest" is resolved with the Materials Project API (MPR_API_KEY), pass --database-version to import offline.
+"""
+import argparse
+from pathlib import Path
+
+from pymatgen.core.structure import Structure
+
+from logger import logger
+from settings import Settings
+from services.structures.source.materials_project import MaterialsProjectStructureSource
+from services.structures.store import SQLiteStructureStore
+
+
+def _collect_files(paths: list[str]) -> list[Path]:
+    files = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            files.extend(sorted(p for p in path.iterdir() if p.is_file()))
+        else:
+            files.append(path)
+
+    return files
+
+
+def main() -> None:
+    settings = Settings()
+
+    parser = argparse.ArgumentParser(description="Import structures into the local structure store")
+    parser.add_argument("paths", nargs="+", help="Structure files or directories with them")
+    parser.add_argument(
+        "--database-version",
+        default=settings.MP_DATABASE_VERSION,
+        help="Database version the structures belong to (default: %(default)s)",
+    )
+    parser.add_argument("--store", default=settings.STRUCTURE_STORE_PATH, help="Path to the store")
+    args = parser.parse_args()
+
+    store = SQLiteStructureStore(
+        path=args.store,
+        ttl=settings.STRUCTURE_STORE_TTL,
+        max_entries=settings.STRUCTURE_STORE_MAX_ENTRIES,
+    )
+
+    # the service looks the structures up by the resolved version
+    database_version = MaterialsProjectStructureSource(args.database_version).database_version(settings.MPR_API_KEY)
+
+    structures = {}
+    for file in _collect_files(args.paths):
+        try:
+            structures[file.stem] = Structure.from_file(str(file))
+        except Exception as e:
+            logger.error(f"Skipping {file}: {e}")
+
+    store.put_many(database_version, structures, pinned=True)
+    store.close()
+    logger.info(f"Imported {len(structures)} structures of database version {database_version} into {args.store}")
+
+
+if __name__ == "__main__":
+    main()
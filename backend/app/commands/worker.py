@@ -0,0 +1,76 @@
+"""
+Remote worker: relaxes the jobs of a dispatcher on another host.
+
+Usage (from the app directory), the dispatcher runs with WORKER_TRANSPORT=tcp:
+    BROKER_HOST=dispatcher.example BROKER_AUTHKEY=secret python -m commands.worker
+
+Model, dtype, batch size and checkpoint settings are read from the environment like in the dispatcher.
+The worker exits when it is drained: on SIGTERM or SIGINT, when the dispatcher shuts down
+    or when the connection is lost, running jobs are checkpointed and resumed by another worker.
+"""
+import multiprocessing
+import signal
+
+from logger import logger
+from services.relaxation.batched_worker import BatchedRelaxationWorker
+from services.relaxation.transport.tcp import TcpWorkerConnection
+from services.relaxation.worker import RelaxationWorker
+from settings import Settings
+from utils.calculator_factory import create_calculator_registry
+
+
+def main() -> None:
+    settings = Settings()
+
+    drain_event = multiprocessing.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: drain_event.set())
+
+    calculator_registry = create_calculator_registry(
+        default_model=settings.MODEL,
+        default_dtype=settings.DTYPE,
+    )
+
+    logger.info(f"Connecting to the dispatcher at {settings.BROKER_HOST}:{settings.BROKER_PORT}")
+    connection = TcpWorkerConnection(
+        address=(settings.BROKER_HOST, settings.BROKER_PORT),
+        authkey=settings.BROKER_AUTHKEY,
+        slots=settings.BATCH_SIZE,
+        drain_event=drain_event,
+    )
+
+    worker: RelaxationWorker
+    if settings.BATCH_SIZE > 1:
+        worker = BatchedRelaxationWorker(
+            calculator_registry,
+            connection.task_queue,
+            connection.message_queue,
+            drain_event,
+            settings.BATCH_SIZE,
+            checkpoint_interval=settings.CHECKPOINT_INTERVAL_STEPS,
+            max_models=settings.WORKER_MAX_MODELS,
+        )
+    else:
+        worker = RelaxationWorker(
+            calculator_registry,
+            connection.task_queue,
+            connection.message_queue,
+            drain_event,
+            checkpoint_interval=settings.CHECKPOINT_INTERVAL_STEPS,
+            max_models=settings.WORKER_MAX_MODELS,
+        )
+
+    connection.add_cancel_listener(worker.cancel)
+
+    if settings.CPU_BUDGET:
+        worker.set_num_threads(settings.CPU_BUDGET)
+
+    # the worker relaxes in this process, there is no pool to supervise it
+    try:
+        worker.run()
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
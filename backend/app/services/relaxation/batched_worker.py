@@ -0,0 +1,237 @@
+import queue
+from dataclasses import dataclass
+from functools import partial
+from multiprocessing.synchronize import Event
+import time
+from contextlib import contextmanager
+from threading import Condition, Lock, Thread
+from typing import Any, Callable, Iterator
+
+import numpy as np
+import numpy.typing as npt
+from ase import Atoms
+from ase.calculators.calculator import Calculator, all_changes
+
+from logger import logger
+from utils.calculator_factory import CalculatorRegistry, evaluate_batch
+from .events import JobEvent
+from .job import Job
+from .transport.abstract import ReceiveChannel, SendChannel
+from .worker import RelaxationWorker
+
+
+EnergyAndForces = tuple[float, npt.NDArray[np.float64]]
+
+
+@dataclass
+class _Request:
+    atoms: Atoms
+    result: EnergyAndForces | None = None
+    error: Exception | None = None
+
+    @property
+    def done(self) -> bool:
+        return self.result is not None or self.error is not None
+
+
+class BatchEvaluator:
+    """
+    Collects energy and forces requests from the relaxations running in parallel
+        and evaluates them in a single batch.
+
+    Optimizers evaluate the structure several times per step (line search),
+        so every relaxation runs in its own thread and blocks until the batch with its structure is evaluated.
+    """
+    def __init__(self, evaluate: Callable[[list[Atoms]], list[EnergyAndForces]]) -> None:
+        self._evaluate = evaluate
+        self._condition = Condition()
+        self._participants = 0
+        self._pending: list[_Request] = []
+
+    @property
+    def participants(self) -> int:
+        with self._condition:
+            return self._participants
+
+    def join(self) -> None:
+        with self._condition:
+            self._participants += 1
+
+    def leave(self) -> None:
+        with self._condition:
+            self._participants -= 1
+            self._condition.notify_all()
+
+    def evaluate(self, atoms: Atoms) -> EnergyAndForces:
+        """Called by the relaxations, blocks until the batch is evaluated"""
+        request = _Request(atoms)
+
+        with self._condition:
+            self._pending.append(request)
+            self._condition.notify_all()
+            self._condition.wait_for(lambda: request.done)
+
+        if request.error is not None:
+            raise request.error
+
+        assert request.result is not None
+        return request.result
+
+    def run_batch(self, timeout: float) -> int:
+        """
+        Called by the coordinating thread, returns the size of the evaluated batch.
+
+        Waits until every relaxation is waiting for its energy and forces,
+            if some of them are still busy after the timeout, evaluates the ones that are ready.
+        """
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self._participants > 0 and len(self._pending) >= self._participants,
+                timeout,
+            )
+            requests, self._pending = self._pending, []
+
+        if not requests:
+            return 0
+
+        try:
+            results = self._evaluate([request.atoms for request in requests])
+            for request, result in zip(requests, results):
+                request.result = result
+        except Exception as e:
+            # one broken structure should not fail the whole batch
+            logger.exception(f"Error evaluating batch of {len(requests)} structures, evaluating one by one: {e}")
+            for request in requests:
+                try:
+                    request.result = self._evaluate([request.atoms])[0]
+                except Exception as request_error:
+                    request.error = request_error
+
+        with self._condition:
+            self._condition.notify_all()
+
+        return len(requests)
+
+
+class BatchedCalculator(Calculator):
+    """ASE calculator of a single relaxation that delegates evaluation to the shared BatchEvaluator"""
+    implemented_properties = ["energy", "free_energy", "forces"]
+
+    def __init__(self, evaluator: BatchEvaluator, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self.evaluator = evaluator
+
+    def calculate(self,
+                  atoms: Atoms | None = None,
+                  properties: list[str] | None = None,
+                  system_changes: list[str] = all_changes) -> None:
+        super().calculate(atoms, properties, system_changes)
+
+        energy, forces = self.evaluator.evaluate(self.atoms)
+        self.results = {
+            "energy": energy,
+            "free_energy": energy,
+            "forces": forces,
+        }
+
+
+class BatchedRelaxationWorker(RelaxationWorker):
+    """
+    Worker that relaxes up to batch_size jobs at the same time, evaluating them with one forward pass of the model.
+
+    Every job keeps its own optimizer and converges on its own,
+        finished jobs leave the batch and are replaced with new jobs from the task queue.
+    Small structures leave most of the model throughput unused, so batching them gives more structures per core-hour.
+    Only jobs with the same model and dtype are batched together, every loaded model has its own BatchEvaluator.
+    """
+    def __init__(self,
+                 calculator_registry: CalculatorRegistry,
+                 task_queue: 'ReceiveChannel[Job]',
+                 message_queue: 'SendChannel[JobEvent]',
+                 drain_event: Event,
+                 batch_size: int,
+                 batch_timeout: float = 0.05,
+                 checkpoint_interval: int = 10,
+                 max_models: int = 2) -> None:
+        # lease slots are created by the base worker
+        self.batch_size = batch_size
+        super().__init__(calculator_registry, task_queue, message_queue, drain_event, checkpoint_interval, max_models)
+        self.batch_timeout = batch_timeout
+
+        # calculator of every evaluator, by (model, dtype)
+        self._evaluators: dict[tuple[str, str], tuple[Calculator, BatchEvaluator]] = {}
+        # models are loaded by the relaxation threads
+        self._models_lock = Lock()
+
+    @property
+    def slots(self) -> int:
+        return self.batch_size
+
+    def run(self) -> None:
+        self._load_default_calculator()
+
+        relaxations: list[Thread] = []
+
+        while True:
+            relaxations = [relaxation for relaxation in relaxations if relaxation.is_alive()]
+
+            # running relaxations stop themselves after the drain, see RelaxationWorker
+            stopping = self._stopping()
+            if stopping and not relaxations:
+                break
+
+            self._beat()
+            self._apply_num_threads()
+
+            # block only if there is nothing to relax, otherwise take what is already queued
+            while not stopping and len(relaxations) < self.batch_size:
+                try:
+                    job = self._take_job(block=not relaxations, timeout=1.0)
+                except queue.Empty:
+                    break
+
+                relaxation = Thread(target=self._run_job, args=(job,), daemon=True)
+                relaxation.start()
+                relaxations.append(relaxation)
+
+            # not under the lock, a relaxation may be loading a model for a long time
+            evaluators = [evaluator for _, evaluator in list(self._evaluators.values()) if evaluator.participants]
+
+            for evaluator in evaluators:
+                evaluator.run_batch(timeout=self.batch_timeout)
+
+            if not evaluators:
+                # relaxations are still loading their models
+                time.sleep(self.batch_timeout)
+
+        logger.info("Worker stopped")
+
+    @contextmanager
+    def _calculator(self, model: str | None, dtype: str | None) -> Iterator[Calculator]:
+        """The relaxation takes part in the batches of the model until the stage is finished"""
+        with self._models_lock:
+            evaluator = self._get_evaluator(model, dtype)
+            evaluator.join()
+
+        try:
+            yield BatchedCalculator(evaluator)
+        finally:
+            evaluator.leave()
+
+    def _get_evaluator(self, model: str | None, dtype: str | None) -> BatchEvaluator:
+        factory = self.calculator_registry.get(model, dtype)
+        key = (factory.model, factory.dtype)
+        calculator = self._load_calculator(factory)
+
+        # evaluators of the unloaded models are dropped after their last relaxation is finished,
+        #   so the memory of the model is freed
+        for other_key, (other_calculator, evaluator) in list(self._evaluators.items()):
+            if self._calculators.get(other_key) is not other_calculator and not evaluator.participants:
+                del self._evaluators[other_key]
+
+        # if the model was unloaded and loaded again while its relaxations were running,
+        #   the old instance is used until all of them are finished
+        if key not in self._evaluators:
+            self._evaluators[key] = (calculator, BatchEvaluator(partial(evaluate_batch, factory, calculator)))
+
+        return self._evaluators[key][1]
@@ -0,0 +1,80 @@
+import asyncio
+from collections import defaultdict
+from threading import Lock
+
+from .events import JobEvent
+
+
+class JobSubscription:
+    """
+    Events of a single job delivered to an asyncio consumer.
+
+    The queue is bounded, so a consumer that can't keep up is marked as overflowed
+        and should reconnect, replaying missed steps from the repository.
+    """
+    def __init__(self, job_id: str, loop: asyncio.AbstractEventLoop, max_size: int) -> None:
+        self.job_id = job_id
+        self.overflowed = False
+
+        self._loop = loop
+        self._queue: asyncio.Queue[JobEvent] = asyncio.Queue(max_size)
+
+    def put_threadsafe(self, event: JobEvent) -> None:
+        try:
+            self._loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            # event loop is already closed, nobody is listening anymore
+            pass
+
+    async def get(self, timeout: float) -> JobEvent | None:
+        """Wait for the next event, None if there were no events for timeout seconds"""
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def _put(self, event: JobEvent) -> None:
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+
+class JobEventBroadcaster:
+    """Fans out events applied by the message listener to the subscribers of the job"""
+    def __init__(self, max_queue_size: int = 1000) -> None:
+        self.max_queue_size = max_queue_size
+
+        self._subscriptions: dict[str, set[JobSubscription]] = defaultdict(set)
+        self._lock = Lock()
+
+    def subscribe(self, job_id: str) -> JobSubscription:
+        """Should be called from the event loop that will consume the events"""
+        subscription = JobSubscription(job_id, asyncio.get_running_loop(), self.max_queue_size)
+
+        with self._lock:
+            self._subscriptions[job_id].add(subscription)
+
+        return subscription
+
+    def unsubscribe(self, subscription: JobSubscription) -> None:
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.job_id)
+            if subscriptions is None:
+                return
+
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscriptions[subscription.job_id]
+
+    def job_ids(self) -> list[str]:
+        """Jobs that have subscribers"""
+        with self._lock:
+            return list(self._subscriptions)
+
+    def publish(self, event: JobEvent) -> None:
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(event["job_id"], ()))
+
+        for subscription in subscriptions:
+            subscription.put_threadsafe(event)
@@ -0,0 +1,162 @@
+from typing import TYPE_CHECKING, TypedDict
+
+import numpy as np
+import numpy.typing as npt
+from ase import Atoms
+
+# scipy is imported by the functions that use it, the trajectory store imports this module in the API process
+if TYPE_CHECKING:
+    from ase.optimize.precon import PreconLBFGS
+
+
+class Checkpoint(TypedDict):
+    """State of the relaxation after the step, enough to continue it as if it was never interrupted"""
+    step: int
+    positions: npt.NDArray[np.float64]
+
+    # stage of the staged relaxation, the step it started after and the shift of its energies, see RelaxationWorker
+    stage: int
+    stage_start_step: int
+    energy_offset: float
+    # wall time the job has run for, it counts towards the wall time budget of the resumed job
+    elapsed_seconds: float
+
+    # PreconLBFGS state: the number of steps taken and the inverse Hessian history
+    nsteps: int
+    iteration: int
+    s: npt.NDArray[np.float64]
+    y: npt.NDArray[np.float64]
+    rho: npt.NDArray[np.float64]
+    r0: npt.NDArray[np.float64]
+    f0: npt.NDArray[np.float64]
+    e0: float | None
+    e1: float | None
+    just_reset_hessian: bool
+
+    # Exp preconditioner state: its parameters are estimated from the initial structure
+    # and the matrix is rebuilt only after large displacements, so both depend on the history
+    precon_r_NN: float
+    precon_r_cut: float
+    precon_mu: float
+    precon_mu_c: float | None
+    # empty until the matrix is checked for the rebuild for the first time
+    precon_old_positions: npt.NDArray[np.float64]
+    precon_data: npt.NDArray[np.float64]
+    precon_indices: npt.NDArray[np.int32]
+    precon_indptr: npt.NDArray[np.int32]
+
+
+# optional float values are stored as NaN
+_OPTIONAL_FLOATS = ("e0", "e1", "precon_mu_c")
+
+
+def capture_checkpoint(optimizer: 'PreconLBFGS',
+                       atoms: Atoms,
+                       step: int,
+                       stage: int = 0,
+                       stage_start_step: int = 0,
+                       energy_offset: float = 0.0,
+                       elapsed_seconds: float = 0.0) -> Checkpoint | None:
+    """Returns None if the optimizer hasn't taken a step yet (there is nothing to save)"""
+    from scipy import sparse
+
+    if optimizer.nsteps == 0 or optimizer.r0 is None:
+        return None
+
+    n_coordinates = optimizer.r0.size
+    precon = optimizer.precon
+    matrix = sparse.csr_matrix(precon.P)
+
+    return Checkpoint(
+        step=step,
+        positions=atoms.get_positions(),
+        stage=stage,
+        stage_start_step=stage_start_step,
+        energy_offset=energy_offset,
+        elapsed_seconds=elapsed_seconds,
+        nsteps=optimizer.nsteps,
+        iteration=optimizer.iteration,
+        s=np.array(optimizer.s).reshape(-1, n_coordinates),
+        y=np.array(optimizer.y).reshape(-1, n_coordinates),
+        rho=np.array(optimizer.rho, dtype=np.float64),
+        r0=np.array(optimizer.r0),
+        f0=np.array(optimizer.f0),
+        e0=optimizer.e0,
+        e1=optimizer.e1,
+        just_reset_hessian=optimizer._just_reset_hessian,
+        precon_r_NN=precon.r_NN,
+        precon_r_cut=precon.r_cut,
+        precon_mu=precon.mu,
+        precon_mu_c=precon.mu_c,
+        precon_old_positions=np.empty(0) if precon.old_positions is None else np.array(precon.old_positions),
+        precon_data=matrix.data,
+        precon_indices=matrix.indices,
+        precon_indptr=matrix.indptr,
+    )
+
+
+def restore_checkpoint(optimizer: 'PreconLBFGS', checkpoint: Checkpoint) -> None:
+    """Positions of the atoms are expected to be restored already"""
+    from scipy import sparse
+
+    optimizer.nsteps = checkpoint["nsteps"]
+    optimizer.iteration = checkpoint["iteration"]
+    optimizer.s = list(checkpoint["s"])
+    optimizer.y = list(checkpoint["y"])
+    optimizer.rho = list(checkpoint["rho"])
+    optimizer.r0 = checkpoint["r0"]
+    optimizer.f0 = checkpoint["f0"]
+    optimizer.e0 = checkpoint["e0"]
+    optimizer.e1 = checkpoint["e1"]
+    optimizer._just_reset_hessian = checkpoint["just_reset_hessian"]
+
+    precon = optimizer.precon
+    precon.r_NN = checkpoint["precon_r_NN"]
+    precon.r_cut = checkpoint["precon_r_cut"]
+    precon.mu = checkpoint["precon_mu"]
+    precon.mu_c = checkpoint["precon_mu_c"]
+    precon.old_positions = checkpoint["precon_old_positions"] if checkpoint["precon_old_positions"].size else None
+    precon.P = sparse.csr_matrix(
+        (checkpoint["precon_data"], checkpoint["precon_indices"], checkpoint["precon_indptr"]),
+        shape=(checkpoint["r0"].size, checkpoint["r0"].size),
+    )
+    precon.create_solver()
+
+
+def save_checkpoint(path: str, checkpoint: Checkpoint) -> None:
+    with open(path, "wb") as file:
+        np.savez(
+            file,
+            **{key: value for key, value in checkpoint.items() if key not in _OPTIONAL_FLOATS},
+            **{key: np.nan if checkpoint[key] is None else checkpoint[key] for key in _OPTIONAL_FLOATS},
+        )
+
+
+def load_checkpoint(path: str) -> Checkpoint:
+    with np.load(path) as data:
+        optional = {key: float(data[key]) for key in _OPTIONAL_FLOATS}
+
+        return Checkpoint(
+            step=int(data["step"]),
+            positions=data["positions"],
+            stage=int(data["stage"]),
+            stage_start_step=int(data["stage_start_step"]),
+            energy_offset=float(data["energy_offset"]),
+            elapsed_seconds=float(data["elapsed_seconds"]),
+            nsteps=int(data["nsteps"]),
+            iteration=int(data["iteration"]),
+            s=data["s"],
+            y=data["y"],
+            rho=data["rho"],
+            r0=data["r0"],
+            f0=data["f0"],
+            just_reset_hessian=bool(data["just_reset_hessian"]),
+            precon_r_NN=float(data["precon_r_NN"]),
+            precon_r_cut=float(data["precon_r_cut"]),
+            precon_mu=float(data["precon_mu"]),
+            precon_old_positions=data["precon_old_positions"],
+            precon_data=data["precon_data"],
+            precon_indices=data["precon_indices"],
+            precon_indptr=data["precon_indptr"],
+            **{key: None if np.isnan(value) else value for key, value in optional.items()},
+        )
@@ -0,0 +1,410 @@
+import multiprocessing
+import queue
+import threading
+import time
+from typing import cast
+
+from logger import logger
+from utils.calculator_factory import CalculatorRegistry
+from utils.metrics import registry
+from .batched_worker import BatchedRelaxationWorker
+from .broadcaster import JobEventBroadcaster
+from .events import JobEvent, JobEventType, JobStatusEvent
+from .job import FINAL_STATUSES, Job, JobStatus
+from .metrics import (
+    EVENTS,
+    MESSAGE_BYTES,
+    MESSAGE_LATENCY_SECONDS,
+    REPOSITORY_UPDATE_SECONDS,
+    STEP_MODEL_SECONDS,
+    STEP_OPTIMIZER_SECONDS,
+)
+from .repository.abstract import AbstractRelaxationJobRepository
+from .retention import RetentionManager
+from .scheduler import JobSchedule, JobScheduler
+from .trajectory_store import TrajectoryNotFound, TrajectoryStore
+from .transport.abstract import AbstractJobTransport
+from .transport.local import LocalJobTransport
+from .worker import RelaxationWorker
+from .worker_pool import WorkerPool
+
+
+# Limits the size of a single repository write from the message listener
+_MAX_EVENTS_PER_WRITE = 256
+
+
+class JobDispatcher:
+    """
+    Relaxes prepared (pending) jobs: schedules them, runs the workers and applies their events to the repository.
+
+    Runs either in the API process, which submits its jobs directly (see RelaxationService),
+        or in its own process (see commands.dispatcher), then new jobs are found by polling the shared repository
+        every poll_interval seconds, they are created by the web processes.
+    Jobs that the web processes leave in the FETCHING status for fetch_timeout seconds
+        (e.g. the process was restarted while fetching the structure) fail.
+    Jobs go to the workers through the transport, local by default, remote workers of the TCP transport
+        add their capacity to the pool and their lost jobs are requeued like the jobs of the dead local workers.
+    Cancelled jobs are removed from the queue or stopped by their workers,
+        jobs cancelled by the web processes are found by the poller too.
+    """
+    def __init__(self,
+                 repository: AbstractRelaxationJobRepository,
+                 calculator_registry: CalculatorRegistry,
+                 trajectory_store: TrajectoryStore,
+                 retention_manager: RetentionManager,
+                 broadcaster: JobEventBroadcaster,
+                 min_workers: int,
+                 max_workers: int,
+                 batch_size: int = 1,
+                 checkpoint_interval: int = 10,
+                 drain_timeout: float = 30.0,
+                 cpu_budget: int | None = None,
+                 worker_idle_timeout: float = 300.0,
+                 worker_heartbeat_timeout: float = 600.0,
+                 worker_max_models: int = 2,
+                 poll_interval: float | None = None,
+                 fetch_timeout: float = 600.0,
+                 transport: AbstractJobTransport | None = None) -> None:
+        self.repository = repository
+        self.calculator_registry = calculator_registry
+        self.trajectory_store = trajectory_store
+        self.retention_manager = retention_manager
+        self.broadcaster = broadcaster
+        self.transport = transport or LocalJobTransport()
+        # every worker relaxes up to batch_size jobs at the same time, the pool updates the capacity
+        self.scheduler = JobScheduler(self.transport.task_queue, capacity=min_workers * batch_size)
+
+        self.batch_size = batch_size
+        self.checkpoint_interval = checkpoint_interval
+        self.drain_timeout = drain_timeout
+        self.worker_max_models = worker_max_models
+        self.poll_interval = poll_interval
+        self.fetch_timeout = fetch_timeout
+        # set on shutdown, workers checkpoint and stop their jobs
+        self.drain_event = multiprocessing.Event()
+
+        # when the poller saw the job in the FETCHING status for the first time
+        self._fetching_since: dict[str, float] = {}
+        # cancelled jobs that their workers have not stopped yet
+        self._cancelling: set[str] = set()
+
+        self.worker_pool = WorkerPool(
+            worker_factory=self._create_worker,
+            scheduler=self.scheduler,
+            transport=self.transport,
+            drain_event=self.drain_event,
+            min_workers=min_workers,
+            max_workers=max_workers,
+            jobs_per_worker=batch_size,
+            cpu_budget=cpu_budget,
+            idle_timeout=worker_idle_timeout,
+            heartbeat_timeout=worker_heartbeat_timeout,
+        )
+        self.worker_pool.add_lost_worker_listener(self._requeue_worker_jobs)
+        self.transport.add_lost_job_listener(self._requeue_lost_job)
+
+        self._shutdown_flag = False
+        self._stop_event = threading.Event()
+
+        registry.gauge("relaxation_workers", "Number of running workers", lambda: self.worker_pool.size)
+        registry.gauge(
+            "relaxation_jobs_waiting", "Number of jobs waiting for a worker", lambda: self.scheduler.load()[0]
+        )
+        registry.gauge(
+            "relaxation_jobs_dispatched", "Number of jobs dispatched to the workers", lambda: self.scheduler.load()[1]
+        )
+
+        self.transport.start()
+        self.worker_pool.start()
+
+        self._recover_jobs()
+        self.scheduler.start()
+
+        self._message_listener = self._start_message_listener()
+        self.retention_manager.start()
+
+        self._poller: threading.Thread | None = None
+        if self.poll_interval is not None:
+            self._poller = threading.Thread(target=self._poll_repository, daemon=True)
+            self._poller.start()
+
+    def _create_worker(self) -> RelaxationWorker:
+        if self.batch_size > 1:
+            return BatchedRelaxationWorker(
+                self.calculator_registry,
+                self.transport.task_queue,
+                self.transport.message_queue,
+                self.drain_event,
+                self.batch_size,
+                checkpoint_interval=self.checkpoint_interval,
+                max_models=self.worker_max_models,
+            )
+
+        return RelaxationWorker(
+            self.calculator_registry,
+            self.transport.task_queue,
+            self.transport.message_queue,
+            self.drain_event,
+            checkpoint_interval=self.checkpoint_interval,
+            max_models=self.worker_max_models,
+        )
+
+    def submit(self, job: Job) -> None:
+        """Job has to be stored in the repository in the PENDING status"""
+        self.scheduler.submit(job)
+        logger.info(f"Job added to processing queue (job {job['id']})")
+
+    def get_schedule(self, job: Job) -> JobSchedule:
+        return self.scheduler.schedule(job)
+
+    def requeue_job(self, job_id: str) -> None:
+        """Put the unfinished job back to the queue, it is resumed from its last checkpoint if there is one"""
+        job = self.repository.get(job_id)
+        if job["status"] in FINAL_STATUSES:
+            # e.g. the job was cancelled, its lost worker will not report it stopped
+            self.scheduler.job_done(job_id, finished=False)
+            self._cancelling.discard(job_id)
+            self.retention_manager.record_size(job_id)
+            return
+
+        try:
+            checkpoint = self.trajectory_store.get(job_id).read_checkpoint()
+        except TrajectoryNotFound:
+            checkpoint = None
+
+        event = JobStatusEvent(type=JobEventType.STATUS, job_id=job_id, status=JobStatus.PENDING)
+        self.repository.apply_events([event])
+        self.broadcaster.publish(event)
+
+        # the job in the repository stays without the checkpoint, it is only for the worker
+        task = cast(Job, {**job})
+        if checkpoint is not None:
+            task["checkpoint"] = checkpoint
+
+        self.scheduler.requeue(task)
+
+        step = checkpoint["step"] if checkpoint is not None else 0
+        logger.info(f"Job requeued, resuming from step {step} (job {job_id})")
+
+    def cancel_job(self, job_id: str) -> None:
+        """Job has to be cancelled in the repository, it is removed from the queue or stopped by its worker"""
+        if self.scheduler.cancel(job_id):
+            logger.info(f"Job removed from processing queue (job {job_id})")
+            return
+
+        # the worker has already ended the job
+        if not self.scheduler.scheduled(job_id):
+            return
+
+        # a job that no worker has taken yet is stopped when its worker reports it running
+        self._cancelling.add(job_id)
+        self._send_cancel(job_id)
+
+    def _send_cancel(self, job_id: str) -> None:
+        self.worker_pool.cancel_job(job_id)
+        self.transport.cancel(job_id)
+
+    def _fail_job(self, job_id: str, error: str) -> None:
+        event = JobStatusEvent(type=JobEventType.STATUS, job_id=job_id, status=JobStatus.FAILED, error=error)
+        self.repository.apply_events([event])
+        self.broadcaster.publish(event)
+
+    def _recover_jobs(self) -> None:
+        """Jobs that were pending or running when the dispatcher stopped are requeued (persistent repositories only)"""
+        job_ids = self.repository.get_ids_by_status(JobStatus.PENDING, JobStatus.RUNNING)
+        if job_ids:
+            logger.info(f"Recovering {len(job_ids)} unfinished jobs")
+
+        for job_id in job_ids:
+            try:
+                self.requeue_job(job_id)
+            except Exception as e:
+                logger.exception(f"Error recovering job: {e} (job {job_id})")
+
+    def _poll_repository(self) -> None:
+        while not self._stop_event.wait(self.poll_interval):
+            try:
+                self._submit_new_jobs()
+                self._cancel_jobs()
+                self._fail_stale_jobs()
+            except Exception as e:
+                logger.exception(f"Error polling repository for new jobs: {e}")
+
+    def _submit_new_jobs(self) -> None:
+        for job_id in self.repository.get_ids_by_status(JobStatus.PENDING):
+            # the job is read after the check, so a job that has just left the scheduler is already finished
+            if self.scheduler.scheduled(job_id):
+                continue
+
+            job = self.repository.get(job_id)
+            if job["status"] == JobStatus.PENDING:
+                self.submit(job)
+
+    def _cancel_jobs(self) -> None:
+        """Scheduled jobs that the web processes have cancelled, only the few scheduled jobs are checked"""
+        job_ids = self.scheduler.job_ids()
+        # e.g. the job was done before the cancel was sent to its worker
+        self._cancelling.intersection_update(job_ids)
+
+        unfinished = set(self.repository.get_ids_by_status(JobStatus.PENDING, JobStatus.RUNNING))
+        for job_id in job_ids:
+            if job_id in unfinished or job_id in self._cancelling:
+                continue
+
+            # the job may also be finished, its slot is freed by the message listener
+            if self.repository.get(job_id)["status"] == JobStatus.CANCELLED:
+                self.cancel_job(job_id)
+
+    def _fail_stale_jobs(self) -> None:
+        now = time.monotonic()
+        job_ids = self.repository.get_ids_by_status(JobStatus.FETCHING)
+
+        self._fetching_since = {job_id: self._fetching_since.get(job_id, now) for job_id in job_ids}
+        for job_id, since in list(self._fetching_since.items()):
+            if now - since > self.fetch_timeout:
+                logger.warning(f"Structure was not fetched in {self.fetch_timeout:.0f} s (job {job_id})")
+                self._fail_job(job_id, "Structure was not fetched in time, create the job again")
+                del self._fetching_since[job_id]
+
+    def _requeue_worker_jobs(self, job_ids: list[str]) -> None:
+        """Jobs leased to the lost worker are resumed by another one"""
+        for job_id in job_ids:
+            try:
+                self.requeue_job(job_id)
+            except Exception as e:
+                logger.exception(f"Error requeuing job: {e} (job {job_id})")
+
+    def _requeue_lost_job(self, job_id: str) -> None:
+        """Job of a remote worker is resumed by another worker"""
+        try:
+            self.requeue_job(job_id)
+        except Exception as e:
+            logger.exception(f"Error requeuing job: {e} (job {job_id})")
+
+    def _start_message_listener(self) -> threading.Thread:
+        logger.info("Starting message listener")
+        thread = threading.Thread(target=self._listen_for_updates, daemon=True)
+        thread.start()
+        return thread
+
+    def _listen_for_updates(self) -> None:
+        while True:
+            try:
+                events = [self.transport.message_queue.get(timeout=1.0)]
+            except queue.Empty:
+                # events sent by the draining workers are processed before the listener stops
+                if self._shutdown_flag:
+                    return
+                continue
+
+            # take everything that is already queued, so the repository can write it at once
+            while len(events) < _MAX_EVENTS_PER_WRITE:
+                try:
+                    events.append(self.transport.message_queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            # job ID and whether the job was finished (not failed or stopped)
+            done_jobs = [
+                (event["job_id"], event["type"] == JobEventType.SUMMARY) for event in events
+                if event["type"] == JobEventType.SUMMARY
+                or (event["type"] == JobEventType.STATUS and event["status"] in FINAL_STATUSES)
+            ]
+
+            self._observe_events(events)
+            self._resend_cancels(events)
+
+            # positions go to the trajectory before the step appears in the job,
+            #   so readers of the job always find the positions of its steps
+            self._write_trajectories(events)
+
+            # checkpoints are stored with the trajectory only, they don't change the job
+            events = [event for event in events if event["type"] != JobEventType.CHECKPOINT]
+
+            try:
+                with REPOSITORY_UPDATE_SECONDS.time():
+                    self.repository.apply_events(events)
+            except Exception as e:
+                logger.exception(f"Error applying {len(events)} events, applying one by one: {e}")
+                events = self._apply_events_one_by_one(events)
+
+            for event in events:
+                self.broadcaster.publish(event)
+
+            # slots are freed even if the events could not be applied, the workers are done with the jobs anyway
+            for job_id, finished in done_jobs:
+                self.scheduler.job_done(job_id, finished)
+                self._cancelling.discard(job_id)
+                self.retention_manager.record_size(job_id)
+
+    @staticmethod
+    def _observe_events(events: list[JobEvent]) -> None:
+        now = time.time()
+        for event in events:
+            EVENTS.inc(event["type"].value)
+            if "sent_at" in event:
+                MESSAGE_LATENCY_SECONDS.observe(now - event["sent_at"])
+            if "message_bytes" in event:
+                MESSAGE_BYTES.observe(event["message_bytes"])
+            if event["type"] == JobEventType.STEP and "model_seconds" in event:
+                STEP_MODEL_SECONDS.observe(event["model_seconds"])
+                STEP_OPTIMIZER_SECONDS.observe(event["optimizer_seconds"])
+
+    def _resend_cancels(self, events: list[JobEvent]) -> None:
+        """Cancelled jobs that were waiting for a worker are stopped once the worker starts them"""
+        for event in events:
+            if (
+                event["type"] == JobEventType.STATUS
+                and event["status"] == JobStatus.RUNNING
+                and event["job_id"] in self._cancelling
+            ):
+                self._send_cancel(event["job_id"])
+
+    def _write_trajectories(self, events: list[JobEvent]) -> None:
+        for event in events:
+            try:
+                if event["type"] == JobEventType.STEP:
+                    self.trajectory_store.write_step(
+                        event["job_id"], event["step"], event["positions"], event["energy"], event["force"]
+                    )
+                elif event["type"] == JobEventType.CHECKPOINT:
+                    self.trajectory_store.get(event["job_id"]).write_checkpoint(event["checkpoint"])
+            except Exception as e:
+                logger.exception(f"Error writing {event['type']} event to the trajectory: {e} (job {event['job_id']})")
+
+    def _apply_events_one_by_one(self, events: list[JobEvent]) -> list[JobEvent]:
+        """Returns events that were applied"""
+        applied = []
+        for event in events:
+            try:
+                self.repository.apply_events([event])
+                applied.append(event)
+            except Exception as e:
+                logger.exception(f"Error applying {event['type']} event: {e} (job {event['job_id']})")
+
+        return applied
+
+    def shutdown(self) -> None:
+        logger.info("Stopping repository poller")
+        self._stop_event.set()
+        if self._poller is not None:
+            self._poller.join(timeout=10.0)
+
+        logger.info("Stopping job scheduler")
+        self.scheduler.stop()
+
+        logger.info("Stopping retention manager")
+        self.retention_manager.stop()
+
+        logger.info("Draining workers")
+        # remote workers are drained at the same time as the local ones
+        remote_drain = threading.Thread(target=self.transport.stop, args=(self.drain_timeout,), daemon=True)
+        remote_drain.start()
+        self.worker_pool.stop(timeout=self.drain_timeout)
+        remote_drain.join()
+        logger.info("Workers drained")
+
+        logger.info("Shutting message listener")
+        self._shutdown_flag = True
+        self._message_listener.join(timeout=10.0)
+        logger.info("Message listener shut down")
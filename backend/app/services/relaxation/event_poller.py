@@ -0,0 +1,95 @@
+import threading
+
+from logger import logger
+from .broadcaster import JobEventBroadcaster
+from .events import JobEvent, JobEventType, JobStatusEvent, JobStepEvent, JobSummaryEvent
+from .job import Job, JobStatus
+from .repository.abstract import AbstractRelaxationJobRepository, JobNotFound
+from .trajectory_store import TrajectoryStore
+
+
+class RepositoryEventPoller:
+    """
+    Publishes the events of the subscribed jobs in the processes that don't run the dispatcher.
+
+    The dispatcher publishes the events it applies only in its own process,
+        so the changes of the subscribed jobs are read from the shared repository every interval seconds.
+    Steps taken between two polls are published as a single event of the last step,
+        subscribers read the skipped steps from the job.
+    """
+    def __init__(self,
+                 repository: AbstractRelaxationJobRepository,
+                 trajectory_store: TrajectoryStore,
+                 broadcaster: JobEventBroadcaster,
+                 interval: float = 0.5) -> None:
+        self.repository = repository
+        self.trajectory_store = trajectory_store
+        self.broadcaster = broadcaster
+        self.interval = interval
+
+        # status and number of steps of every subscribed job at the previous poll
+        self._seen: dict[str, tuple[str, int]] = {}
+        self._stop_event = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        logger.info("Starting event poller")
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10.0)
+
+    def poll(self) -> None:
+        job_ids = self.broadcaster.job_ids()
+        self._seen = {job_id: seen for job_id, seen in self._seen.items() if job_id in job_ids}
+
+        for job_id in job_ids:
+            try:
+                job = self.repository.get(job_id)
+            except JobNotFound:
+                continue
+
+            for event in self._events(job):
+                self.broadcaster.publish(event)
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                logger.exception(f"Error polling events: {e}")
+
+    def _events(self, job: Job) -> list[JobEvent]:
+        """
+        Events of the changes since the previous poll.
+
+        The subscriber may have missed changes before the first poll, so the first poll publishes the current state.
+        """
+        job_id = job["id"]
+        status, steps = job["status"], len(job["forces"])
+        previous_status, previous_steps = self._seen.get(job_id, ("", 0))
+        self._seen[job_id] = (status, steps)
+
+        events: list[JobEvent] = []
+        if steps > previous_steps:
+            events.append(JobStepEvent(
+                type=JobEventType.STEP,
+                job_id=job_id,
+                step=steps,
+                energy=job["energies"][steps - 1],
+                force=job["forces"][steps - 1],
+                positions=self.trajectory_store.get(job_id).positions[steps - 1],
+            ))
+
+        if status != previous_status:
+            if status == JobStatus.FINISHED:
+                events.append(JobSummaryEvent(
+                    type=JobEventType.SUMMARY, job_id=job_id, status=status, energies=job["energies"]
+                ))
+            else:
+                events.append(JobStatusEvent(type=JobEventType.STATUS, job_id=job_id, status=status))
+
+        return events
@@ -0,0 +1,100 @@
+import enum
+from typing import Literal, NotRequired, TypedDict
+
+import numpy as np
+import numpy.typing as npt
+
+from .checkpoint import Checkpoint
+from .job import FINAL_STATUSES, Job, JobStatus
+
+
+class JobEventType(str, enum.Enum):
+    STATUS = "STATUS"
+    STEP = "STEP"
+    SUMMARY = "SUMMARY"
+    CHECKPOINT = "CHECKPOINT"
+
+
+class _EventStamp(TypedDict):
+    """Set by the worker when the event is sent, for the metrics of the message queue"""
+    sent_at: NotRequired[float]
+    # set on a sample of the events only, see RelaxationWorker._send
+    message_bytes: NotRequired[int]
+
+
+class JobStatusEvent(_EventStamp):
+    """Job has changed its status"""
+    type: Literal[JobEventType.STATUS]
+    job_id: str
+    status: str
+    # reason of the failure, if it is known
+    error: NotRequired[str]
+
+
+class JobStepEvent(_EventStamp):
+    """
+    Single optimizer step, size of the event does not depend on the step number.
+
+    Positions are written to the trajectory store, the job keeps only the energy and force.
+    """
+    type: Literal[JobEventType.STEP]
+    job_id: str
+    step: int
+    energy: float
+    force: float
+    positions: npt.NDArray[np.float64]
+    # time spent in the model and in the optimizer since the previous step
+    model_seconds: NotRequired[float]
+    optimizer_seconds: NotRequired[float]
+
+
+class JobSummaryEvent(_EventStamp):
+    """Final results of the relaxation, sent once"""
+    type: Literal[JobEventType.SUMMARY]
+    job_id: str
+    status: str
+    energies: list[float]
+
+
+class JobCheckpointEvent(_EventStamp):
+    """Optimizer state to resume the job from, it is stored with the trajectory and does not change the job"""
+    type: Literal[JobEventType.CHECKPOINT]
+    job_id: str
+    checkpoint: Checkpoint
+
+
+JobEvent = JobStatusEvent | JobStepEvent | JobSummaryEvent | JobCheckpointEvent
+
+
+def apply_event(job: Job, event: JobEvent) -> None:
+    """
+    Apply progress event to the job in place.
+
+    Workers send only what has changed since the previous event,
+        so the whole history is assembled here instead of being pickled over and over again.
+    """
+    # the job may be cancelled while its worker is still sending its events, its steps and progress stay as they were
+    if job["status"] in FINAL_STATUSES:
+        return
+
+    if event["type"] == JobEventType.STATUS:
+        job["status"] = event["status"]
+        if event["status"] == JobStatus.FAILED:
+            job["progress"] = 100
+        if "error" in event:
+            job["error"] = event["error"]
+
+    elif event["type"] == JobEventType.STEP:
+        step = event["step"]
+        # the same event may be delivered again, e.g. after a failed batch write
+        if step <= len(job["forces"]):
+            return
+
+        job["energies"].append(event["energy"])
+        job["forces"].append(event["force"])
+        job["progress"] = step / job["max_steps"]
+
+    elif event["type"] == JobEventType.SUMMARY:
+        job["energies"] = event["energies"]
+        job["status"] = event["status"]
+        job["progress"] = 1
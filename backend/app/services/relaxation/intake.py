@@ -0,0 +1,91 @@
+import queue
+import threading
+from dataclasses import dataclass
+from typing import Callable
+
+from logger import logger
+from .job import Job
+from .metrics import INTAKE_REJECTED
+
+
+class IntakeQueueFull(Exception):
+    pass
+
+
+@dataclass
+class IntakeTask:
+    job: Job
+    # the job stores only the hash of the API key, the key itself is kept in memory until the structure is fetched
+    mpr_api_key: str
+
+
+class JobIntake:
+    """
+    Prepares new jobs in the background, so creating a job does not wait for the structure source.
+
+    Up to concurrency jobs are prepared at the same time (the structure is fetched and the slab is built),
+        up to max_pending jobs wait for their turn.
+    When the backlog is full, new jobs are rejected with IntakeQueueFull,
+        so a burst of submissions is pushed back to the clients instead of piling up here.
+    """
+    def __init__(self, handler: Callable[[IntakeTask], None], concurrency: int = 4, max_pending: int = 100) -> None:
+        if concurrency < 1 or max_pending < 1:
+            raise ValueError(f"Invalid intake limits: concurrency {concurrency}, max pending {max_pending}")
+
+        self.handler = handler
+        self.concurrency = concurrency
+        self.max_pending = max_pending
+
+        self._queue: queue.Queue[IntakeTask] = queue.Queue(maxsize=max_pending)
+        # number of jobs being prepared right now
+        self._active = 0
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._threads: list[threading.Thread] = []
+
+    @property
+    def pending(self) -> int:
+        """Number of jobs waiting for their turn and being prepared"""
+        with self._lock:
+            return self._queue.qsize() + self._active
+
+    def submit(self, task: IntakeTask) -> None:
+        """The job has to be stored before it is submitted, raises IntakeQueueFull"""
+        try:
+            self._queue.put_nowait(task)
+        except queue.Full:
+            INTAKE_REJECTED.inc()
+            raise IntakeQueueFull(f"{self.max_pending} jobs are already waiting for their structures")
+
+    def start(self) -> None:
+        logger.info(f"Starting job intake with {self.concurrency} threads")
+        for _ in range(self.concurrency):
+            thread = threading.Thread(target=self._run, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self) -> None:
+        """Jobs that are still waiting are left as they are, see RelaxationService._fail_interrupted_jobs"""
+        self._stop_event.set()
+        for thread in self._threads:
+            thread.join(timeout=10.0)
+
+        self._threads = []
+
+    def _run(self) -> None:
+        while not self._stop_event.is_set():
+            try:
+                task = self._queue.get(timeout=1.0)
+            except queue.Empty:
+                continue
+
+            with self._lock:
+                self._active += 1
+
+            try:
+                self.handler(task)
+            except Exception as e:
+                logger.exception(f"Error preparing job: {e} (job {task.job['id']})")
+            finally:
+                with self._lock:
+                    self._active -= 1
@@ -1,12 +1,30 @@
 import enum
-from typing import TypedDict, Any
+from typing import NotRequired, TypedDict, Any
+
+from .checkpoint import Checkpoint
 
 
 class JobStatus(str, enum.Enum):
+    # structure of the job is being fetched, see JobIntake
+    FETCHING = "FETCHING"
     PENDING = "PENDING"
     RUNNING = "RUNNING"
     FINISHED = "FINISHED"
     FAILED = "FAILED"
+    # stopped before it was finished, steps taken until then are kept
+    CANCELLED = "CANCELLED"
+    TIMED_OUT = "TIMED_OUT"
+
+
+# Statuses after which the job is not going to change anymore
+FINAL_STATUSES = frozenset({JobStatus.FINISHED, JobStatus.FAILED, JobStatus.CANCELLED, JobStatus.TIMED_OUT})
+
+
+class Prerelaxation(TypedDict):
+    """Cheaper stage the job is relaxed with to the looser fmax before the model of the job"""
+    model: str
+    dtype: str
+    fmax: float
 
 
 class Job(TypedDict):
@@ -16,17 +34,36 @@ class Job(TypedDict):
     # Fields that store data for calculations
     fmax: float
     max_steps: int
+    # wall time budget of the relaxation in seconds, the job is stopped when it runs longer (None is unlimited)
+    max_seconds: float | None
+    # calculator the job is relaxed with, see CalculatorRegistry
+    model: str
+    dtype: str
+    prerelaxation: Prerelaxation | None
 
-    # Fields that are used to create the job
-    chemical_formula: str
-    atoms: dict[str, Any]
-    atoms_slab: dict[str, Any]
-    step_atoms: dict[int, dict[str, Any]]
+    # Fields that are used to create the job, they are None (and the hash is empty) until the structure is fetched
+    material_id: str
+    chemical_formula: str | None
+    atoms: dict[str, Any] | None
+    atoms_slab: dict[str, Any] | None
+    # identical relaxations have the same hash, see memoization.relaxation_key
+    input_hash: str
+    # set if the structure turned out identical to another job, the job is only a link to it, see RelaxationService
+    identical_job_id: str | None
+
+    # Fields that are used by the scheduler
+    priority: str
+    # hash of the API key the job was submitted with, jobs of the same owner share the workers fairly
+    owner: str
 
     # Fields that are updated during the job
     status: str
     progress: float
+    # reason why the job failed, if it is known (e.g. the material was not found)
+    error: str | None
 
     energies: list[float]
     forces: list[float]
-    trajectory_file: str
+
+    # set only on the job that is sent to the worker to resume it, see RelaxationService.requeue_job
+    checkpoint: NotRequired[Checkpoint]
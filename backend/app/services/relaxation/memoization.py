@@ -0,0 +1,120 @@
+import hashlib
+import json
+from threading import Lock
+from typing import Any
+
+import numpy as np
+
+from .metrics import MEMO_LOOKUPS
+
+
+def relaxation_key(atoms: dict[str, Any],
+                   model: str,
+                   dtype: str,
+                   fmax: float,
+                   max_steps: int,
+                   optimizer: str = "PreconLBFGS",
+                   prerelaxation: dict[str, Any] | None = None,
+                   max_seconds: float | None = None) -> str:
+    """
+    Canonical hash of the relaxation input, identical relaxations have the same key.
+
+    Coordinates are rounded, so the noise of the float arithmetic does not produce different keys.
+    """
+    def canonical(values: Any) -> bytes:
+        # adding zero turns -0.0 into 0.0
+        return (np.round(np.asarray(values, dtype=np.float64), 8) + 0.0).tobytes()
+
+    digest = hashlib.sha256()
+    digest.update(np.asarray(atoms["numbers"], dtype=np.int64).tobytes())
+    digest.update(canonical(atoms["positions"]))
+    digest.update(canonical(atoms["cell"]))
+    digest.update(np.asarray(atoms["pbc"], dtype=bool).tobytes())
+    parameters: dict[str, Any] = {
+        "model": model,
+        "dtype": dtype,
+        "fmax": fmax,
+        "max_steps": max_steps,
+        "optimizer": optimizer,
+        "prerelaxation": prerelaxation,
+        "max_seconds": max_seconds,
+    }
+    digest.update(json.dumps(parameters, sort_keys=True).encode())
+
+    return digest.hexdigest()
+
+
+def request_key(material_id: str,
+                owner: str,
+                model: str,
+                dtype: str,
+                fmax: float,
+                max_steps: int,
+                prerelaxation: dict[str, Any] | None = None,
+                max_seconds: float | None = None) -> str:
+    """
+    Hash of the relaxation request, known before the structure is fetched.
+
+    Structure of a material does not change between requests, so identical requests are identical relaxations.
+    Requests of different owners (API keys) never match, the structure is fetched with the key of the request,
+        so a request with an invalid key fails instead of getting the job of another owner.
+    """
+    parameters: dict[str, Any] = {
+        "material_id": material_id,
+        "owner": owner,
+        "model": model,
+        "dtype": dtype,
+        "fmax": fmax,
+        "max_steps": max_steps,
+        "prerelaxation": prerelaxation,
+        "max_seconds": max_seconds,
+    }
+
+    return hashlib.sha256(json.dumps(parameters, sort_keys=True).encode()).hexdigest()
+
+
+class RelaxationResultCache:
+    """
+    Maps relaxation keys to the jobs that did (or are doing) this relaxation.
+
+    Hits and misses are exported as relaxation_memo_lookups_total with the name of the cache.
+    """
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._job_ids: dict[str, str] = {}
+        self._keys: dict[str, str] = {}
+        self._lock = Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> str | None:
+        return self._job_ids.get(key)
+
+    def put(self, key: str, job_id: str) -> None:
+        with self._lock:
+            if (previous_job_id := self._job_ids.get(key)) is not None:
+                self._keys.pop(previous_job_id, None)
+
+            self._job_ids[key] = job_id
+            self._keys[job_id] = key
+
+    def forget(self, job_id: str) -> None:
+        with self._lock:
+            if (key := self._keys.pop(job_id, None)) is not None:
+                self._job_ids.pop(key, None)
+
+    def record_hit(self) -> None:
+        with self._lock:
+            self.hits += 1
+        MEMO_LOOKUPS.inc(self.name, "hit")
+
+    def record_miss(self) -> None:
+        with self._lock:
+            self.misses += 1
+        MEMO_LOOKUPS.inc(self.name, "miss")
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
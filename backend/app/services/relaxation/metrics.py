@@ -0,0 +1,50 @@
+from utils.metrics import BYTES_BUCKETS, registry
+
+
+# Jobs may wait for hours when the workers are busy
+_QUEUE_WAIT_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 1800.0, 3600.0, 4 * 3600.0)
+
+STRUCTURE_FETCH_SECONDS = registry.histogram(
+    "relaxation_structure_fetch_seconds",
+    "Time of a structure source request, one request fetches the structures of one or more new jobs",
+)
+INTAKE_REJECTED = registry.counter(
+    "relaxation_intake_rejected_total",
+    "Number of new jobs rejected because too many jobs were waiting for their structures",
+)
+QUEUE_WAIT_SECONDS = registry.histogram(
+    "relaxation_queue_wait_seconds",
+    "Time from the submission of a job to its dispatch to the workers",
+    buckets=_QUEUE_WAIT_BUCKETS,
+)
+STEP_MODEL_SECONDS = registry.histogram(
+    "relaxation_step_model_seconds",
+    "Time of a step spent in the model (forward pass, including the wait for the batch in the batched workers)",
+)
+STEP_OPTIMIZER_SECONDS = registry.histogram(
+    "relaxation_step_optimizer_seconds",
+    "Time of a step spent outside of the model (optimizer and preconditioner)",
+)
+MESSAGE_BYTES = registry.histogram(
+    "relaxation_message_bytes",
+    "Pickled size of the events sent by the workers, sampled",
+    buckets=BYTES_BUCKETS,
+)
+MESSAGE_LATENCY_SECONDS = registry.histogram(
+    "relaxation_message_latency_seconds",
+    "Time from sending an event by the worker to its processing by the service",
+)
+REPOSITORY_UPDATE_SECONDS = registry.histogram(
+    "relaxation_repository_update_seconds",
+    "Time to apply a batch of events to the repository",
+)
+MEMO_LOOKUPS = registry.counter(
+    "relaxation_memo_lookups_total",
+    "Number of lookups of identical relaxations, by cache (request before the fetch, result after it) and result",
+    label_names=("cache", "result"),
+)
+EVENTS = registry.counter(
+    "relaxation_events_total",
+    "Number of events received from the workers",
+    label_names=("type",),
+)
@@ -1,6 +1,7 @@
 from abc import abstractmethod
 from typing import NoReturn
 
+from services.relaxation.events import JobEvent, apply_event
 from services.relaxation.job import Job
 
 
@@ -20,6 +21,11 @@ class AbstractRelaxationJobRepository:
         """Save new job in the storage"""
         pass
 
+    def create_many(self, jobs: list[Job]) -> None:
+        """Save several new jobs in the storage, implementations should do it in one operation if possible"""
+        for job in jobs:
+            self.create(job)
+
     @abstractmethod
     def get(self, job_id: str) -> Job:
         """Get job from the storage"""
@@ -30,6 +36,37 @@ class AbstractRelaxationJobRepository:
         """Update job in the storage"""
         pass
 
+    @abstractmethod
+    def delete(self, job_id: str) -> None:
+        """Remove job from the storage"""
+        pass
+
+    @abstractmethod
+    def get_ids_by_status(self, *statuses: str) -> list[str]:
+        """IDs of the jobs with any of the given statuses"""
+        pass
+
+    @abstractmethod
+    def touch(self, job_ids: list[str], accessed_at: float) -> None:
+        """Record when the jobs were last accessed, jobs that do not exist are skipped"""
+        pass
+
+    @abstractmethod
+    def get_accessed_at(self, *statuses: str) -> dict[str, float | None]:
+        """When the jobs with any of the given statuses were last accessed, None if they never were"""
+        pass
+
+    def apply_events(self, events: list[JobEvent]) -> None:
+        """
+        Apply progress events sent by the workers, in order.
+
+        Storages that can write several events at once (e.g. in one transaction) should override this.
+        """
+        for event in events:
+            job = self.get(event["job_id"])
+            apply_event(job, event)
+            self.update(job)
+
     def _raise_not_found(self, job_id: str) -> NoReturn:
         """Raise exception if job with given id does not exist"""
         raise JobNotFound(f"Job with id {job_id} does not exist")
@@ -19,6 +19,7 @@ class InMemoryRelaxationJobRepository(AbstractRelaxationJobRepository):
 
     def __init__(self) -> None:
         self.jobs: dict[str, Job] = {}
+        self.accessed_at: dict[str, float] = {}
         self._lock = Lock()
 
     def create(self, job: Job) -> None:
@@ -30,6 +31,14 @@ class InMemoryRelaxationJobRepository(AbstractRelaxationJobRepository):
 
             self.jobs[job_id] = job
 
+    def create_many(self, jobs: list[Job]) -> None:
+        with self._lock:
+            for job in jobs:
+                if job["id"] in self.jobs:
+                    self._raise_already_exists(job["id"])
+
+            self.jobs.update((job["id"], job) for job in jobs)
+
     def get(self, job_id: str) -> Job:
         if job := self.jobs.get(job_id):
             return job
@@ -42,3 +51,19 @@ class InMemoryRelaxationJobRepository(AbstractRelaxationJobRepository):
             self._raise_not_found(job_id)
 
         self.jobs[job_id] = job
+
+    def delete(self, job_id: str) -> None:
+        with self._lock:
+            self.accessed_at.pop(job_id, None)
+            if self.jobs.pop(job_id, None) is None:
+                self._raise_not_found(job_id)
+
+    def get_ids_by_status(self, *statuses: str) -> list[str]:
+        return [job_id for job_id, job in list(self.jobs.items()) if job["status"] in statuses]
+
+    def touch(self, job_ids: list[str], accessed_at: float) -> None:
+        with self._lock:
+            self.accessed_at.update((job_id, accessed_at) for job_id in job_ids if job_id in self.jobs)
+
+    def get_accessed_at(self, *statuses: str) -> dict[str, float | None]:
+        return {job_id: self.accessed_at.get(job_id) for job_id in self.get_ids_by_status(*statuses)}
@@ -0,0 +1,282 @@
+import sqlite3
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, cast
+
+import numpy as np
+
+from services.relaxation.events import JobEvent, JobEventType, apply_event
+from services.relaxation.job import FINAL_STATUSES, Job, JobStatus
+from services.relaxation.repository.abstract import AbstractRelaxationJobRepository
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    progress REAL NOT NULL,
+    input_hash TEXT NOT NULL,
+    -- float64 energies and max forces of the steps, every step is appended to them;
+    --   energies of the finished job are replaced with the final (normalized) ones
+    energies BLOB NOT NULL,
+    forces BLOB NOT NULL,
+    -- the rest of the job metadata, encoded with ase.io.jsonio
+    data TEXT NOT NULL,
+    -- when the job was last accessed (unix time), shared by all processes for the retention
+    accessed_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);
+"""
+
+# Size of a float64 value in the blobs
+_VALUE_BYTES = 8
+
+# Job fields that are stored in their own columns, everything else goes to the data column
+_OWN_FIELDS = frozenset({"id", "status", "progress", "input_hash", "energies", "forces"})
+
+
+# Events are not applied to the jobs in these statuses, e.g. events of the worker after the job was cancelled
+_FINAL_STATUS_VALUES = tuple(sorted(status.value for status in FINAL_STATUSES))
+_NOT_FINAL = f"status NOT IN ({', '.join('?' * len(_FINAL_STATUS_VALUES))})"
+
+
+def _to_blob(values: Any) -> bytes:
+    return np.asarray(values, dtype=np.float64).tobytes()
+
+
+def _from_blob(blob: bytes) -> Any:
+    return np.frombuffer(blob, dtype=np.float64)
+
+
+class SQLiteRelaxationJobRepository(AbstractRelaxationJobRepository):
+    """
+    SQLite repository stores jobs on the disk, one row per job.
+    Energies and max forces of the steps are stored as binary float64 blobs in the row of the job,
+        a new step is appended to them without reading the job.
+    Positions of the steps are not stored here, see TrajectoryStore.
+
+    Recently used jobs are kept in a bounded in-memory cache (running jobs are polled the most),
+        events of the cached jobs are applied both to the cache and the database.
+    If the database is shared by several processes (e.g. the web processes and the dispatcher),
+        only finished and failed jobs are cached, other jobs may be changed by the other processes at any time.
+
+    Pros:
+        - Persistence (jobs survive restarts)
+        - Memory usage does not grow with job count
+    Cons:
+        - Jobs that are not cached have to be read from the disk
+        - Writes are serialized (single writer)
+    """
+
+    def __init__(self, path: str, cache_size: int = 128, shared: bool = False) -> None:
+        self.path = path
+        self.cache_size = cache_size
+        self.shared = shared
+
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = Lock()
+        self._cache: OrderedDict[str, Job] = OrderedDict()
+
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.executescript(_SCHEMA)
+
+    def create(self, job: Job) -> None:
+        self.create_many([job])
+
+    def create_many(self, jobs: list[Job]) -> None:
+        with self._lock:
+            try:
+                with self._connection:
+                    for job in jobs:
+                        self._insert(job)
+            except sqlite3.IntegrityError:
+                existing = {job["id"] for job in jobs if self._exists(job["id"])}
+                self._raise_already_exists(", ".join(sorted(existing)))
+
+            for job in jobs:
+                self._cache_put(job)
+
+    def get(self, job_id: str) -> Job:
+        with self._lock:
+            if (job := self._cache.get(job_id)) is not None:
+                self._cache.move_to_end(job_id)
+                return job
+
+            job = self._select(job_id)
+            self._cache_put(job)
+
+            return job
+
+    def update(self, job: Job) -> None:
+        job_id = job["id"]
+
+        with self._lock:
+            with self._connection:
+                cursor = self._connection.execute(
+                    "UPDATE jobs SET status = ?, progress = ?, input_hash = ?, energies = ?, forces = ?, data = ?"
+                    " WHERE id = ?",
+                    (*self._row(job)[1:], job_id),
+                )
+                if cursor.rowcount == 0:
+                    self._raise_not_found(job_id)
+
+            self._cache_put(job)
+
+    def delete(self, job_id: str) -> None:
+        with self._lock:
+            with self._connection:
+                cursor = self._connection.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+            self._cache.pop(job_id, None)
+
+        if cursor.rowcount == 0:
+            self._raise_not_found(job_id)
+
+    def get_ids_by_status(self, *statuses: str) -> list[str]:
+        placeholders = ", ".join("?" * len(statuses))
+
+        with self._lock:
+            rows = self._connection.execute(
+                f"SELECT id FROM jobs WHERE status IN ({placeholders})",
+                [JobStatus(status).value for status in statuses],
+            ).fetchall()
+
+        return [row[0] for row in rows]
+
+    def touch(self, job_ids: list[str], accessed_at: float) -> None:
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "UPDATE jobs SET accessed_at = ? WHERE id = ?", [(accessed_at, job_id) for job_id in job_ids]
+            )
+
+    def get_accessed_at(self, *statuses: str) -> dict[str, float | None]:
+        placeholders = ", ".join("?" * len(statuses))
+
+        with self._lock:
+            rows = self._connection.execute(
+                f"SELECT id, accessed_at FROM jobs WHERE status IN ({placeholders})",
+                [JobStatus(status).value for status in statuses],
+            ).fetchall()
+
+        return dict(rows)
+
+    def apply_events(self, events: list[JobEvent]) -> None:
+        """All events are written in a single transaction"""
+        with self._lock:
+            with self._connection:
+                for event in events:
+                    self._write_event(event)
+
+            for event in events:
+                if (job := self._cache.get(event["job_id"])) is not None:
+                    apply_event(job, event)
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+    def _write_event(self, event: JobEvent) -> None:
+        job_id = event["job_id"]
+
+        if event["type"] == JobEventType.STATUS:
+            cursor = self._connection.execute(
+                "UPDATE jobs SET status = ?, progress = COALESCE(?, progress),"
+                " data = CASE WHEN ? IS NULL THEN data ELSE json_set(data, '$.error', ?) END"
+                f" WHERE id = ? AND {_NOT_FINAL}",
+                (
+                    JobStatus(event["status"]).value,
+                    100 if event["status"] == JobStatus.FAILED else None,
+                    event.get("error"),
+                    event.get("error"),
+                    job_id,
+                    *_FINAL_STATUS_VALUES,
+                ),
+            )
+
+        elif event["type"] == JobEventType.STEP:
+            # the same step may be delivered again, see apply_event
+            cursor = self._connection.execute(
+                "UPDATE jobs SET energies = CAST(energies || ? AS BLOB), forces = CAST(forces || ? AS BLOB),"
+                " progress = CAST(? AS REAL) / json_extract(data, '$.max_steps')"
+                f" WHERE id = ? AND length(forces) < ? * {_VALUE_BYTES} AND {_NOT_FINAL}",
+                (
+                    _to_blob([event["energy"]]),
+                    _to_blob([event["force"]]),
+                    event["step"],
+                    job_id,
+                    event["step"],
+                    *_FINAL_STATUS_VALUES,
+                ),
+            )
+
+        elif event["type"] == JobEventType.SUMMARY:
+            cursor = self._connection.execute(
+                f"UPDATE jobs SET status = ?, progress = 1, energies = ? WHERE id = ? AND {_NOT_FINAL}",
+                (JobStatus(event["status"]).value, _to_blob(event["energies"]), job_id, *_FINAL_STATUS_VALUES),
+            )
+
+        if cursor.rowcount == 0 and not self._exists(job_id):
+            self._raise_not_found(job_id)
+
+    def _exists(self, job_id: str) -> bool:
+        return self._connection.execute("SELECT 1 FROM jobs WHERE id = ?", (job_id,)).fetchone() is not None
+
+    def _insert(self, job: Job) -> None:
+        self._connection.execute(
+            "INSERT INTO jobs (id, status, progress, input_hash, energies, forces, data) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            self._row(job),
+        )
+
+    @staticmethod
+    def _row(job: Job) -> tuple[Any, ...]:
+        """Values of the columns in the order of the schema"""
+        # ase.io imports scipy, it is not needed until the first job is stored
+        from ase.io.jsonio import encode
+
+        data = {key: value for key, value in job.items() if key not in _OWN_FIELDS}
+
+        return (
+            job["id"],
+            JobStatus(job["status"]).value,
+            job["progress"],
+            job["input_hash"],
+            _to_blob(job["energies"]),
+            _to_blob(job["forces"]),
+            encode(data),
+        )
+
+    def _select(self, job_id: str) -> Job:
+        row = self._connection.execute(
+            "SELECT status, progress, input_hash, energies, forces, data FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            self._raise_not_found(job_id)
+
+        status, progress, input_hash, energies, forces, data = row
+
+        from ase.io.jsonio import decode
+
+        job = cast(Job, decode(data))
+        job.update({
+            "id": job_id,
+            "status": JobStatus(status),
+            "progress": progress,
+            "input_hash": input_hash,
+            "energies": _from_blob(energies).tolist(),
+            "forces": _from_blob(forces).tolist(),
+        })
+
+        return job
+
+    def _cache_put(self, job: Job) -> None:
+        if self.shared and job["status"] not in FINAL_STATUSES:
+            self._cache.pop(job["id"], None)
+            return
+
+        self._cache[job["id"]] = job
+        self._cache.move_to_end(job["id"])
+
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
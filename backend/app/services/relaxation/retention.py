@@ -0,0 +1,238 @@
+import math
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable
+
+from logger import logger
+from .job import FINAL_STATUSES, JobStatus
+from .repository.abstract import AbstractRelaxationJobRepository, JobNotFound
+from .trajectory_export import TrajectoryExporter
+from .trajectory_store import TrajectoryStore
+
+
+@dataclass
+class RetentionUsage:
+    jobs: int
+    final_jobs: int
+    disk_bytes: int
+    evicted_jobs: int
+
+
+class RetentionManager:
+    """
+    Keeps memory and disk used by the jobs bounded.
+
+    Finished and failed jobs are evicted in the least-recently-accessed order
+        when they are not accessed for ttl seconds, when there are more than max_jobs jobs
+        or when the trajectories of all jobs take more than max_disk_bytes.
+    Pending and running jobs are never evicted, so the limits may be exceeded while they are in flight.
+    Limits set to None are not enforced.
+
+    Access times are stored in the repository, so they are shared by all processes that use it,
+        a job's access time is written at most once per touch_interval seconds.
+
+    Compaction runs in a background thread every interval seconds,
+        it also removes trajectories that have no job (e.g. left after a restart with the in-memory repository).
+    """
+    def __init__(self,
+                 repository: AbstractRelaxationJobRepository,
+                 trajectory_store: TrajectoryStore,
+                 trajectory_exporter: TrajectoryExporter,
+                 ttl: float | None,
+                 max_jobs: int | None,
+                 max_disk_bytes: int | None,
+                 interval: float = 60.0,
+                 orphan_grace_period: float = 600.0,
+                 touch_interval: float = 60.0) -> None:
+        self.repository = repository
+        self.trajectory_store = trajectory_store
+        self.trajectory_exporter = trajectory_exporter
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self.max_disk_bytes = max_disk_bytes
+        self.interval = interval
+        # trajectory is created right before its job, it is not an orphan during that time
+        self.orphan_grace_period = orphan_grace_period
+        self.touch_interval = touch_interval
+
+        self.evicted_jobs = 0
+
+        # when this process last wrote the access time of the job, to throttle the writes
+        self._touched_at: dict[str, float] = {}
+        self._pruned_at = time.time()
+        # disk usage of the jobs and IDs of the final jobs as of the last measurement, see usage
+        self._sizes: dict[str, int] = {}
+        self._final_job_ids: set[str] = set()
+        self._measured_at = -math.inf
+        self._lock = threading.Lock()
+
+        self._eviction_listeners: list[Callable[[str], None]] = []
+        self._compaction_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: threading.Thread | None = None
+
+        trajectory_exporter.add_write_listener(self.record_size)
+
+    def add_eviction_listener(self, listener: Callable[[str], None]) -> None:
+        """Listener is called with the ID of every evicted job, e.g. to drop it from the caches"""
+        self._eviction_listeners.append(listener)
+
+    def touch(self, job_id: str) -> None:
+        now = time.time()
+
+        with self._lock:
+            if now - self._touched_at.get(job_id, -math.inf) < self.touch_interval:
+                return
+
+            # entries older than the interval don't throttle anything
+            if now - self._pruned_at > self.touch_interval:
+                self._touched_at = {
+                    touched_id: touched_at for touched_id, touched_at in self._touched_at.items()
+                    if now - touched_at < self.touch_interval
+                }
+                self._pruned_at = now
+
+            self._touched_at[job_id] = now
+
+        self.repository.touch([job_id], now)
+
+    def record_size(self, job_id: str) -> None:
+        """Measure the files of the job again, called when the job is done or its files are written"""
+        size = self._size_bytes(job_id)
+
+        with self._lock:
+            self._sizes[job_id] = size
+            self._final_job_ids.add(job_id)
+
+    def start(self) -> None:
+        logger.info("Starting retention manager")
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10.0)
+
+    def usage(self) -> RetentionUsage:
+        """
+        Figures of the last compaction pass, updated when the files of the jobs are written or removed.
+        Processes that don't run the compaction (e.g. the web processes) measure them at most once per interval.
+        """
+        if self._thread is None and time.monotonic() - self._measured_at > self.interval:
+            with self._compaction_lock:
+                # measured by a concurrent request in the meantime
+                if time.monotonic() - self._measured_at > self.interval:
+                    self._measure()
+
+        with self._lock:
+            return RetentionUsage(
+                jobs=len(self._sizes),
+                final_jobs=len(self._final_job_ids),
+                disk_bytes=sum(self._sizes.values()),
+                evicted_jobs=self.evicted_jobs,
+            )
+
+    def compact(self) -> int:
+        """Evict jobs that are over the limits, returns the number of evicted jobs"""
+        with self._compaction_lock:
+            now = time.time()
+
+            self._remove_orphans(set(self.repository.get_ids_by_status(*JobStatus)), now)
+            self._measure()
+
+            accessed_at = self.repository.get_accessed_at(*FINAL_STATUSES)
+            # jobs that were never accessed (e.g. left from the previous run) are kept for the ttl from now on
+            never_accessed = [job_id for job_id, job_accessed_at in accessed_at.items() if job_accessed_at is None]
+            if never_accessed:
+                self.repository.touch(never_accessed, now)
+                accessed_at.update(dict.fromkeys(never_accessed, now))
+
+            with self._lock:
+                jobs = len(self._sizes)
+                disk_bytes = sum(self._sizes.values())
+                sizes = dict(self._sizes)
+
+            evicted = 0
+            for job_id in sorted(accessed_at, key=lambda job_id: accessed_at[job_id] or now):
+                expired = self.ttl is not None and now - (accessed_at[job_id] or now) > self.ttl
+                too_many = self.max_jobs is not None and jobs > self.max_jobs
+                too_large = self.max_disk_bytes is not None and disk_bytes > self.max_disk_bytes
+                # the rest of the jobs were accessed later, so they are not expired either
+                if not (expired or too_many or too_large):
+                    break
+
+                self._evict(job_id)
+                jobs -= 1
+                disk_bytes -= sizes.get(job_id, 0)
+                evicted += 1
+
+            if evicted:
+                logger.info(f"Evicted {evicted} jobs, {jobs} jobs left using {disk_bytes} bytes")
+
+            return evicted
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.compact()
+            except Exception as e:
+                logger.exception(f"Error compacting jobs: {e}")
+
+    def _measure(self) -> None:
+        """Walk the files of all jobs, it takes a while with many jobs, so it is done once per pass"""
+        job_ids = self.repository.get_ids_by_status(*JobStatus)
+        final_job_ids = set(self.repository.get_ids_by_status(*FINAL_STATUSES))
+        sizes = {job_id: self._size_bytes(job_id) for job_id in job_ids}
+
+        with self._lock:
+            self._sizes = sizes
+            self._final_job_ids = final_job_ids
+            self._measured_at = time.monotonic()
+
+    def _size_bytes(self, job_id: str) -> int:
+        return self.trajectory_store.size_bytes(job_id) + self.trajectory_exporter.size_bytes(job_id)
+
+    def _evict(self, job_id: str) -> None:
+        try:
+            self.repository.delete(job_id)
+        except JobNotFound:
+            pass
+
+        self.trajectory_store.delete(job_id)
+        self.trajectory_exporter.evict(job_id)
+        with self._lock:
+            self._touched_at.pop(job_id, None)
+            self._sizes.pop(job_id, None)
+            self._final_job_ids.discard(job_id)
+        self.evicted_jobs += 1
+
+        for listener in self._eviction_listeners:
+            try:
+                listener(job_id)
+            except Exception as e:
+                logger.exception(f"Error in eviction listener: {e} (job {job_id})")
+
+        logger.info(f"Job evicted (job {job_id})")
+
+    def _remove_orphans(self, job_ids: set[str], now: float) -> None:
+        for job_id in self.trajectory_store.job_ids():
+            if job_id in job_ids:
+                continue
+
+            try:
+                if now - self.trajectory_store.created_at(job_id) < self.orphan_grace_period:
+                    continue
+            except FileNotFoundError:
+                # removed in the meantime
+                continue
+
+            logger.info(f"Removing trajectory without a job (job {job_id})")
+            self.trajectory_store.delete(job_id)
+            self.trajectory_exporter.evict(job_id)
+
+        # exports are made only for finished jobs, so they never exist before the job
+        for job_id in self.trajectory_exporter.job_ids():
+            if job_id not in job_ids:
+                self.trajectory_exporter.evict(job_id)
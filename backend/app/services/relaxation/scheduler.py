@@ -0,0 +1,232 @@
+import enum
+import itertools
+import threading
+import time
+from dataclasses import dataclass, field
+
+from logger import logger
+from .job import Job
+from .metrics import QUEUE_WAIT_SECONDS
+from .transport.abstract import SendChannel
+
+
+class JobPriority(str, enum.Enum):
+    HIGH = "HIGH"
+    NORMAL = "NORMAL"
+    LOW = "LOW"
+
+
+_PRIORITY_RANKS = {
+    JobPriority.HIGH: 0,
+    JobPriority.NORMAL: 1,
+    JobPriority.LOW: 2,
+}
+
+# Smoothing factor of the measured seconds per cost unit
+_THROUGHPUT_SMOOTHING = 0.2
+
+
+def estimate_cost(job: Job) -> int:
+    """Relaxation time grows with the number of atoms and the number of steps"""
+    return len(job["atoms_slab"]["numbers"]) * job["max_steps"]
+
+
+@dataclass
+class JobSchedule:
+    queue_position: int | None
+    eta_seconds: float | None
+
+
+@dataclass
+class _Entry:
+    job: Job
+    cost: int
+    submitted_at: float
+    sequence: int
+    dispatched_at: float = field(default=0.0)
+
+    @property
+    def priority_rank(self) -> int:
+        return _PRIORITY_RANKS[JobPriority(self.job.get("priority", JobPriority.NORMAL))]
+
+    @property
+    def owner(self) -> str:
+        return self.job.get("owner", "")
+
+
+class JobScheduler:
+    """
+    Decides which pending job goes to the workers next, instead of relaxing them in the submission order.
+
+    Jobs are ordered by:
+        1. Priority class, a job is promoted by one class every aging_interval seconds, so low priority jobs don't starve
+        2. Number of running jobs of the same owner (API key), so one client can't take all workers
+        3. Estimated cost (atoms × max_steps), so small jobs are not stuck behind large ones
+        4. Submission order
+
+    The task queue is filled only up to the capacity of the workers,
+        the rest of the jobs wait here, so the order can still change when new jobs arrive.
+    """
+    def __init__(self, task_queue: 'SendChannel[Job]', capacity: int, aging_interval: float = 60.0) -> None:
+        self.task_queue = task_queue
+        self.capacity = capacity
+        self.aging_interval = aging_interval
+
+        self._pending: dict[str, _Entry] = {}
+        self._running: dict[str, _Entry] = {}
+        self._sequence = itertools.count()
+        # measured from finished jobs, None until the first one finishes
+        self._seconds_per_cost: float | None = None
+
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread: threading.Thread | None = None
+
+    def submit(self, job: Job) -> None:
+        with self._condition:
+            self._pending[job["id"]] = _Entry(
+                job=job,
+                cost=estimate_cost(job),
+                submitted_at=time.monotonic(),
+                sequence=next(self._sequence),
+            )
+            self._condition.notify_all()
+
+    def requeue(self, job: Job) -> None:
+        """Put the job back to the queue (e.g. its worker died), it keeps its place and age if it was scheduled"""
+        with self._condition:
+            entry = self._running.pop(job["id"], None) or self._pending.pop(job["id"], None)
+            if entry is None:
+                entry = _Entry(
+                    job=job,
+                    cost=estimate_cost(job),
+                    submitted_at=time.monotonic(),
+                    sequence=next(self._sequence),
+                )
+
+            entry.job = job
+            self._pending[job["id"]] = entry
+            self._condition.notify_all()
+
+    def cancel(self, job_id: str) -> bool:
+        """Removes the waiting job, returns False if it is not waiting (e.g. it is already dispatched)"""
+        with self._condition:
+            return self._pending.pop(job_id, None) is not None
+
+    def job_done(self, job_id: str, finished: bool) -> None:
+        """
+        Called when the job is finished, failed or stopped, frees its slot.
+
+        Only finished jobs update the throughput, e.g. a job cancelled right after dispatch would make the ETAs too low.
+        """
+        with self._condition:
+            if (entry := self._running.pop(job_id, None)) is None:
+                return
+
+            self._condition.notify_all()
+            if not finished:
+                return
+
+            duration = time.monotonic() - entry.dispatched_at
+            seconds_per_cost = duration / max(entry.cost, 1)
+            if self._seconds_per_cost is None:
+                self._seconds_per_cost = seconds_per_cost
+            else:
+                self._seconds_per_cost += _THROUGHPUT_SMOOTHING * (seconds_per_cost - self._seconds_per_cost)
+
+    def set_capacity(self, capacity: int) -> None:
+        """Called when workers are added or removed, jobs already dispatched are not taken back"""
+        with self._condition:
+            self.capacity = capacity
+            self._condition.notify_all()
+
+    def load(self) -> tuple[int, int]:
+        """Number of jobs waiting for a free slot and number of dispatched jobs"""
+        with self._condition:
+            return len(self._pending), len(self._running)
+
+    def job_ids(self) -> list[str]:
+        """IDs of the waiting and dispatched jobs"""
+        with self._condition:
+            return [*self._pending, *self._running]
+
+    def scheduled(self, job_id: str) -> bool:
+        """True if the job is waiting or dispatched"""
+        with self._condition:
+            return job_id in self._pending or job_id in self._running
+
+    def schedule(self, job: Job) -> JobSchedule:
+        """Position in the queue (1 is the next job to run) and estimated time until the job is finished"""
+        with self._condition:
+            seconds_per_cost = self._seconds_per_cost
+
+            if job["id"] in self._running:
+                entry = self._running[job["id"]]
+                eta = None
+                if seconds_per_cost is not None:
+                    remaining = 1 - min(job["progress"], 1.0)
+                    eta = remaining * entry.cost * seconds_per_cost
+
+                return JobSchedule(queue_position=None, eta_seconds=eta)
+
+            if job["id"] not in self._pending:
+                return JobSchedule(queue_position=None, eta_seconds=None)
+
+            queue = self._ordered()
+
+        position = next(i for i, entry in enumerate(queue) if entry.job["id"] == job["id"])
+        eta = None
+        if seconds_per_cost is not None:
+            # jobs ahead are relaxed in parallel by all workers, running jobs are not taken into account
+            cost_ahead = sum(entry.cost for entry in queue[:position])
+            eta = (cost_ahead / max(self.capacity, 1) + queue[position].cost) * seconds_per_cost
+
+        return JobSchedule(queue_position=position + 1, eta_seconds=eta)
+
+    def start(self) -> None:
+        logger.info("Starting job scheduler")
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+
+        if self._thread is not None:
+            self._thread.join(timeout=10.0)
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: self._stopped or (self._pending and len(self._running) < self.capacity)
+                )
+                if self._stopped:
+                    return
+
+                entry = self._ordered()[0]
+                del self._pending[entry.job["id"]]
+                entry.dispatched_at = time.monotonic()
+                self._running[entry.job["id"]] = entry
+
+            QUEUE_WAIT_SECONDS.observe(entry.dispatched_at - entry.submitted_at)
+            self.task_queue.put(entry.job)
+            logger.info(f"Job dispatched to the workers, cost {entry.cost} (job {entry.job['id']})")
+
+    def _ordered(self) -> list[_Entry]:
+        now = time.monotonic()
+        running_by_owner: dict[str, int] = {}
+        for entry in self._running.values():
+            running_by_owner[entry.owner] = running_by_owner.get(entry.owner, 0) + 1
+
+        def key(entry: _Entry) -> tuple[float, int, int, int]:
+            promotions = (now - entry.submitted_at) // self.aging_interval
+            return (
+                entry.priority_rank - promotions,
+                running_by_owner.get(entry.owner, 0),
+                entry.cost,
+                entry.sequence,
+            )
+
+        return sorted(self._pending.values(), key=key)
@@ -1,166 +1,495 @@
-import queue
+import hashlib
 import threading
 import uuid
-from io import StringIO
-from multiprocessing import Queue
-from typing import cast
+from typing import TYPE_CHECKING
 
-from ase import Atoms, build, io
-from mp_api.client import MPRester, MPRestError  # type: ignore[import-untyped]
-from pymatgen.core.structure import Structure
-from pymatgen.io.ase import AseAtomsAdaptor
+from ase import Atoms
 
 from logger import logger
-from utils.calculator_factory import MACECalculatorFactory
-from .job import Job, JobStatus
-from .repository.abstract import AbstractRelaxationJobRepository
-from .worker import RelaxationWorker
-
-
-class MaterialNotFound(Exception):
-    pass
-
-
-class MaterialMalformedName(Exception):
-    pass
-
-
-class ApiKeyMalformed(Exception):
-    pass
-
-
-class ApiKeyOutdated(Exception):
-    pass
-
-
-class TrajectoryIsEmpty(Exception):
+from services.structures.source.abstract import AbstractStructureSource, ApiKeyMalformed, ApiKeyOutdated, \
+    FetchError, MaterialMalformedName, MaterialNotFound
+from utils.calculator_factory import CalculatorRegistry
+from utils.metrics import registry
+from .broadcaster import JobEventBroadcaster
+from .dispatcher import JobDispatcher
+from .event_poller import RepositoryEventPoller
+from .events import JobEventType, JobStatusEvent
+from .intake import IntakeQueueFull, IntakeTask, JobIntake
+from .job import FINAL_STATUSES, Job, JobStatus, Prerelaxation
+from .memoization import RelaxationResultCache, relaxation_key, request_key
+from .metrics import STRUCTURE_FETCH_SECONDS
+from .repository.abstract import AbstractRelaxationJobRepository, JobNotFound
+from .retention import RetentionManager
+from .scheduler import JobPriority, JobSchedule
+from .trajectory_export import TrajectoryExport, TrajectoryExporter, TrajectoryFormat
+from .trajectory_store import JobTrajectory, TrajectoryStore
+
+# pymatgen and ase.build are imported when the first job is created, they are not needed to serve the jobs
+if TYPE_CHECKING:
+    from pymatgen.core.structure import Structure
+
+
+# Reasons reported in the jobs whose structure could not be fetched, other errors are reported as _FETCH_FAILED
+_FETCH_ERRORS: dict[type[Exception], str] = {
+    MaterialNotFound: "Material not found",
+    MaterialMalformedName: "Invalid material name format",
+    ApiKeyMalformed: "Invalid API key format",
+    ApiKeyOutdated: "API key has expired",
+}
+_FETCH_FAILED = "Structure could not be fetched"
+
+# Jobs in these statuses have no result to share with the identical jobs
+_NOT_REUSED = frozenset({JobStatus.FAILED, JobStatus.CANCELLED, JobStatus.TIMED_OUT})
+
+
+class JobAlreadyFinished(Exception):
     pass
 
 
 class RelaxationService:
+    """
+    Creates the jobs and serves them to the API.
+
+    Prepared jobs are relaxed by the dispatcher, if the service runs without one (the web processes),
+        the dispatcher of another process finds them in the shared repository,
+        and the events of the subscribed jobs are found there as well, see RepositoryEventPoller.
+    """
     def __init__(self,
                  repository: AbstractRelaxationJobRepository,
-                 calculator_factory: MACECalculatorFactory,
-                 num_workers: int) -> None:
+                 structure_source: AbstractStructureSource,
+                 calculator_registry: CalculatorRegistry,
+                 trajectory_store: TrajectoryStore,
+                 trajectory_exporter: TrajectoryExporter,
+                 retention_manager: RetentionManager,
+                 broadcaster: JobEventBroadcaster,
+                 dispatcher: JobDispatcher | None,
+                 intake_concurrency: int = 4,
+                 intake_max_pending: int = 100,
+                 event_poll_interval: float = 0.5) -> None:
         self.repository = repository
-        self.task_queue: Queue[Job] = Queue()
-        self.message_queue: Queue[Job] = Queue()
-
-        self._workers: list[RelaxationWorker] = []
-
-        self._shutdown_flag = False
-
-        for i, _ in enumerate(range(num_workers), start=1):
-            logger.info(f"Starting worker {i}/{num_workers}")
-            worker = RelaxationWorker(calculator_factory, self.task_queue, self.message_queue)
-            worker.start()
-            self._workers.append(worker)
-
-        logger.info("Workers started")
-
-        self._message_listener = self._start_message_listener()
+        self.structure_source = structure_source
+        self.calculator_registry = calculator_registry
+        self.trajectory_store = trajectory_store
+        self.trajectory_exporter = trajectory_exporter
+        self.retention_manager = retention_manager
+        self.broadcaster = broadcaster
+        self.dispatcher = dispatcher
+        self.result_cache = RelaxationResultCache("result")
+        self.retention_manager.add_eviction_listener(self.result_cache.forget)
+        # identical requests are found before their structures are fetched, see request_key
+        self.request_cache = RelaxationResultCache("request")
+        self.retention_manager.add_eviction_listener(self.request_cache.forget)
+        # makes lookup of the identical job and creation of the new one atomic
+        self._create_lock = threading.Lock()
+
+        # new jobs are prepared here before they go to the dispatcher
+        self.intake = JobIntake(self._prepare_new_job, concurrency=intake_concurrency, max_pending=intake_max_pending)
+
+        registry.gauge(
+            "relaxation_jobs_fetching", "Number of new jobs waiting for their structures", lambda: self.intake.pending
+        )
+
+        self._event_poller: RepositoryEventPoller | None = None
+        if self.dispatcher is None:
+            self._event_poller = RepositoryEventPoller(
+                self.repository, self.trajectory_store, self.broadcaster, interval=event_poll_interval
+            )
+            self._event_poller.start()
+        else:
+            # nobody else prepares the jobs, so the jobs left in the FETCHING status were interrupted by a restart
+            self._fail_interrupted_jobs()
+
+        self.intake.start()
 
     def create_job(self,
                    material_id: str,
                    fmax: float,
                    max_steps: int,
-                   mpr_api_key: str) -> Job:
-        job_id = str(uuid.uuid4())
+                   mpr_api_key: str,
+                   max_seconds: float | None = None,
+                   priority: JobPriority = JobPriority.NORMAL,
+                   model: str | None = None,
+                   dtype: str | None = None,
+                   prerelax_model: str | None = None,
+                   prerelax_dtype: str | None = None,
+                   prerelax_fmax: float = 0.2) -> Job:
+        """
+        Job is returned before its structure is fetched, see JobIntake; it fails if the structure can't be fetched.
+
+        Default model and dtype of the registry are used if they are not given, raises UnknownModel.
+        If prerelax_model is given, the job is relaxed with it to prerelax_fmax first, see RelaxationWorker.
+        Job that runs longer than max_seconds is stopped in the TIMED_OUT status.
+        Raises IntakeQueueFull if too many jobs are waiting for their structures.
+        """
+        factory = self.calculator_registry.get(model, dtype)
+        prerelaxation = self._prerelaxation(prerelax_model, prerelax_dtype, prerelax_fmax)
+
+        job = self._new_job(
+            material_id,
+            fmax,
+            max_steps,
+            max_seconds,
+            priority,
+            self._owner(mpr_api_key),
+            factory.model,
+            factory.dtype,
+            prerelaxation,
+        )
+        job_id = job["id"]
+        key = self._request_key(job)
 
         logger.info(f"Creating new job for material {material_id} (job {job_id})")
-        structure = self.fetch_structure(material_id, mpr_api_key)
+        with self._create_lock:
+            if identical_job := self._find_identical_job(self.request_cache, key):
+                return identical_job
+
+            self.repository.create(job)
+            try:
+                self.intake.submit(IntakeTask(job=job, mpr_api_key=mpr_api_key))
+            except IntakeQueueFull:
+                self.repository.delete(job_id)
+                raise
 
-        logger.info(f"Structure fetched for material {material_id} (job {job_id})")
+            self.request_cache.put(key, job_id)
+        logger.info(f"Job created in repository, waiting for its structure (job {job_id})")
 
-        ase_atoms = AseAtomsAdaptor.get_atoms(structure)
+        return job
+
+    def _prepare_new_job(self, task: IntakeTask) -> None:
+        """Fetches the structure of the new job, builds its slab and hands the job to the scheduler"""
+        job_id = task.job["id"]
+        material_id = task.job["material_id"]
 
-        job: Job = {
-            "id": job_id,
+        try:
+            structure = self.fetch_structure(material_id, task.mpr_api_key)
+            logger.info(f"Structure fetched for material {material_id} (job {job_id})")
+
+            job = self._prepare_job(task.job, structure)
+        except Exception as e:
+            if (error := _FETCH_ERRORS.get(type(e))) is not None:
+                logger.info(f"Structure of material {material_id} not fetched: {error} (job {job_id})")
+            else:
+                error = _FETCH_FAILED
+                logger.exception(f"Error fetching structure of material {material_id}: {e} (job {job_id})")
+
+            self._fail_job(job_id, error)
+            return
+
+        with self._create_lock:
+            # the job may be cancelled while its structure is fetched
+            if self.repository.get(job_id)["status"] != JobStatus.FETCHING:
+                logger.info(f"Job was stopped while its structure was fetched (job {job_id})")
+                return
+
+            # e.g. the same structure was requested by another owner or under another material ID
+            if identical_job := self._find_identical_job(self.result_cache, job["input_hash"]):
+                self._link_job(job, identical_job)
+                return
+
+            self.trajectory_store.create(job_id, job["atoms_slab"], job["max_steps"])
+            self.repository.update(job)
+            self.result_cache.put(job["input_hash"], job_id)
+
+            # dispatched under the lock, so a cancel either sees the job in the scheduler or stops it from being sent
+            self.broadcaster.publish(JobStatusEvent(type=JobEventType.STATUS, job_id=job_id, status=JobStatus.PENDING))
+            self._dispatch(job)
+
+    def _link_job(self, job: Job, identical_job: Job) -> None:
+        """
+        New job is not relaxed, it is stored as a link to the identical job and served by it, see get_job.
+        Link is final, so the dispatcher doesn't take it and the retention evicts it like the other final jobs.
+        """
+        job_id = job["id"]
+        self.repository.update({**job, "identical_job_id": identical_job["id"], "status": JobStatus.FINISHED})
+        logger.info(f"Job is served by the identical job {identical_job['id']} (job {job_id})")
+
+        # subscribers of the new job follow the link, see stream_relaxation
+        self.broadcaster.publish(
+            JobStatusEvent(type=JobEventType.STATUS, job_id=job_id, status=identical_job["status"])
+        )
+
+    def create_jobs(self,
+                    material_ids: list[str],
+                    fmax: float,
+                    max_steps: int,
+                    mpr_api_key: str,
+                    max_seconds: float | None = None,
+                    priority: JobPriority = JobPriority.NORMAL,
+                    model: str | None = None,
+                    dtype: str | None = None,
+                    prerelax_model: str | None = None,
+                    prerelax_dtype: str | None = None,
+                    prerelax_fmax: float = 0.2) -> list[Job | FetchError]:
+        """
+        Create a job for every material, structures of all materials are fetched at once.
+
+        Materials that can't be fetched get the error in place of the job.
+        """
+        factory = self.calculator_registry.get(model, dtype)
+        prerelaxation = self._prerelaxation(prerelax_model, prerelax_dtype, prerelax_fmax)
+
+        logger.info(f"Creating {len(material_ids)} new jobs")
+        with STRUCTURE_FETCH_SECONDS.time():
+            structures = self.structure_source.fetch_many(material_ids, mpr_api_key)
+
+        logger.info(f"Structures fetched for {len(structures)} materials")
+
+        owner = self._owner(mpr_api_key)
+        results: list[Job | FetchError] = []
+        # new jobs by their input hash, the same material may be requested twice in one batch
+        jobs: dict[str, Job] = {}
+        with self._create_lock:
+            for material_id in material_ids:
+                structure = structures[material_id]
+                if isinstance(structure, Exception):
+                    results.append(structure)
+                    continue
+
+                job = self._prepare_job(
+                    self._new_job(
+                        material_id,
+                        fmax,
+                        max_steps,
+                        max_seconds,
+                        priority,
+                        owner,
+                        factory.model,
+                        factory.dtype,
+                        prerelaxation,
+                    ),
+                    structure,
+                )
+                if (identical_job := jobs.get(job["input_hash"])) is not None:
+                    self.result_cache.record_hit()
+                    results.append(identical_job)
+                    continue
+
+                if identical_job := self._find_identical_job(self.result_cache, job["input_hash"]):
+                    results.append(identical_job)
+                    continue
+
+                self.trajectory_store.create(job["id"], job["atoms_slab"], max_steps)
+                jobs[job["input_hash"]] = job
+                results.append(job)
+
+            self.repository.create_many(list(jobs.values()))
+
+            for job in jobs.values():
+                # cached only once they are stored, so a cached job that is not in the repository was evicted
+                self.result_cache.put(job["input_hash"], job["id"])
+                self.request_cache.put(self._request_key(job), job["id"])
+                # a job cancelled right after it is created is already in the scheduler, see _prepare_new_job
+                self._dispatch(job)
+        logger.info(f"{len(jobs)} jobs created in repository")
+
+        return results
+
+    @staticmethod
+    def _new_job(material_id: str,
+                 fmax: float,
+                 max_steps: int,
+                 max_seconds: float | None,
+                 priority: JobPriority,
+                 owner: str,
+                 model: str,
+                 dtype: str,
+                 prerelaxation: Prerelaxation | None) -> Job:
+        """Job without the structure, see _prepare_job"""
+        return {
+            "id": str(uuid.uuid4()),
+            "material_id": material_id,
             "fmax": fmax,
             "max_steps": max_steps,
-            "chemical_formula": ase_atoms.get_chemical_formula(),
-            "atoms": ase_atoms.todict(),
-            "atoms_slab": self.make_slab(ase_atoms).todict(),
-            "step_atoms": {},
-            "status": JobStatus.PENDING,
+            "max_seconds": max_seconds,
+            "model": model,
+            "dtype": dtype,
+            "prerelaxation": prerelaxation,
+            "chemical_formula": None,
+            "atoms": None,
+            "atoms_slab": None,
+            "input_hash": "",
+            "identical_job_id": None,
+            "priority": priority,
+            "owner": owner,
+            "status": JobStatus.FETCHING,
             "progress": 0.0,
+            "error": None,
             "energies": [],
             "forces": [],
-            "trajectory_file": "",
         }
 
-        self.repository.create(job)
-        logger.info(f"Job created in repository (job {job_id})")
+    def _prepare_job(self, job: Job, structure: 'Structure') -> Job:
+        """Copy of the new job with the structure and the slab, ready to be relaxed"""
+        from pymatgen.io.ase import AseAtomsAdaptor
 
-        self.task_queue.put(job)
-        logger.info(f"Job added to processing queue (job {job_id})")
+        ase_atoms = AseAtomsAdaptor.get_atoms(structure)
+        atoms = ase_atoms.todict()
+        atoms_slab = self.make_slab(ase_atoms).todict()
+        prerelaxation = job["prerelaxation"]
 
-        return job
+        return {
+            **job,
+            "chemical_formula": ase_atoms.get_chemical_formula(),
+            "atoms": atoms,
+            "atoms_slab": atoms_slab,
+            "input_hash": relaxation_key(
+                atoms_slab,
+                model=job["model"],
+                dtype=job["dtype"],
+                fmax=job["fmax"],
+                max_steps=job["max_steps"],
+                prerelaxation=dict(prerelaxation) if prerelaxation is not None else None,
+                max_seconds=job["max_seconds"],
+            ),
+            "status": JobStatus.PENDING,
+        }
+
+    @staticmethod
+    def _request_key(job: Job) -> str:
+        prerelaxation = job["prerelaxation"]
+
+        return request_key(
+            job["material_id"],
+            owner=job["owner"],
+            model=job["model"],
+            dtype=job["dtype"],
+            fmax=job["fmax"],
+            max_steps=job["max_steps"],
+            prerelaxation=dict(prerelaxation) if prerelaxation is not None else None,
+            max_seconds=job["max_seconds"],
+        )
+
+    def _prerelaxation(self, model: str | None, dtype: str | None, fmax: float) -> Prerelaxation | None:
+        """None if no pre-relaxation model is given, raises UnknownModel"""
+        if model is None:
+            return None
+
+        factory = self.calculator_registry.get(model, dtype)
+        return Prerelaxation(model=factory.model, dtype=factory.dtype, fmax=fmax)
+
+    @staticmethod
+    def _owner(mpr_api_key: str) -> str:
+        """API keys are secrets, so only their hashes are stored with the jobs"""
+        return hashlib.sha256(mpr_api_key.encode("utf-8")).hexdigest()[:16]
+
+    def _find_identical_job(self, cache: RelaxationResultCache, key: str) -> Job | None:
+        """Finished or in-flight job with the same key in the cache, failed and stopped jobs are not reused"""
+        identical_job = None
+        if (job_id := cache.get(key)) is not None:
+            try:
+                identical_job = self._get_linked_job(job_id)
+            except JobNotFound:
+                cache.forget(job_id)
+
+        if identical_job is None or identical_job["status"] in _NOT_REUSED:
+            cache.record_miss()
+            return None
+
+        cache.record_hit()
+        self.retention_manager.touch(identical_job["id"])
+        logger.info(f"Identical relaxation found, hit rate {cache.hit_rate:.2%} (job {identical_job['id']})")
+
+        return identical_job
 
     def get_job(self, job_id: str) -> Job:
+        """Job that was linked to an identical job is served by that job, see _link_job"""
         logger.info(f"Retrieving the job (job {job_id})")
-        return self.repository.get(job_id)
+        job = self._get_linked_job(job_id)
+        self.retention_manager.touch(job_id)
+        if job["id"] != job_id:
+            self.retention_manager.touch(job["id"])
 
-    def _start_message_listener(self) -> threading.Thread:
-        logger.info("Starting message listener")
-        thread = threading.Thread(target=self._listen_for_updates, daemon=True)
-        thread.start()
-        return thread
+        return job
 
-    def _listen_for_updates(self) -> None:
-        while not self._shutdown_flag:
-            try:
-                job = self.message_queue.get(timeout=5.0)
-                self.repository.update(job)
-            except queue.Empty:
-                continue
+    def _get_linked_job(self, job_id: str) -> Job:
+        """The job or the identical job it is linked to, raises JobNotFound if either is gone"""
+        job = self.repository.get(job_id)
+        if job["identical_job_id"] is None:
+            return job
 
-    def shutdown(self) -> None:
-        logger.info("Shutting down relaxation service")
+        try:
+            return self.repository.get(job["identical_job_id"])
+        except JobNotFound:
+            # the identical job was evicted before the link
+            raise JobNotFound(f"Job with id {job_id} does not exist")
+
+    def cancel_job(self, job_id: str) -> Job:
+        """
+        Cancels the job, raises JobAlreadyFinished if the job is already in a final status.
+
+        Job waiting for its structure is not prepared, waiting job is removed from the queue,
+            running job is stopped by its worker after the current step.
+        Without the dispatcher in this process the dispatcher finds the cancelled job in the shared repository.
+        """
+        # the status is changed under the lock, so the intake doesn't prepare the cancelled job
+        with self._create_lock:
+            # a link cancels the identical job, like a request that got the identical job in the response
+            job = self._get_linked_job(job_id)
+            job_id, status = job["id"], job["status"]
+            if status in FINAL_STATUSES:
+                raise JobAlreadyFinished(f"Job is already {JobStatus(status).value}")
+
+            # final statuses are not changed by the later events, so the job stays cancelled whatever its worker sends
+            event = JobStatusEvent(type=JobEventType.STATUS, job_id=job_id, status=JobStatus.CANCELLED)
+            self.repository.apply_events([event])
+
+        self.broadcaster.publish(event)
+        logger.info(f"Job cancelled in the {JobStatus(status).value} status (job {job_id})")
+
+        if self.dispatcher is not None and status != JobStatus.FETCHING:
+            self.dispatcher.cancel_job(job_id)
+
+        return self.repository.get(job_id)
 
-        logger.info("Shutting message listener")
-        self._shutdown_flag = True
-        self._message_listener.join(timeout=10.0)
-        logger.info("Message listener shut down")
+    def get_schedule(self, job: Job) -> JobSchedule:
+        """Schedule is known only to the dispatcher, it is empty in the web processes"""
+        if self.dispatcher is None:
+            return JobSchedule(queue_position=None, eta_seconds=None)
 
-        logger.info("Killing workers")
-        for i, worker in enumerate(self._workers, start=1):
-            logger.info(f"Killing worker {i}/{len(self._workers)}")
-            # I'm too lazy to implement a proper shutdown mechanism here c:
-            worker.kill()
-        logger.info("Workers killed")
+        return self.dispatcher.get_schedule(job)
 
-        logger.info("Relaxation service shut down")
+    def _dispatch(self, job: Job) -> None:
+        if self.dispatcher is not None:
+            self.dispatcher.submit(job)
+        else:
+            logger.info(f"Job is left for the dispatcher (job {job['id']})")
 
-    @classmethod
-    def fetch_structure(cls, material_id: str, mpr_api_key: str) -> Structure:
-        try:
-            with MPRester(mpr_api_key) as mpr:
-                docs = mpr.materials.summary.search(material_ids=[material_id], fields=["structure"])
-        except ValueError as e:
-            if "is not formatted correctly" in str(e):
-                raise MaterialMalformedName from e
+    def get_trajectory(self, job_id: str) -> JobTrajectory:
+        return self.trajectory_store.get(job_id)
 
-            if "Please use a new API key from" in str(e):
-                raise ApiKeyMalformed from e
+    def find_trajectory(self, job: Job) -> JobTrajectory | None:
+        """None if the job has no trajectory because its structure is not fetched (yet)"""
+        if job["atoms_slab"] is None:
+            return None
 
-            logger.exception(f"Error fetching structure for material {material_id}: {e}")
-            raise
+        return self.trajectory_store.get(job["id"])
 
-        except MPRestError as e:
-            if "status code 401" in str(e):
-                raise ApiKeyOutdated from e
+    def _fail_job(self, job_id: str, error: str) -> None:
+        event = JobStatusEvent(type=JobEventType.STATUS, job_id=job_id, status=JobStatus.FAILED, error=error)
+        self.repository.apply_events([event])
+        self.broadcaster.publish(event)
 
-            logger.exception(f"Error fetching structure for material {material_id}: {e}")
-            raise
+    def _fail_interrupted_jobs(self) -> None:
+        """API keys are not stored, so the structures of these jobs can't be fetched again"""
+        for job_id in self.repository.get_ids_by_status(JobStatus.FETCHING):
+            self._fail_job(job_id, "Service was restarted before the structure was fetched, create the job again")
+
+    def shutdown(self) -> None:
+        logger.info("Stopping job intake")
+        self.intake.stop()
 
-        if not docs:
-            raise MaterialNotFound(f"Material {material_id} not found")
+        if self._event_poller is not None:
+            logger.info("Stopping event poller")
+            self._event_poller.stop()
 
-        return cast(Structure, docs[0].structure)
+    def fetch_structure(self, material_id: str, mpr_api_key: str) -> 'Structure':
+        with STRUCTURE_FETCH_SECONDS.time():
+            return self.structure_source.fetch(material_id, mpr_api_key)
 
     @staticmethod
     def make_slab(atoms: Atoms) -> Atoms:
+        from ase import build
+
         while len(atoms) < 15:
             atoms *= (2, 2, 2)
 
@@ -168,13 +497,8 @@ class RelaxationService:
 
         return atoms
 
-    @classmethod
-    def get_trajectory_xyz(cls, job: Job) -> StringIO:
-        if not job["trajectory_file"]:
-            raise TrajectoryIsEmpty("Trajectory is empty")
-
-        traj = io.read(job["trajectory_file"], ":")
-        buffer = StringIO()
-        io.write(buffer, traj, format="xyz")
-
-        return buffer
+    def export_trajectory(self,
+                          job: Job,
+                          structure_format: TrajectoryFormat,
+                          compress: bool = False) -> TrajectoryExport:
+        return self.trajectory_exporter.export(job, structure_format, compress)
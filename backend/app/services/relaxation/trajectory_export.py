@@ -0,0 +1,194 @@
+import enum
+import io
+import os
+import shutil
+import tempfile
+import zlib
+from dataclasses import dataclass
+from typing import Callable, Iterator
+
+import numpy as np
+from ase import Atoms
+
+from logger import logger
+from .job import Job, JobStatus
+from .trajectory_store import JobTrajectory, TrajectoryNotFound, TrajectoryStore, directory_size
+
+
+class TrajectoryIsEmpty(Exception):
+    pass
+
+
+class TrajectoryFormat(str, enum.Enum):
+    XYZ = "xyz"
+    EXTXYZ = "extxyz"
+    NPZ = "npz"
+
+
+_MEDIA_TYPES = {
+    TrajectoryFormat.XYZ: "chemical/x-xyz",
+    TrajectoryFormat.EXTXYZ: "chemical/x-extxyz",
+    TrajectoryFormat.NPZ: "application/x-npz",
+}
+
+_CHUNK_SIZE = 64 * 1024
+
+
+@dataclass
+class TrajectoryExport:
+    """Either a ready file (cached export) or chunks that are encoded while they are sent"""
+    filename: str
+    media_type: str
+    path: str | None = None
+    chunks: Iterator[bytes] | None = None
+
+
+class TrajectoryExporter:
+    """
+    Encodes the trajectory from the TrajectoryStore frame by frame,
+        so the whole encoded trajectory is never held in memory.
+
+    Trajectories of finished jobs never change, so their exports are written to cache_dir (a directory per job)
+        while they are streamed for the first time and served from the disk afterwards.
+    """
+    def __init__(self, cache_dir: str, trajectory_store: TrajectoryStore) -> None:
+        self.cache_dir = cache_dir
+        self.trajectory_store = trajectory_store
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self._write_listeners: list[Callable[[str], None]] = []
+
+    def add_write_listener(self, listener: Callable[[str], None]) -> None:
+        """Listener is called with the job ID when an export of the job is written to the cache"""
+        self._write_listeners.append(listener)
+
+    @staticmethod
+    def media_type(structure_format: TrajectoryFormat) -> str:
+        return _MEDIA_TYPES[structure_format]
+
+    @staticmethod
+    def format_from_accept(accept: str | None) -> TrajectoryFormat:
+        for structure_format, media_type in _MEDIA_TYPES.items():
+            if accept and media_type in accept:
+                return structure_format
+
+        return TrajectoryFormat.XYZ
+
+    def export(self, job: Job, structure_format: TrajectoryFormat, compress: bool) -> TrajectoryExport:
+        try:
+            trajectory = self.trajectory_store.get(job["id"])
+        except TrajectoryNotFound as e:
+            raise TrajectoryIsEmpty("Trajectory is empty") from e
+
+        if trajectory.length == 0:
+            raise TrajectoryIsEmpty("Trajectory is empty")
+
+        filename = f"trajectory_{job['id']}.{structure_format.value}"
+        media_type = self.media_type(structure_format)
+        if compress:
+            filename += ".gz"
+            media_type = "application/gzip"
+
+        cache_path = os.path.join(self._job_directory(job["id"]), filename)
+        if os.path.exists(cache_path):
+            return TrajectoryExport(filename=filename, media_type=media_type, path=cache_path)
+
+        chunks = self._encode(trajectory, trajectory.length, structure_format)
+        if compress:
+            chunks = _gzip(chunks)
+
+        # trajectory of the running job is still growing, so it can't be cached
+        if job["status"] == JobStatus.FINISHED:
+            os.makedirs(self._job_directory(job["id"]), exist_ok=True)
+            chunks = self._notify_written(_tee_to_file(chunks, cache_path), job["id"])
+
+        return TrajectoryExport(filename=filename, media_type=media_type, chunks=chunks)
+
+    def evict(self, job_id: str) -> None:
+        """Remove cached exports of the job"""
+        shutil.rmtree(self._job_directory(job_id), ignore_errors=True)
+
+    def size_bytes(self, job_id: str) -> int:
+        return directory_size(self._job_directory(job_id))
+
+    def job_ids(self) -> list[str]:
+        """IDs of the jobs with cached exports"""
+        return [entry.name for entry in os.scandir(self.cache_dir) if entry.is_dir()]
+
+    def _job_directory(self, job_id: str) -> str:
+        return os.path.join(self.cache_dir, job_id)
+
+    def _notify_written(self, chunks: Iterator[bytes], job_id: str) -> Iterator[bytes]:
+        # listeners are not called if the export is not sent to the end, the file is not written then
+        yield from chunks
+
+        for listener in self._write_listeners:
+            try:
+                listener(job_id)
+            except Exception as e:
+                logger.exception(f"Error in export write listener: {e} (job {job_id})")
+
+    def _encode(self,
+                trajectory: JobTrajectory,
+                length: int,
+                structure_format: TrajectoryFormat) -> Iterator[bytes]:
+        if structure_format == TrajectoryFormat.NPZ:
+            yield from _encode_npz(trajectory, length)
+            return
+
+        from ase.io import write
+
+        for step in range(1, length + 1):
+            atoms = Atoms.fromdict(trajectory.atoms(step))
+            atoms.info.update(
+                step=step,
+                energy=float(trajectory.energies[step - 1]),
+                fmax=float(trajectory.forces[step - 1]),
+            )
+
+            buffer = io.StringIO()
+            write(buffer, atoms, format=structure_format.value)
+            yield buffer.getvalue().encode("utf-8")
+
+
+def _encode_npz(trajectory: JobTrajectory, length: int) -> Iterator[bytes]:
+    """NPZ is a zip archive, so it is written at once, arrays are taken from the mapped files without copies"""
+    # the archive is written to the disk, not to memory, and read back in chunks
+    with tempfile.TemporaryFile() as file:
+        np.savez_compressed(
+            file,
+            numbers=trajectory.topology["numbers"],
+            cell=trajectory.topology["cell"],
+            pbc=trajectory.topology["pbc"],
+            positions=trajectory.positions[:length],
+            energies=trajectory.energies[:length],
+            fmax=trajectory.forces[:length],
+        )
+        file.seek(0)
+
+        while chunk := file.read(_CHUNK_SIZE):
+            yield chunk
+
+
+def _gzip(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(wbits=31)  # 31 means gzip container
+    for chunk in chunks:
+        if compressed := compressor.compress(chunk):
+            yield compressed
+
+    yield compressor.flush()
+
+
+def _tee_to_file(chunks: Iterator[bytes], path: str) -> Iterator[bytes]:
+    """Yield chunks and write them to the file, the file appears only if all chunks were written"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            for chunk in chunks:
+                file.write(chunk)
+                yield chunk
+
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
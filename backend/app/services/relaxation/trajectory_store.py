@@ -0,0 +1,175 @@
+import os
+import shutil
+from collections import OrderedDict
+from threading import Lock
+from typing import Any
+
+import numpy as np
+import numpy.typing as npt
+from numpy.lib.format import open_memmap
+
+from .checkpoint import Checkpoint, load_checkpoint, save_checkpoint
+
+
+class TrajectoryNotFound(Exception):
+    pass
+
+
+class JobTrajectory:
+    """
+    Trajectory of a single job in its own directory.
+
+    Cell is fixed during the relaxation, so only the positions change between steps:
+        the topology (numbers, cell, pbc) is stored once, positions, energies and max forces of the steps
+        are stored in arrays preallocated for max_steps and memory-mapped from .npy files.
+    Step N is stored at index N - 1, the number of written steps is stored in the length file.
+    """
+    def __init__(self, directory: str) -> None:
+        # ase.io imports scipy, it is not needed until the first trajectory is opened
+        from ase.io.jsonio import decode
+
+        self.directory = directory
+
+        with open(os.path.join(directory, "topology.json")) as file:
+            self.topology: dict[str, Any] = decode(file.read())
+
+        self.positions = open_memmap(os.path.join(directory, "positions.npy"), mode="r+")
+        self.energies = open_memmap(os.path.join(directory, "energies.npy"), mode="r+")
+        self.forces = open_memmap(os.path.join(directory, "forces.npy"), mode="r+")
+        self._length = open_memmap(os.path.join(directory, "length.npy"), mode="r+")
+
+    @classmethod
+    def create(cls, directory: str, atoms: dict[str, Any], max_steps: int) -> "JobTrajectory":
+        from ase.io.jsonio import encode
+
+        os.makedirs(directory, exist_ok=True)
+
+        topology = {key: value for key, value in atoms.items() if key != "positions"}
+        with open(os.path.join(directory, "topology.json"), "w") as file:
+            file.write(encode(topology))
+
+        # optimizer reports the initial structure as well, so there are up to max_steps + 1 steps
+        capacity = max_steps + 1
+        n_atoms = len(atoms["numbers"])
+        for name, shape in (
+            ("positions", (capacity, n_atoms, 3)),
+            ("energies", (capacity,)),
+            ("forces", (capacity,)),
+        ):
+            # files are sparse, the disk is used only by the written steps
+            open_memmap(os.path.join(directory, f"{name}.npy"), mode="w+", dtype=np.float64, shape=shape)
+        open_memmap(os.path.join(directory, "length.npy"), mode="w+", dtype=np.int64, shape=(1,))
+
+        return cls(directory)
+
+    @property
+    def length(self) -> int:
+        """Number of written steps"""
+        return int(self._length[0])
+
+    def write_step(self, step: int, positions: npt.NDArray[np.float64], energy: float, force: float) -> None:
+        """Writing the same step twice is harmless"""
+        self.positions[step - 1] = positions
+        self.energies[step - 1] = energy
+        self.forces[step - 1] = force
+        # length is updated last, so readers never see a step that is not written yet
+        self._length[0] = max(self.length, step)
+
+    def atoms(self, step: int) -> dict[str, Any]:
+        """Atoms of the step in the Atoms.todict() format, positions are a view of the mapped file"""
+        return {**self.topology, "positions": self.positions[step - 1]}
+
+    def write_checkpoint(self, checkpoint: Checkpoint) -> None:
+        """The previous checkpoint is replaced only when the new one is completely written"""
+        path = os.path.join(self.directory, "checkpoint.npz")
+        save_checkpoint(f"{path}.tmp", checkpoint)
+        os.replace(f"{path}.tmp", path)
+
+    def read_checkpoint(self) -> Checkpoint | None:
+        path = os.path.join(self.directory, "checkpoint.npz")
+        if not os.path.exists(path):
+            return None
+
+        return load_checkpoint(path)
+
+
+class TrajectoryStore:
+    """
+    Trajectories of all jobs, every job has its own directory with memory-mapped arrays.
+
+    Up to max_open trajectories are kept open (in LRU order),
+        views of the evicted ones stay valid while somebody is using them.
+    """
+    def __init__(self, directory: str, max_open: int = 256) -> None:
+        self.directory = directory
+        self.max_open = max_open
+
+        self._open: OrderedDict[str, JobTrajectory] = OrderedDict()
+        self._lock = Lock()
+
+        os.makedirs(directory, exist_ok=True)
+
+    def create(self, job_id: str, atoms: dict[str, Any], max_steps: int) -> JobTrajectory:
+        trajectory = JobTrajectory.create(self._job_directory(job_id), atoms, max_steps)
+
+        with self._lock:
+            self._put(job_id, trajectory)
+
+        return trajectory
+
+    def get(self, job_id: str) -> JobTrajectory:
+        with self._lock:
+            if (trajectory := self._open.get(job_id)) is not None:
+                self._open.move_to_end(job_id)
+                return trajectory
+
+            directory = self._job_directory(job_id)
+            if not os.path.exists(os.path.join(directory, "length.npy")):
+                raise TrajectoryNotFound(f"Trajectory of job {job_id} not found")
+
+            trajectory = JobTrajectory(directory)
+            self._put(job_id, trajectory)
+
+            return trajectory
+
+    def write_step(self,
+                   job_id: str,
+                   step: int,
+                   positions: npt.NDArray[np.float64],
+                   energy: float,
+                   force: float) -> None:
+        self.get(job_id).write_step(step, positions, energy, force)
+
+    def job_ids(self) -> list[str]:
+        """IDs of all stored trajectories, including the ones that are not open"""
+        return [entry.name for entry in os.scandir(self.directory) if entry.is_dir()]
+
+    def size_bytes(self, job_id: str) -> int:
+        return directory_size(self._job_directory(job_id))
+
+    def created_at(self, job_id: str) -> float:
+        return os.stat(self._job_directory(job_id)).st_mtime
+
+    def delete(self, job_id: str) -> None:
+        with self._lock:
+            self._open.pop(job_id, None)
+
+        shutil.rmtree(self._job_directory(job_id), ignore_errors=True)
+
+    def _job_directory(self, job_id: str) -> str:
+        return os.path.join(self.directory, job_id)
+
+    def _put(self, job_id: str, trajectory: JobTrajectory) -> None:
+        self._open[job_id] = trajectory
+        self._open.move_to_end(job_id)
+
+        while len(self._open) > self.max_open:
+            self._open.popitem(last=False)
+
+
+def directory_size(directory: str) -> int:
+    """Disk space used by the files of the directory, sparse files are counted by the allocated blocks"""
+    try:
+        return sum(entry.stat().st_blocks * 512 for entry in os.scandir(directory) if entry.is_file())
+    except FileNotFoundError:
+        return 0
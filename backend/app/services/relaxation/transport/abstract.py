@@ -0,0 +1,79 @@
+from abc import abstractmethod
+from typing import Callable, Protocol, TypeVar
+
+from services.relaxation.events import JobEvent
+from services.relaxation.job import Job
+
+T = TypeVar("T")
+T_co = TypeVar("T_co", covariant=True)
+T_contra = TypeVar("T_contra", contravariant=True)
+
+
+class SendChannel(Protocol[T_contra]):
+    """Sending end of a one way channel, e.g. the scheduler puts the jobs to the task queue"""
+
+    def put(self, item: T_contra) -> None:
+        ...
+
+
+class ReceiveChannel(Protocol[T_co]):
+    """Receiving end of a one way channel with the interface of multiprocessing.Queue, get raises queue.Empty"""
+
+    def get(self, block: bool = True, timeout: float | None = None) -> T_co:
+        ...
+
+    def get_nowait(self) -> T_co:
+        ...
+
+
+class Channel(SendChannel[T], ReceiveChannel[T], Protocol[T]):
+    """
+    Both ends of a one way channel, e.g. a multiprocessing.Queue shared by the dispatcher and the workers.
+    Remote workers get only the end they use, see TcpWorkerConnection.
+    """
+
+
+class AbstractJobTransport:
+    """
+    Channels between the dispatcher and the workers.
+
+    The scheduler puts the dispatched jobs to the task queue, workers take them from it
+        and send the events of the jobs to the message queue, the dispatcher applies them to the repository.
+    Workers of the pool run in the dispatcher process, transports may also serve remote workers:
+        they take the jobs from the same task queue, their capacity is added to the capacity of the pool.
+    """
+
+    @property
+    @abstractmethod
+    def task_queue(self) -> Channel[Job]:
+        pass
+
+    @property
+    @abstractmethod
+    def message_queue(self) -> Channel[JobEvent]:
+        pass
+
+    @property
+    def remote_slots(self) -> int:
+        """Number of jobs the connected remote workers can relax at the same time"""
+        return 0
+
+    @property
+    def remote_active_jobs(self) -> int:
+        """Number of jobs taken by the remote workers"""
+        return 0
+
+    def cancel(self, job_id: str) -> None:
+        """Stops the job after its current step, if a remote worker is running it"""
+        pass
+
+    def add_lost_job_listener(self, listener: Callable[[str], None]) -> None:
+        """Listener is called with the ID of an unfinished job that a remote worker gave up, it should be requeued"""
+        pass
+
+    def start(self) -> None:
+        pass
+
+    def stop(self, timeout: float) -> None:
+        """Drains the remote workers, jobs that are not stopped in time are left to the next dispatcher"""
+        pass
@@ -0,0 +1,25 @@
+from multiprocessing import Queue
+
+from services.relaxation.events import JobEvent
+from services.relaxation.job import Job
+from services.relaxation.transport.abstract import AbstractJobTransport
+
+
+class LocalJobTransport(AbstractJobTransport):
+    """
+    Multiprocessing queues shared with the workers of the pool, which are forked from the dispatcher process.
+
+    No remote workers, all jobs are relaxed on this host.
+    """
+
+    def __init__(self) -> None:
+        self._task_queue: Queue[Job] = Queue()
+        self._message_queue: Queue[JobEvent] = Queue()
+
+    @property
+    def task_queue(self) -> 'Queue[Job]':
+        return self._task_queue
+
+    @property
+    def message_queue(self) -> 'Queue[JobEvent]':
+        return self._message_queue
@@ -0,0 +1,331 @@
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from multiprocessing.connection import Client, Connection, Listener, answer_challenge, deliver_challenge
+from multiprocessing.synchronize import Event
+from typing import Callable
+
+from logger import logger
+from services.relaxation.events import JobEvent, JobEventType
+from services.relaxation.job import FINAL_STATUSES, Job, JobStatus
+from services.relaxation.transport.local import LocalJobTransport
+
+# Longest time the broker waits for a job before it answers that there is none,
+#   so it notices the drain and the lost workers in time
+_MAX_TAKE_TIMEOUT = 1.0
+
+
+@dataclass
+class _RemoteWorker:
+    address: str
+    slots: int = 0
+    # IDs of the jobs the worker has taken and not finished yet
+    leases: set[str] = field(default_factory=set)
+    last_seen: float = field(default_factory=time.monotonic)
+    drained: bool = False
+    # IDs of the cancelled jobs of the worker that are not sent to it yet
+    cancels: list[str] = field(default_factory=list)
+
+
+class TcpJobTransport(LocalJobTransport):
+    """
+    Broker of the remote workers (see commands.worker), workers of the pool use the local queues as before.
+
+    Remote workers connect over TCP and are authenticated with the shared authkey
+        (messages are pickled, so only the holders of the authkey may connect).
+    A worker reports how many jobs it relaxes at the same time and takes the jobs from the task queue one by one,
+        a taken job is leased to the worker until the job is finished, failed or stopped.
+    Cancellations of the leased jobs are sent to their workers with the next message.
+    Jobs of a worker that disconnects, sends nothing for lease_timeout seconds or is drained on its own
+        (e.g. its host is shut down) are given to the lost job listeners, so another worker resumes them.
+    """
+
+    def __init__(self, host: str, port: int, authkey: str, lease_timeout: float = 600.0) -> None:
+        if not authkey:
+            raise ValueError("TCP transport needs an authkey shared with the remote workers")
+
+        super().__init__()
+        self.address = (host, port)
+        self.lease_timeout = lease_timeout
+        self._authkey = authkey.encode()
+
+        self._workers: list[_RemoteWorker] = []
+        self._lost_job_listeners: list[Callable[[str], None]] = []
+        self._listener: Listener | None = None
+        self._lock = threading.Lock()
+        # remote workers stop taking jobs and checkpoint the running ones
+        self._draining = threading.Event()
+        self._stop_event = threading.Event()
+
+    @property
+    def remote_slots(self) -> int:
+        with self._lock:
+            return sum(worker.slots for worker in self._workers)
+
+    @property
+    def remote_active_jobs(self) -> int:
+        with self._lock:
+            return sum(len(worker.leases) for worker in self._workers)
+
+    def cancel(self, job_id: str) -> None:
+        with self._lock:
+            for worker in self._workers:
+                if job_id in worker.leases:
+                    worker.cancels.append(job_id)
+
+    def add_lost_job_listener(self, listener: Callable[[str], None]) -> None:
+        self._lost_job_listeners.append(listener)
+
+    def start(self) -> None:
+        # workers authenticate in their own threads, so a silent connection doesn't block the others
+        self._listener = Listener(self.address)
+        logger.info(f"Waiting for remote workers on {self.address[0]}:{self.address[1]}")
+
+        thread = threading.Thread(target=self._accept, args=(self._listener,), daemon=True)
+        thread.start()
+
+    def stop(self, timeout: float) -> None:
+        self._draining.set()
+
+        deadline = time.monotonic() + timeout
+        while self.remote_active_jobs and time.monotonic() < deadline:
+            time.sleep(0.1)
+
+        if active_jobs := self.remote_active_jobs:
+            logger.warning(f"{active_jobs} jobs of the remote workers were not drained in time")
+
+        self._stop_event.set()
+        if self._listener is not None:
+            self._listener.close()
+
+    def _accept(self, listener: Listener) -> None:
+        while not self._stop_event.is_set():
+            try:
+                connection = listener.accept()
+            except OSError as e:
+                if self._stop_event.is_set():
+                    return
+
+                logger.exception(f"Error accepting remote worker: {e}")
+                continue
+
+            host, port = listener.last_accepted
+            thread = threading.Thread(target=self._serve, args=(connection, f"{host}:{port}"), daemon=True)
+            thread.start()
+
+    def _serve(self, connection: Connection, address: str) -> None:
+        try:
+            deliver_challenge(connection, self._authkey)
+            answer_challenge(connection, self._authkey)
+        except Exception as e:
+            logger.warning(f"Remote worker {address} is not authenticated: {e}")
+            connection.close()
+            return
+
+        worker = _RemoteWorker(address)
+        with self._lock:
+            self._workers.append(worker)
+
+        logger.info(f"Remote worker {address} connected")
+
+        try:
+            self._serve_worker(connection, worker)
+        except (EOFError, OSError) as e:
+            logger.warning(f"Lost connection to remote worker {address}: {e}")
+        finally:
+            connection.close()
+            with self._lock:
+                self._workers.remove(worker)
+                lost_job_ids = list(worker.leases)
+
+            # jobs that were not drained in time are resumed by the next dispatcher
+            if not self._draining.is_set():
+                for job_id in lost_job_ids:
+                    self._job_lost(job_id)
+
+    def _serve_worker(self, connection: Connection, worker: _RemoteWorker) -> None:
+        while True:
+            if self._draining.is_set() and not worker.drained:
+                connection.send(("drain", None))
+                worker.drained = True
+
+            with self._lock:
+                cancels, worker.cancels = worker.cancels, []
+            for job_id in cancels:
+                connection.send(("cancel", job_id))
+
+            # the drain is sent before the connection is closed, so the worker doesn't take it for a lost dispatcher
+            if self._stop_event.is_set():
+                return
+
+            if not connection.poll(_MAX_TAKE_TIMEOUT):
+                silence = time.monotonic() - worker.last_seen
+                if worker.leases and silence > self.lease_timeout:
+                    logger.warning(f"Remote worker {worker.address} sent nothing for {silence:.0f} s, dropping it")
+                    return
+                continue
+
+            kind, payload = connection.recv()
+            worker.last_seen = time.monotonic()
+
+            if kind == "hello":
+                worker.slots = payload
+                logger.info(f"Remote worker {worker.address} relaxes up to {payload} jobs")
+            elif kind == "take":
+                self._send_job(connection, worker, payload)
+            elif kind == "event":
+                self._receive_event(worker, payload)
+            else:
+                logger.warning(f"Unknown message {kind} from remote worker {worker.address}")
+
+    def _send_job(self, connection: Connection, worker: _RemoteWorker, timeout: float) -> None:
+        job: Job | None = None
+        if not self._draining.is_set():
+            try:
+                if timeout > 0:
+                    job = self.task_queue.get(timeout=min(timeout, _MAX_TAKE_TIMEOUT))
+                else:
+                    job = self.task_queue.get_nowait()
+            except queue.Empty:
+                pass
+
+        if job is None:
+            connection.send(("empty", None))
+            return
+
+        # the lease is taken before the job is sent, if sending fails the job is requeued with the other leases
+        with self._lock:
+            worker.leases.add(job["id"])
+
+        connection.send(("task", job))
+        logger.info(f"Job leased to remote worker {worker.address} (job {job['id']})")
+
+    def _receive_event(self, worker: _RemoteWorker, event: JobEvent) -> None:
+        self.message_queue.put(event)
+
+        job_id = event["job_id"]
+        released = event["type"] == JobEventType.SUMMARY or (
+            event["type"] == JobEventType.STATUS
+            and (event["status"] in FINAL_STATUSES or event["status"] == JobStatus.PENDING)
+        )
+        if not released:
+            return
+
+        with self._lock:
+            worker.leases.discard(job_id)
+
+        # the worker was drained on its own, the job was checkpointed and is resumed by another worker
+        if event["type"] == JobEventType.STATUS and event["status"] == JobStatus.PENDING:
+            if not self._draining.is_set():
+                self._job_lost(job_id)
+
+    def _job_lost(self, job_id: str) -> None:
+        logger.info(f"Job of a remote worker is lost (job {job_id})")
+        for listener in self._lost_job_listeners:
+            try:
+                listener(job_id)
+            except Exception as e:
+                logger.exception(f"Error in lost job listener: {e} (job {job_id})")
+
+
+class TcpWorkerConnection:
+    """
+    Connection of a remote worker to the TcpJobTransport of the dispatcher, see commands.worker.
+
+    Its task_queue and message_queue are given to the worker instead of the multiprocessing queues,
+        they are only the ends the worker uses: jobs are taken from the one and events are sent to the other.
+    drain_event is set when the dispatcher drains its workers or the connection is lost,
+        so the worker checkpoints and stops its jobs like the local workers do.
+    Cancellations of the jobs are given to the cancel listeners, e.g. RelaxationWorker.cancel.
+    """
+
+    def __init__(self, address: tuple[str, int], authkey: str, slots: int, drain_event: Event) -> None:
+        self.drain_event = drain_event
+        self._connection = Client(address, authkey=authkey.encode())
+        # the batched worker sends the events of its relaxations from several threads
+        self._lock = threading.Lock()
+        self._cancel_listeners: list[Callable[[str], None]] = []
+
+        self._connection.send(("hello", slots))
+
+        self.task_queue = _RemoteTaskQueue(self)
+        self.message_queue = _RemoteMessageQueue(self)
+
+    def add_cancel_listener(self, listener: Callable[[str], None]) -> None:
+        self._cancel_listeners.append(listener)
+
+    def take(self, timeout: float) -> Job:
+        """Raises queue.Empty if there is no job, the broker waits for a job for up to a second"""
+        with self._lock:
+            try:
+                self._connection.send(("take", timeout))
+                while True:
+                    kind, payload = self._connection.recv()
+                    if kind == "task":
+                        return payload
+                    if kind == "empty":
+                        raise queue.Empty()
+
+                    self._receive(kind, payload)
+            except (EOFError, OSError) as e:
+                self._lost(e)
+                raise queue.Empty()
+
+    def send(self, event: JobEvent) -> None:
+        with self._lock:
+            try:
+                self._connection.send(("event", event))
+                # the broker sends the drain and the cancellations on its own, they wait here until the next message
+                while self._connection.poll():
+                    self._receive(*self._connection.recv())
+            except (EOFError, OSError) as e:
+                self._lost(e)
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def _receive(self, kind: str, payload: str | None) -> None:
+        if kind == "drain":
+            logger.info("Dispatcher drains the workers")
+            self.drain_event.set()
+        elif kind == "cancel" and payload is not None:
+            for listener in self._cancel_listeners:
+                listener(payload)
+
+    def _lost(self, error: Exception) -> None:
+        """Jobs of the worker are requeued by the dispatcher"""
+        if not self.drain_event.is_set():
+            logger.warning(f"Lost connection to the dispatcher: {error}")
+            self.drain_event.set()
+
+
+class _RemoteTaskQueue:
+    """Receiving end of the task queue of the dispatcher, jobs are taken from the broker one by one"""
+    def __init__(self, connection: TcpWorkerConnection) -> None:
+        self._connection = connection
+
+    def get(self, block: bool = True, timeout: float | None = None) -> Job:
+        if not block:
+            return self._connection.take(0.0)
+
+        while timeout is None:
+            try:
+                return self._connection.take(_MAX_TAKE_TIMEOUT)
+            except queue.Empty:
+                if self._connection.drain_event.is_set():
+                    raise
+
+        return self._connection.take(timeout)
+
+    def get_nowait(self) -> Job:
+        return self.get(block=False)
+
+
+class _RemoteMessageQueue:
+    """Sending end of the message queue of the dispatcher"""
+    def __init__(self, connection: TcpWorkerConnection) -> None:
+        self._connection = connection
+
+    def put(self, event: JobEvent) -> None:
+        self._connection.send(event)
@@ -1,74 +1,469 @@
 import io
+import multiprocessing
+import pickle
+import queue
+import threading
 import time
-import tempfile
-from multiprocessing import Process, Queue
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, Iterator
+from multiprocessing import Process
+from multiprocessing.synchronize import Event
 
 from ase import Atoms
-from ase.optimize.precon import PreconLBFGS
-from mace.calculators import MACECalculator
+from ase.calculators.calculator import Calculator, all_changes
 
 from logger import logger
-from utils.calculator_factory import MACECalculatorFactory
+from utils.calculator_factory import AbstractCalculatorFactory, CalculatorRegistry
+from .checkpoint import Checkpoint, capture_checkpoint, restore_checkpoint
+from .events import JobCheckpointEvent, JobEvent, JobEventType, JobStatusEvent, JobStepEvent, JobSummaryEvent
 from .job import Job, JobStatus
+from .transport.abstract import ReceiveChannel, SendChannel
+
+# the service creates the workers, so the optimizer and torch are imported only when the worker runs
+if TYPE_CHECKING:
+    from ase.optimize.precon import PreconLBFGS
+
+
+class JobDrained(Exception):
+    """Raised from the optimizer callback to stop the job when the worker is drained"""
+    pass
+
+
+class JobStopped(Exception):
+    """Raised from the optimizer callback when the job is cancelled or runs longer than its wall time budget"""
+    def __init__(self, status: JobStatus) -> None:
+        super().__init__(status.value)
+        self.status = status
+
+
+# Pickled size is measured for one in this many events, pickling every event again costs as much as sending it
+_MESSAGE_BYTES_SAMPLE_INTERVAL = 100
+
+# Bytes reserved for a job ID in the lease slots shared with the pool, job IDs are UUIDs
+_JOB_ID_BYTES = 64
+
+
+class TimedCalculator(Calculator):
+    """Delegates to the calculator and sums the time spent in it"""
+    implemented_properties = ["energy", "free_energy", "forces"]
+
+    def __init__(self, calculator: Calculator, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self.calculator = calculator
+        self.seconds = 0.0
+
+    def calculate(self,
+                  atoms: Atoms | None = None,
+                  properties: list[str] | None = None,
+                  system_changes: list[str] = all_changes) -> None:
+        super().calculate(atoms, properties, system_changes)
+
+        start = time.perf_counter()
+        self.calculator.calculate(self.atoms, properties, system_changes)
+        self.seconds += time.perf_counter() - start
+
+        self.results = dict(self.calculator.results)
 
 
 class RelaxationWorker(Process):
+    """
+    Relaxes jobs from the task queue one by one.
+
+    Optimizer state is checkpointed every checkpoint_interval steps, so the job can be resumed after the worker dies.
+    When drain_event is set, the running job is checkpointed and stopped, and no new jobs are taken.
+    A retired worker finishes its running jobs and exits.
+    Cancelled jobs and jobs that run longer than their max_seconds are stopped after the current step,
+        the steps taken until then are kept.
+
+    Every job is relaxed with the model and dtype it requested,
+        up to max_models loaded models are kept, the least recently used one is unloaded first.
+
+    Heartbeat, number of running jobs, the torch threads budget and the leases are shared with the WorkerPool.
+    A job is leased to the worker as soon as it is taken from the task queue, until the worker is done with it,
+        so the pool knows which jobs to requeue if the worker dies, even before the job has reported RUNNING.
+    """
     def __init__(self,
-                 calculator_factory: MACECalculatorFactory,
-                 task_queue: 'Queue[Job]',
-                 message_queue: 'Queue[Job]') -> None:
+                 calculator_registry: CalculatorRegistry,
+                 task_queue: 'ReceiveChannel[Job]',
+                 message_queue: 'SendChannel[JobEvent]',
+                 drain_event: Event,
+                 checkpoint_interval: int = 10,
+                 max_models: int = 2) -> None:
         super().__init__()
         self.task_queue = task_queue
         self.message_queue = message_queue
+        self.drain_event = drain_event
+        self.checkpoint_interval = checkpoint_interval
+
+        self.calculator_registry = calculator_registry
+        self.max_models = max_models
+        # loaded calculators by (model, dtype), the most recently used last
+        self._calculators: OrderedDict[tuple[str, str], Calculator] = OrderedDict()
+
+        self._retire_event = multiprocessing.Event()
+        # 0 until the worker is ready to take jobs
+        self._heartbeat = multiprocessing.Value("d", 0.0)
+        # when the process was started, 0 before that
+        self.started_at = 0.0
+        self._active_jobs = multiprocessing.Value("i", 0)
+        self._idle_since = multiprocessing.Value("d", time.time())
+        # 0 keeps the torch default
+        self._num_threads = multiprocessing.Value("i", 0)
+        self._applied_num_threads = 0
+        # ID of the job in every slot, empty if the slot is free
+        self._leases = [multiprocessing.Array("c", _JOB_ID_BYTES) for _ in range(self.slots)]
+
+        # IDs of the jobs to cancel are sent by the pool (see cancel) and read by the worker before every step
+        self._cancel_receiver, self._cancel_sender = multiprocessing.Pipe(duplex=False)
+        self._cancel_send_lock = threading.Lock()
+        self._cancel_receive_lock = threading.Lock()
+        # cancels of the other jobs are dropped, e.g. they come after the job has ended
+        self._running_job_ids: set[str] = set()
+        self._cancelled: set[str] = set()
+
+        # events sent by this worker, every _MESSAGE_BYTES_SAMPLE_INTERVAL-th one is measured
+        self._sent_events = 0
+
+    @property
+    def last_heartbeat(self) -> float:
+        return self._heartbeat.value
+
+    @property
+    def active_jobs(self) -> int:
+        return self._active_jobs.value
+
+    @property
+    def idle_since(self) -> float:
+        return self._idle_since.value
+
+    @property
+    def slots(self) -> int:
+        """Number of jobs the worker relaxes at the same time"""
+        return 1
 
-        self.calculator_factory = calculator_factory
+    @property
+    def leased_job_ids(self) -> list[str]:
+        """Jobs the worker has taken and not finished, failed or stopped yet"""
+        job_ids = []
+        for lease in self._leases:
+            with lease.get_lock():
+                if lease.value:
+                    job_ids.append(lease.value.decode())
+
+        return job_ids
+
+    def set_num_threads(self, num_threads: int) -> None:
+        """Applied by the worker before its next job"""
+        self._num_threads.value = num_threads
+
+    def retire(self) -> None:
+        self._retire_event.set()
+
+    def start(self) -> None:
+        self.started_at = time.time()
+        super().start()
+
+    def cancel(self, job_id: str) -> None:
+        """Stops the job after its current step, if the worker is running it"""
+        with self._cancel_send_lock:
+            self._cancel_sender.send(job_id)
 
     def run(self) -> None:
+        self._load_default_calculator()
+
+        while not self._stopping():
+            self._beat()
+            self._apply_num_threads()
+
+            try:
+                job = self._take_job(timeout=1.0)
+            except queue.Empty:
+                continue
+
+            self._run_job(job)
+
+        logger.info("Worker stopped")
+
+    def _take_job(self, block: bool = True, timeout: float | None = None) -> Job:
+        """Job from the task queue, leased to the worker until _run_job is done with it"""
+        job = self.task_queue.get(block=block, timeout=timeout)
+
+        for lease in self._leases:
+            with lease.get_lock():
+                if not lease.value:
+                    lease.value = job["id"].encode()
+                    return job
+
+        # the worker takes a job only when it has a free slot
+        raise RuntimeError(f"No free lease slot for job {job['id']}")
+
+    def _release_job(self, job_id: str) -> None:
+        for lease in self._leases:
+            with lease.get_lock():
+                if lease.value == job_id.encode():
+                    lease.value = b""
+                    return
+
+    def _cancel_requested(self, job_id: str) -> bool:
+        with self._cancel_receive_lock:
+            while self._cancel_receiver.poll():
+                if (cancelled_job_id := self._cancel_receiver.recv()) in self._running_job_ids:
+                    self._cancelled.add(cancelled_job_id)
+
+            return job_id in self._cancelled
+
+    def _stopping(self) -> bool:
+        return self.drain_event.is_set() or self._retire_event.is_set()
+
+    def _beat(self) -> None:
+        self._heartbeat.value = time.time()
+
+    def _apply_num_threads(self) -> None:
+        num_threads = self._num_threads.value
+        if num_threads and num_threads != self._applied_num_threads:
+            import torch
+
+            torch.set_num_threads(num_threads)
+            self._applied_num_threads = num_threads
+            logger.info(f"Worker uses {num_threads} threads")
+
+    def _load_default_calculator(self) -> None:
+        """Most jobs use the default model, so it is loaded before the worker takes jobs"""
         while True:
             try:
-                calculator = self.calculator_factory.create()
-                break
+                self._load_calculator(self.calculator_registry.get())
+                return
             except Exception as e:
                 logger.exception(f"Error creating calculator: {e}")
                 time.sleep(10)
 
-        while True:
-            job = self.task_queue.get()
+    def _load_calculator(self, factory: AbstractCalculatorFactory) -> Calculator:
+        key = (factory.model, factory.dtype)
+        if (calculator := self._calculators.get(key)) is not None:
+            self._calculators.move_to_end(key)
+            return calculator
 
-            try:
-                self._process_job(calculator, job)
-            except Exception as e:
-                job["status"] = JobStatus.FAILED
-                job["progress"] = 100
-                self.message_queue.put(job)
+        # preloaded calculators are shared with the service process, see CalculatorRegistry.preload
+        if (calculator := self.calculator_registry.preloaded(factory)) is None:
+            logger.info(f"Loading model {factory.model} ({factory.dtype})")
+            calculator = factory.create()
+        self._calculators[key] = calculator
 
-                logger.exception(f"Error occurred while processing: {e} (job {job['id']})")
+        while len(self._calculators) > self.max_models:
+            (model, dtype), _ = self._calculators.popitem(last=False)
+            logger.info(f"Unloading least recently used model {model} ({dtype})")
 
-    def _process_job(self, calculator: MACECalculator, job: Job) -> None:
+        return calculator
+
+    @contextmanager
+    def _calculator(self, model: str | None, dtype: str | None) -> Iterator[Calculator]:
+        """
+        Calculator of the model for the duration of a relaxation stage.
+
+        Every evaluation of the stage runs in the context of the factory, so models with different dtypes
+            don't see the global state (torch's default dtype) left by the previously loaded or used model.
+        """
+        factory = self.calculator_registry.get(model, dtype)
+        calculator = self._load_calculator(factory)
+
+        with factory.evaluation():
+            yield calculator
+
+    def _run_job(self, job: Job) -> None:
+        with self._active_jobs.get_lock():
+            self._active_jobs.value += 1
+        with self._cancel_receive_lock:
+            self._running_job_ids.add(job["id"])
+
+        try:
+            self._process_job(job)
+        except JobDrained:
+            # the job is resumed from the checkpoint on the next start
+            self._send(JobStatusEvent(
+                type=JobEventType.STATUS,
+                job_id=job["id"],
+                status=JobStatus.PENDING,
+            ))
+
+            logger.info(f"Job stopped, worker is drained (job {job['id']})")
+        except JobStopped as e:
+            # steps taken until now stay with the job, its energies are not normalized like those of a finished job
+            self._send(JobStatusEvent(
+                type=JobEventType.STATUS,
+                job_id=job["id"],
+                status=e.status,
+            ))
+
+            logger.info(f"Job stopped with status {e.status.value} (job {job['id']})")
+        except Exception as e:
+            self._send(JobStatusEvent(
+                type=JobEventType.STATUS,
+                job_id=job["id"],
+                status=JobStatus.FAILED,
+            ))
+
+            logger.exception(f"Error occurred while processing: {e} (job {job['id']})")
+        finally:
+            with self._cancel_receive_lock:
+                self._running_job_ids.discard(job["id"])
+                self._cancelled.discard(job["id"])
+
+            # the final event of the job is sent, a dead worker's job is only requeued if it is not final
+            self._release_job(job["id"])
+
+            with self._active_jobs.get_lock():
+                self._active_jobs.value -= 1
+                if self._active_jobs.value == 0:
+                    self._idle_since.value = time.time()
+
+    def _process_job(self, job: Job) -> None:
+        """
+        Relaxes the job in stages, every stage continues from the structure and the step where the previous one stopped.
+
+        Jobs with a pre-relaxation are first relaxed with the cheaper model to the looser fmax,
+            then refined with the model of the job, most steps are taken far from the minimum, so they are cheap.
+        """
         job_id = job["id"]
         fmax = job["fmax"]
         max_steps = job["max_steps"]
-        with tempfile.NamedTemporaryFile(prefix=job_id, suffix="traj", delete=False) as trajectory_file:
-            job["trajectory_file"] = trajectory_file.name
+        model = job["model"]
+        dtype = job["dtype"]
+        prerelaxation = job["prerelaxation"]
+        max_seconds = job["max_seconds"]
+        started_at = time.monotonic()
 
         logger.info(f"Processing job with fmax {fmax} and max_steps {max_steps} (job {job_id})")
 
-        job["status"] = JobStatus.RUNNING
-        self.message_queue.put(job)
+        self._send(JobStatusEvent(
+            type=JobEventType.STATUS,
+            job_id=job_id,
+            status=JobStatus.RUNNING,
+        ))
+
+        stages: list[tuple[str | None, str | None, float]] = [(model, dtype, fmax)]
+        if prerelaxation is not None:
+            stages.insert(0, (prerelaxation["model"], prerelaxation["dtype"], prerelaxation["fmax"]))
 
         atoms = Atoms.fromdict(job["atoms_slab"])
-        atoms.calc = calculator
+        energies: list[float] = []
+        first_stage = 0
+        last_step = 0
+        energy_offset = 0.0
+
+        checkpoint = job.get("checkpoint")
+        if checkpoint is not None:
+            atoms.set_positions(checkpoint["positions"])
+            # energies of the steps after the checkpoint are calculated again
+            energies = list(job["energies"][:checkpoint["step"]])
+            first_stage = checkpoint["stage"]
+            last_step = checkpoint["stage_start_step"]
+            energy_offset = checkpoint["energy_offset"]
+            # the wall time budget is shared with the previous runs of the job
+            started_at -= checkpoint["elapsed_seconds"]
+        elif prerelaxation is not None:
+            energy_offset = self._energy_offset(atoms, stages[0], stages[-1])
+
+        for stage in range(first_stage, len(stages)):
+            stage_model, stage_dtype, stage_fmax = stages[stage]
+            logger.info(
+                f"Relaxing stage {stage + 1}/{len(stages)} with model {stage_model} ({stage_dtype}) "
+                f"and fmax {stage_fmax} (job {job_id})"
+            )
+
+            with self._calculator(stage_model, stage_dtype) as calculator:
+                last_step = self._relax_stage(
+                    job,
+                    atoms,
+                    calculator,
+                    stage=stage,
+                    fmax=stage_fmax,
+                    start_step=last_step,
+                    energies=energies,
+                    # only the energies of the pre-relaxation are shifted, the last stage is the reference
+                    energy_offset=energy_offset if stage < len(stages) - 1 else 0.0,
+                    checkpoint=checkpoint if stage == first_stage else None,
+                    started_at=started_at,
+                    max_seconds=max_seconds,
+                )
+
+        logger.info(f"Optimization finished (job {job_id})")
+
+        # energies should be:
+        # (opt_log[opt_log.columns[1]] - opt_log[opt_log.columns[1]].iloc[-1])/len(ase_atoms)
+        last_energy = energies[-1]
+        atoms_slab_len = len(job["atoms_slab"]["numbers"])
+
+        self._send(JobSummaryEvent(
+            type=JobEventType.SUMMARY,
+            job_id=job_id,
+            status=JobStatus.FINISHED,
+            energies=[(e - last_energy) / atoms_slab_len for e in energies],
+        ))
+
+    def _energy_offset(self,
+                       atoms: Atoms,
+                       prerelaxation: tuple[str | None, str | None, float],
+                       refinement: tuple[str | None, str | None, float]) -> float:
+        """
+        Difference of the energies of the refinement and the pre-relaxation models on the initial structure.
+
+        Energies of the pre-relaxation are shifted by it, so the energies of both stages are one series.
+        """
+        energies = []
+        for model, dtype, _ in (refinement, prerelaxation):
+            with self._calculator(model, dtype) as calculator:
+                energies.append(calculator.get_potential_energy(atoms))
+
+        return energies[0] - energies[1]
+
+    def _relax_stage(self,
+                     job: Job,
+                     atoms: Atoms,
+                     calculator: Calculator,
+                     stage: int,
+                     fmax: float,
+                     start_step: int,
+                     energies: list[float],
+                     energy_offset: float,
+                     checkpoint: Checkpoint | None,
+                     started_at: float,
+                     max_seconds: float | None) -> int:
+        """
+        Relaxes the atoms with the calculator until fmax or max_steps of the job, returns the last step.
+
+        Steps of the stage continue from start_step, energies of the steps are appended to energies.
+        Raises JobStopped if the job is cancelled or runs longer than max_seconds since started_at (monotonic).
+        """
+        from ase.optimize.precon import PreconLBFGS
+
+        job_id = job["id"]
+        max_steps = job["max_steps"]
+
+        timed_calculator = TimedCalculator(calculator)
+        atoms.calc = timed_calculator
 
         log_buffer = io.StringIO()
 
         optimizer = PreconLBFGS(
             atoms,
             logfile=log_buffer,
-            trajectory=job["trajectory_file"],
             precon='Exp',
             use_armijo=False
         )
 
+        if checkpoint is not None:
+            restore_checkpoint(optimizer, checkpoint)
+            logger.info(f"Resuming from step {checkpoint['step']} (job {job_id})")
+
+        # the structure the later stages start with is the last step of the previous stage, it is not repeated
+        first_step = start_step if stage > 0 else start_step + 1
+        last_step = start_step
+
+        # time of the step is split between the model and the optimizer, the callback itself is not counted
+        step_started_at = time.perf_counter()
+        model_seconds = timed_calculator.seconds
+
         def callback(_: Atoms | None = None) -> None:
             """
             Callback is called after each optimization step,
@@ -76,41 +471,95 @@ class RelaxationWorker(Process):
 
             Not optimal implementation, but looks fine for now
             """
+            nonlocal step_started_at, model_seconds, last_step
+            if stage > 0 and optimizer.nsteps == 0:
+                return
+
+            step_seconds = time.perf_counter() - step_started_at
+            step_model_seconds = timed_calculator.seconds - model_seconds
+
             log_buffer.seek(0)
             last_line = log_buffer.readlines()[-1]
 
             log_parts = last_line.split()
 
-            energy = float(log_parts[3])
+            energy = float(log_parts[3]) + energy_offset
             force = float(log_parts[4])
 
-            job["energies"].append(energy)
-            job["forces"].append(force)
+            energies.append(energy)
+            self._beat()
 
-            current_step = optimizer.get_number_of_steps() + 1
-            progress = current_step / max_steps
+            current_step = first_step + optimizer.get_number_of_steps()
+            last_step = current_step
 
-            job["step_atoms"][current_step] = atoms.copy().todict()
+            logger.info(f"Step {current_step}/{max_steps} with energy {energy} and force {force} (job {job_id})")
 
-            job["progress"] = progress
+            # only the new step is sent, the service appends it to the job and its trajectory
+            self._send(JobStepEvent(
+                type=JobEventType.STEP,
+                job_id=job_id,
+                step=current_step,
+                energy=energy,
+                force=force,
+                positions=atoms.get_positions(),
+                model_seconds=step_model_seconds,
+                optimizer_seconds=step_seconds - step_model_seconds,
+            ))
 
-            logger.info(f"Step {current_step}/{max_steps} with energy {energy} and force {force} (job {job_id})")
+            if self._cancel_requested(job_id):
+                raise JobStopped(JobStatus.CANCELLED)
+
+            elapsed_seconds = time.monotonic() - started_at
+            if max_seconds is not None and elapsed_seconds > max_seconds:
+                logger.info(f"Job ran for {elapsed_seconds:.0f} s, longer than its {max_seconds:.0f} s (job {job_id})")
+                raise JobStopped(JobStatus.TIMED_OUT)
+
+            draining = self.drain_event.is_set()
+            if draining or current_step % self.checkpoint_interval == 0:
+                self._send_checkpoint(
+                    optimizer, atoms, job_id, current_step, stage, start_step, energy_offset, elapsed_seconds
+                )
+
+            if draining:
+                raise JobDrained()
 
-            self.message_queue.put(job)
+            step_started_at = time.perf_counter()
+            model_seconds = timed_calculator.seconds
 
         optimizer.attach(callback)
-        optimizer.run(fmax=fmax, steps=max_steps)
+        # the first step of the job is its initial structure, so the job has max_steps optimizer steps after it
+        #   whether it is relaxed in one stage or several, like the jobs without the pre-relaxation
+        steps_taken = max(start_step - 1, 0)
+        # on resume the optimizer continues counting from the checkpoint
+        optimizer.run(fmax=fmax, steps=max(max_steps - steps_taken - optimizer.nsteps, 0))
 
-        logger.info(f"Optimization finished (job {job_id})")
+        return last_step
 
-        # energies should be:
-        # (opt_log[opt_log.columns[1]] - opt_log[opt_log.columns[1]].iloc[-1])/len(ase_atoms)
-        last_energy = job["energies"][-1]
-        atoms_slab_len = len(job["atoms_slab"]["numbers"])
-        for idx in range(len(job["energies"])):
-            e = job["energies"][idx]
-            job["energies"][idx] = (e - last_energy) / atoms_slab_len
-        job["status"] = JobStatus.FINISHED
-        job["progress"] = 1
+    def _send(self, event: JobEvent) -> None:
+        # pickle is measured before the stamps are added, they are only a few bytes
+        if self._sent_events % _MESSAGE_BYTES_SAMPLE_INTERVAL == 0:
+            event["message_bytes"] = len(pickle.dumps(event, protocol=pickle.HIGHEST_PROTOCOL))
+        self._sent_events += 1
+        event["sent_at"] = time.time()
+        self.message_queue.put(event)
+
+    def _send_checkpoint(self,
+                         optimizer: 'PreconLBFGS',
+                         atoms: Atoms,
+                         job_id: str,
+                         step: int,
+                         stage: int,
+                         stage_start_step: int,
+                         energy_offset: float,
+                         elapsed_seconds: float) -> None:
+        checkpoint = capture_checkpoint(
+            optimizer, atoms, step, stage, stage_start_step, energy_offset, elapsed_seconds
+        )
+        if checkpoint is None:
+            return
 
-        self.message_queue.put(job)
+        self._send(JobCheckpointEvent(
+            type=JobEventType.CHECKPOINT,
+            job_id=job_id,
+            checkpoint=checkpoint,
+        ))
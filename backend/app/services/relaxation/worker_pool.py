@@ -0,0 +1,222 @@
+import math
+import os
+import threading
+import time
+from multiprocessing.synchronize import Event
+from typing import Callable
+
+from logger import logger
+from .scheduler import JobScheduler
+from .transport.abstract import AbstractJobTransport
+from .worker import RelaxationWorker
+
+
+class WorkerPool:
+    """
+    Keeps between min_workers and max_workers workers running, depending on the load.
+
+    Workers are added when jobs wait for a free slot, and retired after idle_timeout seconds without a job,
+        so idle processes don't hold a model in memory.
+    Workers that die or don't send a heartbeat for heartbeat_timeout seconds are replaced,
+        lost worker listeners are called with the IDs of the jobs leased to them, e.g. to requeue the jobs.
+    Cores of cpu_budget are split between the workers by the number of torch threads, so they don't oversubscribe the CPU.
+    Remote workers of the transport add their slots to the capacity, they are not started or stopped by the pool.
+    """
+    def __init__(self,
+                 worker_factory: Callable[[], RelaxationWorker],
+                 scheduler: JobScheduler,
+                 transport: AbstractJobTransport,
+                 drain_event: Event,
+                 min_workers: int,
+                 max_workers: int,
+                 jobs_per_worker: int = 1,
+                 cpu_budget: int | None = None,
+                 idle_timeout: float = 300.0,
+                 heartbeat_timeout: float = 600.0,
+                 interval: float = 2.0) -> None:
+        if not 0 <= min_workers <= max_workers or max_workers < 1:
+            raise ValueError(f"Invalid worker limits: min {min_workers}, max {max_workers}")
+
+        self.worker_factory = worker_factory
+        self.scheduler = scheduler
+        self.transport = transport
+        self.drain_event = drain_event
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.jobs_per_worker = jobs_per_worker
+        self.cpu_budget = cpu_budget or os.cpu_count() or 1
+        self.idle_timeout = idle_timeout
+        self.heartbeat_timeout = heartbeat_timeout
+        self.interval = interval
+
+        self._workers: list[RelaxationWorker] = []
+        # finish their running jobs and exit, they don't take new jobs
+        self._retiring: list[RelaxationWorker] = []
+        self._lost_worker_listeners: list[Callable[[list[str]], None]] = []
+        # remote slots of the current capacity
+        self._remote_slots = 0
+
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def size(self) -> int:
+        return len(self._workers)
+
+    @property
+    def pids(self) -> list[int]:
+        """Process IDs of all workers, including the retiring ones"""
+        return [worker.pid for worker in self._workers + self._retiring if worker.pid is not None]
+
+    def cancel_job(self, job_id: str) -> None:
+        """Stops the job if a running worker has taken it"""
+        with self._lock:
+            for worker in self._workers + self._retiring:
+                if job_id in worker.leased_job_ids and worker.is_alive():
+                    worker.cancel(job_id)
+
+    def add_lost_worker_listener(self, listener: Callable[[list[str]], None]) -> None:
+        self._lost_worker_listeners.append(listener)
+
+    def start(self) -> None:
+        logger.info(f"Starting worker pool with {self.min_workers}-{self.max_workers} workers")
+        with self._lock:
+            self._add_workers(self.min_workers)
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float) -> None:
+        """Drains all workers, the ones that don't stop in time are killed"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10.0)
+
+        self.drain_event.set()
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            workers = self._workers + self._retiring
+            for i, worker in enumerate(workers, start=1):
+                worker.join(timeout=max(deadline - time.monotonic(), 0))
+                if worker.is_alive():
+                    logger.warning(f"Worker {i}/{len(workers)} was not drained in time, killing it")
+                    worker.kill()
+
+            self._workers = []
+            self._retiring = []
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            try:
+                with self._lock:
+                    self._check_workers()
+                    self._scale()
+            except Exception as e:
+                logger.exception(f"Error supervising workers: {e}")
+
+    def _check_workers(self) -> None:
+        now = time.time()
+        workers = len(self._workers) + len(self._retiring)
+
+        for worker in list(self._workers):
+            heartbeat = worker.last_heartbeat
+            if worker.is_alive():
+                # workers start to beat when the model is loaded, one stuck loading it is replaced too
+                if now - (heartbeat or worker.started_at) < self.heartbeat_timeout:
+                    continue
+
+                if heartbeat:
+                    logger.warning(f"Worker {worker.pid} sent no heartbeat for {now - heartbeat:.0f} s, killing it")
+                else:
+                    logger.warning(
+                        f"Worker {worker.pid} did not load its model in {now - worker.started_at:.0f} s, killing it"
+                    )
+                worker.kill()
+                worker.join()
+            else:
+                logger.warning(f"Worker {worker.pid} died with exit code {worker.exitcode}")
+
+            self._workers.remove(worker)
+            self._worker_lost(worker)
+
+        for worker in list(self._retiring):
+            if worker.is_alive():
+                continue
+
+            self._retiring.remove(worker)
+            # retired worker exits on its own after its jobs are finished
+            if worker.exitcode != 0:
+                logger.warning(f"Retired worker {worker.pid} died with exit code {worker.exitcode}")
+                self._worker_lost(worker)
+
+        if len(self._workers) + len(self._retiring) != workers or self.transport.remote_slots != self._remote_slots:
+            self._resize()
+
+    def _worker_lost(self, worker: RelaxationWorker) -> None:
+        job_ids = worker.leased_job_ids
+        if job_ids:
+            logger.warning(f"Worker {worker.pid} was lost with {len(job_ids)} jobs: {', '.join(job_ids)}")
+
+        for listener in self._lost_worker_listeners:
+            try:
+                listener(job_ids)
+            except Exception as e:
+                logger.exception(f"Error in lost worker listener: {e}")
+
+    def _scale(self) -> None:
+        pending, running = self.scheduler.load()
+        capacity = len(self._workers) * self.jobs_per_worker + self._remote_slots
+
+        active = sum(worker.active_jobs for worker in self._workers) + self.transport.remote_active_jobs
+        # dispatched jobs that no worker has taken from the task queue yet
+        queued = running - active - sum(worker.active_jobs for worker in self._retiring)
+        # queued jobs beyond the free slots, e.g. they were dispatched to the slots of a remote worker that left
+        stranded = queued - max(capacity - active, 0)
+
+        missing = self.min_workers - len(self._workers)
+        if pending and running >= capacity:
+            missing = max(missing, math.ceil(pending / self.jobs_per_worker))
+        if stranded > 0:
+            missing = max(missing, math.ceil(stranded / self.jobs_per_worker))
+
+        missing = min(missing, self.max_workers - len(self._workers))
+        if missing > 0:
+            logger.info(f"{pending + max(stranded, 0)} jobs are waiting, adding {missing} workers")
+            self._add_workers(missing)
+            return
+
+        if pending or queued > 0:
+            return
+
+        # one worker at a time, so a short pause in the load doesn't stop all of them
+        now = time.time()
+        for worker in self._workers:
+            if len(self._workers) <= self.min_workers:
+                break
+
+            if worker.active_jobs == 0 and now - worker.idle_since > self.idle_timeout:
+                logger.info(f"Worker {worker.pid} is idle for {now - worker.idle_since:.0f} s, retiring it")
+                worker.retire()
+                self._workers.remove(worker)
+                self._retiring.append(worker)
+                self._resize()
+                break
+
+    def _add_workers(self, count: int) -> None:
+        for _ in range(count):
+            worker = self.worker_factory()
+            self._workers.append(worker)
+            self._resize()
+            worker.start()
+
+        logger.info(f"Worker pool has {len(self._workers)} workers")
+
+    def _resize(self) -> None:
+        """Hands the slots and the cores to the current workers"""
+        self._remote_slots = self.transport.remote_slots
+        self.scheduler.set_capacity(len(self._workers) * self.jobs_per_worker + self._remote_slots)
+
+        num_threads = max(self.cpu_budget // max(len(self._workers) + len(self._retiring), 1), 1)
+        for worker in self._workers + self._retiring:
+            worker.set_num_threads(num_threads)
@@ -0,0 +1,61 @@
+from abc import abstractmethod
+from typing import TYPE_CHECKING, Union
+
+# pymatgen is imported by the sources when they read the structures, it is slow to import
+if TYPE_CHECKING:
+    from pymatgen.core.structure import Structure
+
+
+class MaterialNotFound(Exception):
+    pass
+
+
+class MaterialMalformedName(Exception):
+    pass
+
+
+class ApiKeyMalformed(Exception):
+    pass
+
+
+class ApiKeyOutdated(Exception):
+    pass
+
+
+# Errors related to a single material, fetching other materials can go on
+FetchError = MaterialNotFound | MaterialMalformedName
+# Structure of the material or the reason why it can't be fetched
+FetchResult = Union['Structure', FetchError]
+
+
+class AbstractStructureSource:
+    """Source of the bulk structures for the relaxation, e.g. Materials Project or local files"""
+
+    @abstractmethod
+    def database_version(self, api_key: str) -> str:
+        """
+        Version of the data, structures of different versions are cached separately.
+
+        Remote sources may ask the remote for it, then it raises the same errors as fetch.
+        """
+        pass
+
+    @abstractmethod
+    def fetch(self, material_id: str, api_key: str) -> 'Structure':
+        """Get structure of the material"""
+        pass
+
+    def fetch_many(self, material_ids: list[str], api_key: str) -> dict[str, FetchResult]:
+        """
+        Get structures of several materials, errors related to a single material are returned in place of it.
+
+        Sources that can fetch many materials at once (e.g. with one remote request) should override this.
+        """
+        results: dict[str, FetchResult] = {}
+        for material_id in dict.fromkeys(material_ids):
+            try:
+                results[material_id] = self.fetch(material_id, api_key)
+            except (MaterialNotFound, MaterialMalformedName) as e:
+                results[material_id] = e
+
+        return results
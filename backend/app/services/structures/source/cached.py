@@ -0,0 +1,53 @@
+from typing import TYPE_CHECKING
+
+from logger import logger
+from services.structures.source.abstract import AbstractStructureSource, FetchResult
+from services.structures.store import SQLiteStructureStore
+
+if TYPE_CHECKING:
+    from pymatgen.core.structure import Structure
+
+
+class CachedStructureSource(AbstractStructureSource):
+    """Checks the local store first and asks the wrapped source only on a miss"""
+
+    def __init__(self, source: AbstractStructureSource, store: SQLiteStructureStore) -> None:
+        self.source = source
+        self.store = store
+
+    def database_version(self, api_key: str) -> str:
+        return self.source.database_version(api_key)
+
+    def fetch(self, material_id: str, api_key: str) -> 'Structure':
+        database_version = self.database_version(api_key)
+        if (structure := self.store.get(material_id, database_version)) is not None:
+            logger.info(f"Structure for material {material_id} found in the local store")
+            return structure
+
+        structure = self.source.fetch(material_id, api_key)
+        self.store.put(material_id, database_version, structure)
+
+        return structure
+
+    def fetch_many(self, material_ids: list[str], api_key: str) -> dict[str, FetchResult]:
+        database_version = self.database_version(api_key)
+        results: dict[str, FetchResult] = {}
+        missing = []
+        for material_id in dict.fromkeys(material_ids):
+            if (structure := self.store.get(material_id, database_version)) is not None:
+                results[material_id] = structure
+            else:
+                missing.append(material_id)
+
+        logger.info(f"{len(results)} of {len(results) + len(missing)} structures found in the local store")
+
+        if missing:
+            fetched = self.source.fetch_many(missing, api_key)
+            self.store.put_many(database_version, {
+                material_id: result
+                for material_id, result in fetched.items()
+                if not isinstance(result, Exception)
+            })
+            results.update(fetched)
+
+        return results
@@ -0,0 +1,35 @@
+import glob
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from services.structures.source.abstract import AbstractStructureSource, MaterialMalformedName, MaterialNotFound
+
+if TYPE_CHECKING:
+    from pymatgen.core.structure import Structure
+
+
+class LocalStructureSource(AbstractStructureSource):
+    """
+    Reads structures from the directory, the file name (without extension) is the material ID.
+
+    Any format known to pymatgen works (CIF, POSCAR, pymatgen JSON),
+        so the service can run without network access, e.g. in tests and benchmarks.
+    """
+
+    def __init__(self, directory: str, database_version: str = "local") -> None:
+        self.directory = Path(directory)
+        self._database_version = database_version
+
+    def database_version(self, api_key: str) -> str:
+        return self._database_version
+
+    def fetch(self, material_id: str, api_key: str) -> 'Structure':
+        from pymatgen.core.structure import Structure
+
+        if not material_id or "/" in material_id or material_id.startswith("."):
+            raise MaterialMalformedName(f"Invalid material ID {material_id!r}")
+
+        for path in sorted(self.directory.glob(f"{glob.escape(material_id)}.*")):
+            return Structure.from_file(str(path))
+
+        raise MaterialNotFound(f"Material {material_id} not found in {self.directory}")
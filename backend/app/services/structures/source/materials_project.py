@@ -0,0 +1,128 @@
+import time
+from contextlib import contextmanager
+from threading import Lock
+from typing import TYPE_CHECKING, Any, Iterator, cast
+
+from logger import logger
+from services.structures.source.abstract import AbstractStructureSource, ApiKeyMalformed, ApiKeyOutdated, \
+    FetchResult, MaterialMalformedName, MaterialNotFound
+
+if TYPE_CHECKING:
+    from pymatgen.core.structure import Structure
+
+
+class MaterialsProjectStructureSource(AbstractStructureSource):
+    """
+    Fetches structures from the Materials Project API, every call is a remote request.
+
+    The "latest" database version is resolved with the API and checked again after version_ttl seconds,
+        so the cached structures are keyed by the release they were fetched from.
+    """
+
+    def __init__(self, database_version: str = "latest", version_ttl: float = 3600.0) -> None:
+        self._database_version = database_version
+        self.version_ttl = version_ttl
+
+        # resolved "latest" version and when it was resolved (monotonic)
+        self._resolved: tuple[str, float] | None = None
+        self._lock = Lock()
+
+    def database_version(self, api_key: str) -> str:
+        if self._database_version != "latest":
+            return self._database_version
+
+        with self._lock:
+            resolved = self._resolved
+
+        if resolved is not None and time.monotonic() - resolved[1] < self.version_ttl:
+            return resolved[0]
+
+        try:
+            version = self._get_database_version(api_key)
+        except Exception as e:
+            if resolved is None:
+                raise
+
+            # structures of the previous version are still valid, the version is checked again later
+            logger.warning(f"Error checking the database version, keeping {resolved[0]}: {e}")
+            version = resolved[0]
+
+        if resolved is None or version != resolved[0]:
+            logger.info(f"Materials Project database version is {version}")
+
+        with self._lock:
+            self._resolved = (version, time.monotonic())
+
+        return version
+
+    def fetch(self, material_id: str, api_key: str) -> 'Structure':
+        docs = self._search([material_id], api_key)
+
+        if not docs:
+            raise MaterialNotFound(f"Material {material_id} not found")
+
+        return cast('Structure', docs[0].structure)
+
+    def fetch_many(self, material_ids: list[str], api_key: str) -> dict[str, FetchResult]:
+        """All materials are fetched with a single request"""
+        unique_ids = list(dict.fromkeys(material_ids))
+
+        try:
+            docs = self._search(unique_ids, api_key)
+        except MaterialMalformedName:
+            # the API rejects the whole request, fetch one by one to find out which names are malformed
+            return super().fetch_many(unique_ids, api_key)
+
+        structures = {str(doc.material_id): cast('Structure', doc.structure) for doc in docs}
+
+        results: dict[str, FetchResult] = {}
+        for material_id in unique_ids:
+            results[material_id] = structures.get(material_id) or MaterialNotFound(
+                f"Material {material_id} not found"
+            )
+
+        return results
+
+    @classmethod
+    def _search(cls, material_ids: list[str], api_key: str) -> list[Any]:
+        # the client imports most of pymatgen, so it is imported on the first request
+        from mp_api.client import MPRester  # type: ignore[import-untyped]
+
+        with cls._client_errors(f"fetching structures for materials {', '.join(material_ids)}"), \
+                MPRester(api_key) as mpr:
+            return cast(list[Any], mpr.materials.summary.search(
+                material_ids=material_ids,
+                fields=["material_id", "structure"],
+            ))
+
+    @classmethod
+    def _get_database_version(cls, api_key: str) -> str:
+        from mp_api.client import MPRester  # type: ignore[import-untyped]
+
+        with cls._client_errors("checking the database version"), MPRester(api_key) as mpr:
+            return str(mpr.get_database_version())
+
+    @staticmethod
+    @contextmanager
+    def _client_errors(action: str) -> Iterator[None]:
+        """Errors of the client are raised as the errors of the source"""
+        from mp_api.client import MPRestError  # type: ignore[import-untyped]
+
+        try:
+            yield
+        except ValueError as e:
+            if "is not formatted correctly" in str(e):
+                raise MaterialMalformedName from e
+
+            if "Please use a new API key from" in str(e):
+                raise ApiKeyMalformed from e
+
+            logger.exception(f"Error {action}: {e}")
+            raise
+
+        except MPRestError as e:
+            if "status code 401" in str(e):
+                raise ApiKeyOutdated from e
+
+            logger.exception(f"Error {action}: {e}")
+            raise
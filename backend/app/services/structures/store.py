@@ -0,0 +1,98 @@
+import json
+import sqlite3
+import time
+from threading import Lock
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from pymatgen.core.structure import Structure
+
+
+class SQLiteStructureStore:
+    """
+    Structures stored on the disk, keyed by material ID and database version.
+
+    Entries older than ttl seconds are considered stale,
+        the least recently used entries are removed when there are more than max_entries of them.
+    Pinned entries (e.g. imported with commands.import_structures) never expire and don't count towards max_entries.
+    """
+    def __init__(self, path: str, ttl: float, max_entries: int) -> None:
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = Lock()
+
+        with self._lock, self._connection:
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS structures (
+                    material_id TEXT NOT NULL,
+                    database_version TEXT NOT NULL,
+                    structure TEXT NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    pinned INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (material_id, database_version)
+                )
+            """)
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS structures_accessed_at ON structures (accessed_at)"
+            )
+
+    def get(self, material_id: str, database_version: str) -> 'Structure | None':
+        now = time.time()
+
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT structure FROM structures "
+                "WHERE material_id = ? AND database_version = ? AND (pinned OR fetched_at > ?)",
+                (material_id, database_version, now - self.ttl),
+            ).fetchone()
+
+            if row is None:
+                return None
+
+            self._connection.execute(
+                "UPDATE structures SET accessed_at = ? WHERE material_id = ? AND database_version = ?",
+                (now, material_id, database_version),
+            )
+
+        from pymatgen.core.structure import Structure
+
+        return Structure.from_dict(json.loads(row[0]))
+
+    def put(self, material_id: str, database_version: str, structure: 'Structure') -> None:
+        self.put_many(database_version, {material_id: structure})
+
+    def put_many(self, database_version: str, structures: dict[str, 'Structure'], pinned: bool = False) -> None:
+        """Save structures in a single transaction, pinned entries stay pinned when they are saved again"""
+        now = time.time()
+
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT INTO structures "
+                "(material_id, database_version, structure, fetched_at, accessed_at, pinned) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (material_id, database_version) DO UPDATE SET "
+                "structure = excluded.structure, fetched_at = excluded.fetched_at, "
+                "accessed_at = excluded.accessed_at, pinned = MAX(pinned, excluded.pinned)",
+                [
+                    (material_id, database_version, json.dumps(structure.as_dict()), now, now, int(pinned))
+                    for material_id, structure in structures.items()
+                ],
+            )
+            self._evict(now)
+
+    def _evict(self, now: float) -> None:
+        self._connection.execute("DELETE FROM structures WHERE NOT pinned AND fetched_at <= ?", (now - self.ttl,))
+        self._connection.execute(
+            "DELETE FROM structures WHERE rowid IN ("
+            "SELECT rowid FROM structures WHERE NOT pinned ORDER BY accessed_at DESC LIMIT -1 OFFSET ?"
+            ")",
+            (self.max_entries,),
+        )
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
@@ -1,8 +1,89 @@
+import os
+import tempfile
+
 from pydantic_settings import BaseSettings
 from typing import Optional
 
 
 class Settings(BaseSettings):
+    # "all" runs the API and the workers in one process; the API can be scaled to several processes
+    #   (uvicorn --workers N) with "web" processes and a single "dispatcher" process that runs the workers
+    #   (python -m commands.dispatcher), they share the jobs through the sqlite repository and the trajectory store
+    SERVICE_ROLE: str = "all"
+    # seconds between the polls of the shared repository: for new jobs by the dispatcher,
+    #   for the changes of the streamed jobs by the web processes
+    DISPATCHER_POLL_INTERVAL: float = 1.0
+    EVENT_POLL_INTERVAL: float = 0.5
+    # jobs left in the FETCHING status for longer (e.g. their web process was restarted) fail
+    FETCH_TIMEOUT: float = 600.0
+
+    # default model of the jobs: MACE "small", "medium", "large" (or a path to a MACE model),
+    #   or "emt" / "lj" stand-ins that need no model (benchmarks, offline runs), their results are not physical
     MODEL: str = "medium"
-    NUM_WORKERS: int = 2
+    # default dtype of the jobs, "float32" is faster but less precise
+    DTYPE: str = "float64"
+    # models kept loaded by every worker, jobs may choose different models
+    WORKER_MAX_MODELS: int = 2
+    # default model is loaded once by the "dispatcher" process and shared with its workers instead of a copy per worker,
+    #   it is not preloaded with SERVICE_ROLE "all", so the API starts without waiting for the model
+    PRELOAD_MODEL: bool = True
+    # workers are added while jobs wait for a free worker and retired after WORKER_IDLE_TIMEOUT seconds without a job
+    MIN_WORKERS: int = 1
+    MAX_WORKERS: int = 2
+    WORKER_IDLE_TIMEOUT: float = 300.0
+    # workers that don't report for WORKER_HEARTBEAT_TIMEOUT seconds (e.g. stuck) are killed and replaced
+    WORKER_HEARTBEAT_TIMEOUT: float = 600.0
+    # cores split between the workers as torch threads, all cores by default
+    CPU_BUDGET: Optional[int] = None
+    # number of jobs relaxed together by one worker, 1 disables batching
+    BATCH_SIZE: int = 1
+    # "local" relaxes the jobs on this host only, with "tcp" remote workers (python -m commands.worker)
+    #   take the jobs from the dispatcher at BROKER_HOST:BROKER_PORT too, the remote workers need the same settings
+    #   and the same BROKER_AUTHKEY, their jobs are requeued when they send nothing for WORKER_HEARTBEAT_TIMEOUT seconds
+    WORKER_TRANSPORT: str = "local"
+    BROKER_HOST: str = "127.0.0.1"
+    BROKER_PORT: int = 7700
+    BROKER_AUTHKEY: str = ""
     MPR_API_KEY: str = "dummy"
+    # structures of the new jobs are fetched by INTAKE_CONCURRENCY threads,
+    #   new jobs are rejected (429) while INTAKE_MAX_PENDING jobs wait for their structures
+    INTAKE_CONCURRENCY: int = 4
+    INTAKE_MAX_PENDING: int = 100
+    # rendered structures of the steps are cached for up to STRUCTURE_CACHE_MAX_JOBS jobs and STRUCTURE_CACHE_MAX_BYTES
+    STRUCTURE_CACHE_MAX_JOBS: int = 256
+    STRUCTURE_CACHE_MAX_BYTES: int = 256 * 1024 ** 2
+
+    # optimizer state is saved every CHECKPOINT_INTERVAL_STEPS steps, interrupted jobs are resumed from it
+    CHECKPOINT_INTERVAL_STEPS: int = 10
+    # on shutdown running jobs are checkpointed and stopped, workers that take longer are killed
+    DRAIN_TIMEOUT: float = 30.0
+
+    # positions, energies and forces of the steps, one directory per job
+    TRAJECTORY_STORE_DIR: str = "trajectories"
+    TRAJECTORY_STORE_MAX_OPEN: int = 256
+
+    # exported trajectories of the finished jobs are cached here
+    TRAJECTORY_EXPORT_DIR: str = os.path.join(tempfile.gettempdir(), "trajectory_exports")
+
+    # finished jobs are evicted when they are not accessed for RETENTION_TTL seconds,
+    #   or when there are too many of them or their trajectories take too much disk space
+    RETENTION_TTL: Optional[int] = 7 * 24 * 60 * 60
+    RETENTION_MAX_JOBS: Optional[int] = 10_000
+    RETENTION_MAX_DISK_BYTES: Optional[int] = 10 * 1024 ** 3
+    RETENTION_INTERVAL: float = 60.0
+
+    # "memory" or "sqlite" (jobs survive restarts, memory does not grow with job count)
+    REPOSITORY: str = "memory"
+    DATABASE_PATH: str = "jobs.sqlite3"
+    # number of recently used jobs the sqlite repository keeps in memory
+    REPOSITORY_CACHE_SIZE: int = 128
+
+    # "materials_project" or "local" (files from LOCAL_STRUCTURES_DIR, no network needed)
+    STRUCTURE_SOURCE: str = "materials_project"
+    LOCAL_STRUCTURES_DIR: str = "structures"
+    # "latest" is resolved with the API (and checked again every hour), the stored structures are keyed by the version
+    MP_DATABASE_VERSION: str = "latest"
+    # fetched structures are kept on the disk, empty path disables the store
+    STRUCTURE_STORE_PATH: str = "structures.sqlite3"
+    STRUCTURE_STORE_TTL: float = 7 * 24 * 60 * 60
+    STRUCTURE_STORE_MAX_ENTRIES: int = 100_000
@@ -1,33 +1,287 @@
-from typing import Any
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager, nullcontext
+from functools import partial
+from typing import TYPE_CHECKING, Callable, ContextManager, Iterator
 
-import torch
-from mace.calculators import MACECalculator, mace_mp
+import numpy as np
+import numpy.typing as npt
+from ase import Atoms
+from ase.calculators.calculator import Calculator
 
+# torch and MACE take seconds to import, they are imported by the workers when the model is created
+if TYPE_CHECKING:
+    from mace.calculators import MACECalculator
 
-_DEFAULT_DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
 
+# torch's default dtype is global to the process, it is held by one evaluation at a time
+_default_dtype_lock = threading.RLock()
 
-class MACECalculatorFactory:
+
+def _default_device() -> str:
+    import torch
+
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+@contextmanager
+def torch_default_dtype(dtype: str) -> Iterator[None]:
+    """Sets torch's default dtype to the dtype of the model and restores the previous one afterwards"""
+    import torch
+
+    with _default_dtype_lock:
+        previous = torch.get_default_dtype()
+        torch.set_default_dtype(getattr(torch, dtype))
+        try:
+            yield
+        finally:
+            torch.set_default_dtype(previous)
+
+
+class AbstractCalculatorFactory(ABC):
+    """Creates the calculator in the worker process, model and dtype identify the results of the calculator"""
+    model: str
+    dtype: str
+
+    @abstractmethod
+    def create(self) -> Calculator:
+        pass
+
+    def evaluation(self) -> ContextManager[None]:
+        """Context every evaluation of the calculator runs in, e.g. the global state its model depends on"""
+        return nullcontext()
+
+    def share(self, calculator: Calculator) -> bool:
+        """
+        Prepares the calculator created in the service process to be used by the forked workers,
+            returns False if it can't be shared and every worker should create its own.
+        """
+        return True
+
+
+class MACECalculatorFactory(AbstractCalculatorFactory):
     """
     MACECalculator should be created in each process to avoid serialization issues.
 
     Since we pass the factory between processes,
         we have to redefine __getstate__ and __setstate__ to avoid serialization issues.
+
+    MACE creates its input tensors in torch's default dtype, which mace_mp sets for the whole process,
+        so the calculator is created and evaluated with the default dtype set to the dtype of the factory.
     """
-    def __init__(self, model: str, device: str = _DEFAULT_DEVICE):
+    def __init__(self, model: str, device: str | None = None, dtype: str = "float64"):
         self.model = model
+        # None is CUDA if it is available, resolved when the calculator is created
         self.device = device
+        self.dtype = dtype
 
-    def create(self) -> MACECalculator:
-        return mace_mp(
-            model=self.model,
-            dispersion=False,
-            default_dtype="float64",
-            device=self.device
-        )
+    def create(self) -> 'MACECalculator':
+        from mace.calculators import mace_mp
+
+        with torch_default_dtype(self.dtype):
+            return mace_mp(
+                model=self.model,
+                dispersion=False,
+                default_dtype=self.dtype,
+                device=self.device or _default_device()
+            )
+
+    def evaluation(self) -> ContextManager[None]:
+        return torch_default_dtype(self.dtype)
+
+    def share(self, calculator: Calculator) -> bool:
+        # CUDA can't be used in a forked process once it is initialized in the parent
+        if (self.device or _default_device()) != "cpu":
+            return False
+
+        # forked workers share the pages of the weights anyway, the shared memory keeps them shared
+        #   when the workers are spawned (the tensors are sent as handles instead of copies)
+        for model in calculator.models:
+            model.share_memory()
 
-    def __getstate__(self) -> dict[str, str]:
-        return {"model": self.model, "device": self.device}
+        return True
 
-    def __setstate__(self, state: dict[str, str]) -> None:
+    def __getstate__(self) -> dict[str, str | None]:
+        return {"model": self.model, "device": self.device, "dtype": self.dtype}
+
+    def __setstate__(self, state: dict[str, str | None]) -> None:
         self.__init__(**state)  # type: ignore[misc]
+
+
+class StandInCalculatorFactory(AbstractCalculatorFactory):
+    """
+    Cheap built-in ASE calculators instead of the model, "emt" or "lj".
+
+    Results are not physical, but there is no model download and no GPU needed, e.g. for benchmarks and offline runs.
+    """
+    MODELS = ("emt", "lj")
+
+    def __init__(self, model: str, dtype: str = "float64") -> None:
+        if model not in self.MODELS:
+            raise ValueError(f"Unknown stand-in calculator {model!r}, expected one of {list(self.MODELS)}")
+
+        self.model = model
+        # ASE calculators are numpy, always float64
+        self.dtype = dtype
+
+    def create(self) -> Calculator:
+        # both import scipy
+        if self.model == "emt":
+            from ase.calculators.emt import EMT
+
+            return EMT()
+
+        from ase.calculators.lj import LennardJones
+
+        # parameters of copper, the benchmark structures are copper
+        return LennardJones(sigma=2.338, epsilon=0.409)
+
+
+class UnknownModel(ValueError):
+    """Model is not registered or does not support the requested dtype"""
+    pass
+
+
+class CalculatorRegistry:
+    """
+    Models the jobs can choose from, every model is registered with a factory that takes the dtype.
+
+    Jobs that don't choose get the default model and dtype,
+        models that don't support the default dtype fall back to their first supported one.
+    """
+    def __init__(self, default_model: str, default_dtype: str = "float64") -> None:
+        self.default_model = default_model
+        self.default_dtype = default_dtype
+
+        self._models: dict[str, tuple[Callable[[str], AbstractCalculatorFactory], tuple[str, ...]]] = {}
+        # calculators created before the workers are started, by (model, dtype)
+        self._preloaded: dict[tuple[str, str], Calculator] = {}
+
+    @property
+    def models(self) -> dict[str, tuple[str, ...]]:
+        """Supported dtypes of every model"""
+        return {model: dtypes for model, (_, dtypes) in self._models.items()}
+
+    def register(self,
+                 model: str,
+                 factory: Callable[[str], AbstractCalculatorFactory],
+                 dtypes: tuple[str, ...] = ("float32", "float64")) -> None:
+        """Factory is sent to the workers with the registry, so it should be picklable (e.g. a partial of a class)"""
+        self._models[model] = (factory, dtypes)
+
+    def get(self, model: str | None = None, dtype: str | None = None) -> AbstractCalculatorFactory:
+        model = model or self.default_model
+        if model not in self._models:
+            raise UnknownModel(f"Unknown model {model!r}, expected one of {sorted(self._models)}")
+
+        factory, dtypes = self._models[model]
+        if dtype is None:
+            dtype = self.default_dtype if self.default_dtype in dtypes else dtypes[0]
+
+        if dtype not in dtypes:
+            raise UnknownModel(f"Model {model!r} does not support dtype {dtype!r}, expected one of {list(dtypes)}")
+
+        return factory(dtype)
+
+    def preload(self, model: str | None = None, dtype: str | None = None) -> None:
+        """
+        Creates the calculator in the service process, it should be called before the workers are started.
+
+        Workers take the preloaded calculator instead of loading their own copy of the model,
+            so they share its weights and are ready without loading anything.
+        """
+        factory = self.get(model, dtype)
+        calculator = factory.create()
+        if factory.share(calculator):
+            self._preloaded[(factory.model, factory.dtype)] = calculator
+
+    def preloaded(self, factory: AbstractCalculatorFactory) -> Calculator | None:
+        return self._preloaded.get((factory.model, factory.dtype))
+
+
+def create_calculator_registry(default_model: str,
+                               default_dtype: str = "float64",
+                               device: str | None = None) -> CalculatorRegistry:
+    """
+    Foundation MACE models (small, medium, large) and the stand-in calculators.
+
+    Default model that is not one of them (e.g. a path to a fine-tuned model) is registered as a MACE model.
+    """
+    registry = CalculatorRegistry(default_model, default_dtype)
+
+    for model in ("small", "medium", "large"):
+        registry.register(model, partial(MACECalculatorFactory, model, device))
+
+    for model in StandInCalculatorFactory.MODELS:
+        registry.register(model, partial(StandInCalculatorFactory, model), dtypes=("float64",))
+
+    if default_model not in registry.models:
+        registry.register(default_model, partial(MACECalculatorFactory, default_model, device))
+
+    return registry
+
+
+def evaluate_batch(factory: AbstractCalculatorFactory,
+                   calculator: Calculator,
+                   atoms_list: list[Atoms]) -> list[tuple[float, npt.NDArray[np.float64]]]:
+    """
+    Energies and forces of several structures in a single forward pass of the model created by the factory.
+
+    Does the same as MACECalculator.calculate, but for the batch of structures.
+    Other calculators can't batch, they evaluate the structures one by one without importing torch and MACE.
+    """
+    with factory.evaluation():
+        if not isinstance(factory, MACECalculatorFactory):
+            return [
+                (calculator.get_potential_energy(atoms), calculator.get_forces(atoms))
+                for atoms in atoms_list
+            ]
+
+        return _evaluate_mace_batch(calculator, atoms_list)
+
+
+def _evaluate_mace_batch(calculator: 'MACECalculator',
+                         atoms_list: list[Atoms]) -> list[tuple[float, npt.NDArray[np.float64]]]:
+    import torch
+    from mace import data
+    from mace.tools import torch_geometric
+
+    dataset = [
+        data.AtomicData.from_config(
+            data.config_from_atoms(atoms, charges_key=calculator.charges_key),
+            z_table=calculator.z_table,
+            cutoff=calculator.r_max,
+            heads=calculator.heads,
+        )
+        for atoms in atoms_list
+    ]
+    data_loader = torch_geometric.dataloader.DataLoader(
+        dataset=dataset,
+        batch_size=len(dataset),
+        shuffle=False,
+        drop_last=False,
+    )
+    batch_base = next(iter(data_loader)).to(calculator.device)
+
+    energies = []
+    forces = []
+    for model in calculator.models:
+        batch = calculator._clone_batch(batch_base)
+        out = model(batch.to_dict(), compute_stress=False, training=calculator.use_compile)
+        energies.append(out["energy"].detach())
+        forces.append(out["forces"].detach())
+
+    energies_ev = torch.mean(torch.stack(energies), dim=0).cpu().numpy() * calculator.energy_units_to_eV
+    forces_ev = (
+        torch.mean(torch.stack(forces), dim=0).cpu().numpy()
+        * calculator.energy_units_to_eV
+        / calculator.length_units_to_A
+    )
+
+    # atoms of the i-th structure are ptr[i]:ptr[i + 1] in the batch
+    ptr = batch_base["ptr"].cpu().numpy()
+
+    return [
+        (float(energies_ev[i]), forces_ev[ptr[i]:ptr[i + 1]])
+        for i in range(len(atoms_list))
+    ]
@@ -0,0 +1,195 @@
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator, TypeVar
+
+from logger import logger
+
+
+# Buckets of durations, from a fast dictionary update to a slow model evaluation
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+BYTES_BUCKETS = tuple(float(2 ** power) for power in range(8, 27, 2))
+
+
+class Counter:
+    def __init__(self, name: str, description: str, label_names: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+
+        self._values: dict[tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, value: float = 1.0) -> None:
+        """Labels are given in the order of label_names"""
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + value
+
+    def value(self, *labels: str) -> float:
+        with self._lock:
+            return self._values.get(labels, 0.0)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = dict(self._values)
+
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, labels)} {_format_value(value)}")
+
+        return lines
+
+
+class Histogram:
+    """
+    Cumulative histogram in the Prometheus format.
+
+    Observation is a bisect and a few additions under the lock, cheap enough for the hot loops.
+    """
+    def __init__(self, name: str, description: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.name = name
+        self.description = description
+        self.buckets = tuple(sorted(buckets))
+
+        # the last count is for the values above the largest bucket
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    @property
+    def count(self) -> int:
+        with self._lock:
+            return sum(self._counts)
+
+    @property
+    def sum(self) -> float:
+        with self._lock:
+            return self._sum
+
+    def quantile(self, q: float) -> float | None:
+        """Estimated by the linear interpolation inside the bucket, None if nothing was observed"""
+        with self._lock:
+            counts = list(self._counts)
+
+        total = sum(counts)
+        if not total:
+            return None
+
+        rank = q * total
+        cumulative = 0
+        for i, count in enumerate(counts):
+            if cumulative + count >= rank and count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                # values above the largest bucket are reported as the largest bucket
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+
+        return self.buckets[-1]
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{_format_value(bound)}"}} {cumulative}')
+        lines.append(f"{self.name}_sum {_format_value(total)}")
+        lines.append(f"{self.name}_count {cumulative}")
+
+        return lines
+
+
+class Gauge:
+    """Value is read on every scrape, e.g. the length of a queue"""
+    def __init__(self, name: str, description: str, function: Callable[[], float]) -> None:
+        self.name = name
+        self.description = description
+        self.function = function
+
+    def render(self) -> list[str]:
+        return [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} gauge",
+            f"{self.name} {_format_value(self.function())}",
+        ]
+
+
+Metric = Counter | Histogram | Gauge
+
+M = TypeVar("M", Counter, Histogram, Gauge)
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self._metrics: dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, description: str, label_names: tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, description, label_names))
+
+    def histogram(self, name: str, description: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, description, buckets))
+
+    def gauge(self, name: str, description: str, function: Callable[[], float]) -> Gauge:
+        """Gauge with the same name is replaced, e.g. when the service is created again"""
+        return self._register(Gauge(name, description, function))
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        lines = []
+        for metric in metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                # a broken gauge should not hide the other metrics
+                logger.exception(f"Error rendering metric {metric.name}: {e}")
+
+        return "\n".join(lines) + "\n"
+
+    def _register(self, metric: M) -> M:
+        with self._lock:
+            self._metrics[metric.name] = metric
+
+        return metric
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ""
+
+    pairs = ",".join(f'{name}="{value}"' for name, value in zip(names, values))
+    return f"{{{pairs}}}"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+
+    return repr(float(value))
+
+
+registry = MetricsRegistry()
@@ -0,0 +1,97 @@
+import os
+import sys
+from typing import Any, Callable, Iterator
+
+import pytest
+
+# the app imports its modules from the top level, like it does when it runs from backend/app
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
+
+from services.relaxation.job import Job, JobStatus  # noqa: E402
+
+
+@pytest.fixture
+def make_job() -> Callable[..., Job]:
+    """Job of a small copper slab, fields are overridden with the keyword arguments"""
+    from ase.build import fcc111
+
+    def make(job_id: str, **fields: Any) -> Job:
+        atoms = fcc111("Cu", size=(2, 2, 4), vacuum=3.0)
+        atoms.rattle(0.05, seed=1)
+
+        job: dict[str, Any] = {
+            "id": job_id,
+            "material_id": "mp-30",
+            "fmax": 0.05,
+            "max_steps": 10,
+            "max_seconds": None,
+            "model": "emt",
+            "dtype": "float64",
+            "prerelaxation": None,
+            "chemical_formula": atoms.get_chemical_formula(),
+            "atoms": atoms.todict(),
+            "atoms_slab": atoms.todict(),
+            "input_hash": f"hash-{job_id}",
+            "identical_job_id": None,
+            "priority": "NORMAL",
+            "owner": "owner",
+            "status": JobStatus.PENDING,
+            "progress": 0.0,
+            "error": None,
+            "energies": [],
+            "forces": [],
+        }
+        job.update(fields)
+
+        return job  # type: ignore[return-value]
+
+    return make
+
+
+@pytest.fixture
+def structures_dir(tmp_path: Any) -> str:
+    """Structures of the local source: copper (mp-30) and aluminium (mp-134)"""
+    from ase.build import bulk
+
+    directory = os.path.join(tmp_path, "structures")
+    os.makedirs(directory)
+    for material_id, element in (("mp-30", "Cu"), ("mp-134", "Al")):
+        bulk(element, "fcc", cubic=True).write(os.path.join(directory, f"{material_id}.cif"))
+
+    return directory
+
+
+@pytest.fixture
+def api_settings(request: pytest.FixtureRequest, tmp_path: Any, structures_dir: str) -> dict[str, str]:
+    """
+    Settings of a web process: the jobs are left in the shared repository for the dispatcher,
+        tests play the dispatcher by applying the events to the repository.
+    Tests change the settings with indirect parametrization, e.g. {"INTAKE_MAX_PENDING": "1"}.
+    """
+    return {
+        "SERVICE_ROLE": "web",
+        "REPOSITORY": "sqlite",
+        "DATABASE_PATH": os.path.join(tmp_path, "jobs.sqlite3"),
+        "MODEL": "emt",
+        "STRUCTURE_SOURCE": "local",
+        "LOCAL_STRUCTURES_DIR": structures_dir,
+        "STRUCTURE_STORE_PATH": "",
+        "TRAJECTORY_STORE_DIR": os.path.join(tmp_path, "trajectories"),
+        "TRAJECTORY_EXPORT_DIR": os.path.join(tmp_path, "exports"),
+        "EVENT_POLL_INTERVAL": "0.05",
+        **getattr(request, "param", {}),
+    }
+
+
+@pytest.fixture
+def client(monkeypatch: pytest.MonkeyPatch, api_settings: dict[str, str]) -> Iterator[Any]:
+    """Client of the API with api_settings"""
+    from fastapi.testclient import TestClient
+
+    from app import create_app
+
+    for name, value in api_settings.items():
+        monkeypatch.setenv(name, value)
+
+    with TestClient(create_app()) as client:
+        yield client
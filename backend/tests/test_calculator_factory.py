@@ -0,0 +1,67 @@
+import multiprocessing
+import queue
+import sys
+import threading
+from typing import Any, Callable
+
+import numpy as np
+import pytest
+from ase import Atoms
+
+from app import _create_calculator_registry
+from services.relaxation.batched_worker import BatchedRelaxationWorker
+from services.relaxation.events import JobEventType
+from services.relaxation.job import Job, JobStatus
+from settings import Settings
+from utils.calculator_factory import create_calculator_registry, evaluate_batch
+
+
+def test_stand_in_calculators_evaluate_one_by_one(make_job: Callable[..., Job]) -> None:
+    factory = create_calculator_registry("emt").get("emt", "float64")
+    atoms_list = []
+    for seed in range(3):
+        atoms = Atoms.fromdict(make_job(str(seed))["atoms_slab"])
+        atoms.rattle(0.05, seed=seed)
+        atoms_list.append(atoms)
+
+    results = evaluate_batch(factory, factory.create(), atoms_list)
+
+    for atoms, (energy, forces) in zip(atoms_list, results):
+        atoms.calc = factory.create()
+        assert energy == pytest.approx(atoms.get_potential_energy())
+        np.testing.assert_allclose(forces, atoms.get_forces(), atol=1e-10)
+    # torch and MACE are imported by the MACE models only
+    assert "mace.calculators" not in sys.modules
+
+
+def test_batched_worker_relaxes_with_stand_in_calculators(make_job: Callable[..., Job]) -> None:
+    tasks: queue.Queue[Any] = queue.Queue()
+    messages: queue.Queue[Any] = queue.Queue()
+    drain_event = multiprocessing.Event()
+    worker = BatchedRelaxationWorker(create_calculator_registry("emt"), tasks, messages, drain_event, batch_size=3)
+
+    # jobs of different models are batched separately
+    for job_id, model in (("emt-1", "emt"), ("emt-2", "emt"), ("lj", "lj")):
+        tasks.put(make_job(job_id, model=model, max_steps=5))
+    thread = threading.Thread(target=worker.run, daemon=True)
+    thread.start()
+
+    summaries: dict[str, Any] = {}
+    while len(summaries) < 3:
+        event = messages.get(timeout=30.0)
+        if event["type"] == JobEventType.SUMMARY:
+            summaries[event["job_id"]] = event
+    drain_event.set()
+    thread.join(timeout=30.0)
+
+    assert not thread.is_alive()
+    assert {job_id: summary["status"] for job_id, summary in summaries.items()} == {
+        "emt-1": JobStatus.FINISHED, "emt-2": JobStatus.FINISHED, "lj": JobStatus.FINISHED
+    }
+
+
+@pytest.mark.parametrize(("role", "preloaded"), [("all", False), ("web", False), ("dispatcher", True)])
+def test_default_model_is_preloaded_by_the_dispatcher_only(role: str, preloaded: bool) -> None:
+    registry = _create_calculator_registry(Settings(SERVICE_ROLE=role, MODEL="emt", PRELOAD_MODEL=True))
+
+    assert (registry.preloaded(registry.get(None, None)) is not None) == preloaded
@@ -0,0 +1,77 @@
+import os
+from typing import Any, Callable
+
+import numpy as np
+from ase import Atoms
+from ase.calculators.emt import EMT
+from ase.optimize.precon import PreconLBFGS
+
+from services.relaxation.checkpoint import capture_checkpoint, load_checkpoint, restore_checkpoint, save_checkpoint
+from services.relaxation.job import Job
+from services.relaxation.trajectory_store import TrajectoryStore
+
+
+def _optimizer(atoms: Atoms) -> PreconLBFGS:
+    atoms.calc = EMT()
+    # the same optimizer as RelaxationWorker
+    return PreconLBFGS(atoms, logfile=None, precon="Exp", use_armijo=False)
+
+
+def _atoms(job: Job) -> Atoms:
+    return Atoms.fromdict(job["atoms_slab"])
+
+
+def test_nothing_to_capture_before_the_first_step(make_job: Callable[..., Job]) -> None:
+    atoms = _atoms(make_job("job"))
+
+    assert capture_checkpoint(_optimizer(atoms), atoms, step=1) is None
+
+
+def test_saved_checkpoint_is_loaded_unchanged(tmp_path: Any, make_job: Callable[..., Job]) -> None:
+    atoms = _atoms(make_job("job"))
+    optimizer = _optimizer(atoms)
+    optimizer.run(fmax=1e-8, steps=3)
+
+    checkpoint = capture_checkpoint(
+        optimizer, atoms, step=4, stage=1, stage_start_step=2, energy_offset=0.5, elapsed_seconds=12.0
+    )
+    assert checkpoint is not None
+    path = os.path.join(tmp_path, "checkpoint.npz")
+    save_checkpoint(path, checkpoint)
+    loaded = load_checkpoint(path)
+
+    assert loaded.keys() == checkpoint.keys()
+    for key, value in checkpoint.items():
+        if value is None:
+            assert loaded[key] is None, key  # type: ignore[literal-required]
+        else:
+            np.testing.assert_array_equal(loaded[key], value, err_msg=key)  # type: ignore[literal-required]
+
+
+def test_resumed_relaxation_continues_as_if_never_interrupted(tmp_path: Any, make_job: Callable[..., Job]) -> None:
+    job = make_job("job")
+
+    atoms = _atoms(job)
+    _optimizer(atoms).run(fmax=1e-8, steps=8)
+    uninterrupted = atoms.get_positions()
+
+    atoms = _atoms(job)
+    optimizer = _optimizer(atoms)
+    optimizer.run(fmax=1e-8, steps=4)
+    checkpoint = capture_checkpoint(optimizer, atoms, step=5)
+    assert checkpoint is not None
+
+    # the checkpoint goes through the trajectory store, like a job resumed by another worker
+    trajectory = TrajectoryStore(str(tmp_path)).create(job["id"], job["atoms_slab"], job["max_steps"])
+    trajectory.write_checkpoint(checkpoint)
+    restored = trajectory.read_checkpoint()
+    assert restored is not None
+
+    atoms = _atoms(job)
+    atoms.set_positions(restored["positions"])
+    optimizer = _optimizer(atoms)
+    restore_checkpoint(optimizer, restored)
+    optimizer.run(fmax=1e-8, steps=8 - optimizer.nsteps)
+
+    assert optimizer.nsteps == 8
+    np.testing.assert_allclose(atoms.get_positions(), uninterrupted, atol=1e-10)
@@ -0,0 +1,140 @@
+import time
+from typing import Any
+
+import pytest
+
+from services.relaxation.job import JobStatus
+from services.relaxation.metrics import MEMO_LOOKUPS
+
+
+def _wait_for_structure(client: Any, job_id: str) -> dict[str, Any]:
+    """The job once its structure is fetched in the background"""
+    deadline = time.monotonic() + 10.0
+    while (job := client.get(f"/relaxations/{job_id}", params={"include_structures": False}).json())["status"] == (
+        JobStatus.FETCHING
+    ):
+        assert time.monotonic() < deadline
+        time.sleep(0.02)
+
+    return job  # type: ignore[no-any-return]
+
+
+def test_job_is_accepted_before_its_structure_is_fetched(client: Any) -> None:
+    response = client.post("/relaxations", json={"material_id": "mp-30", "max_steps": 5})
+
+    assert response.status_code == 202
+    created = response.json()
+    assert (created["material_id"], created["status"], created["error"]) == ("mp-30", JobStatus.FETCHING, None)
+
+    job = _wait_for_structure(client, created["id"])
+    assert (job["id"], job["status"], job["error"]) == (created["id"], JobStatus.PENDING, None)
+    assert job["optimization"]["max_steps"] == 5
+
+
+def test_job_of_unknown_material_fails_with_the_reason(client: Any) -> None:
+    response = client.post("/relaxations", json={"material_id": "mp-missing"})
+
+    assert response.status_code == 202
+    job = _wait_for_structure(client, response.json()["id"])
+    assert (job["status"], job["error"]) == (JobStatus.FAILED, "Material not found")
+
+
+@pytest.mark.parametrize("api_settings", [{"INTAKE_MAX_PENDING": "1"}], indirect=True)
+def test_jobs_are_rejected_while_the_intake_is_full(client: Any) -> None:
+    service = client.app.state.container.relaxation_service
+    # nothing is prepared, so the first job keeps waiting for its structure
+    service.intake.stop()
+
+    first = client.post("/relaxations", json={"material_id": "mp-30"})
+    second = client.post("/relaxations", json={"material_id": "mp-134"})
+
+    assert first.status_code == 202
+    assert second.status_code == 429
+    assert second.json() == {"detail": "Too many jobs are waiting for their structures, retry later"}
+    # the rejected job is not kept
+    assert service.repository.get_ids_by_status(*JobStatus) == [first.json()["id"]]
+
+
+def test_identical_structure_is_served_by_the_existing_job(client: Any) -> None:
+    service = client.app.state.container.relaxation_service
+    first = _wait_for_structure(client, client.post("/relaxations", json={"material_id": "mp-30"}).json()["id"])
+    hits = service.result_cache.hits
+
+    # requests of another owner are different requests, but the same relaxation
+    created = client.post("/relaxations", json={"material_id": "mp-30", "mp_api_key": "another key"}).json()
+    linked = _wait_for_structure(client, created["id"])
+
+    assert created["id"] != first["id"]
+    assert (linked["id"], linked["status"]) == (first["id"], JobStatus.PENDING)
+    assert service.result_cache.hits == hits + 1
+    # only the first job is left for the dispatcher
+    assert service.repository.get_ids_by_status(JobStatus.PENDING) == [first["id"]]
+
+    response = client.delete(f"/relaxations/{created['id']}")
+    assert (response.json()["id"], response.json()["status"]) == (first["id"], JobStatus.CANCELLED)
+
+    # the link is not served once the identical job is evicted
+    service.repository.delete(first["id"])
+    assert client.get(f"/relaxations/{created['id']}").json() == {"detail": "Job not found"}
+
+
+def test_batch_creates_a_job_for_every_material(client: Any) -> None:
+    material_ids = ["mp-30", "mp-missing", "mp-134", "../mp-30"]
+
+    response = client.post("/relaxations/batch", json={"material_ids": material_ids, "max_steps": 5})
+
+    assert response.status_code == 200
+    items = response.json()["items"]
+    # results are in the order of the request
+    assert [item["material_id"] for item in items] == material_ids
+    assert [item["error"] for item in items] == [
+        None, "Material not found", None, "Invalid material name format"
+    ]
+    assert [item["job_id"] is not None for item in items] == [True, False, True, False]
+
+    # structures are fetched before the response, so the jobs are ready to be relaxed
+    for item in (items[0], items[2]):
+        assert item["status"] == JobStatus.PENDING
+        job = client.get(f"/relaxations/{item['job_id']}", params={"include_structures": False}).json()
+        assert (job["material_id"], job["status"], job["optimization"]["max_steps"]) == (
+            item["material_id"], JobStatus.PENDING, 5
+        )
+
+
+@pytest.mark.parametrize(
+    "request_body",
+    [
+        {"material_ids": []},
+        {"material_ids": ["mp-30"] * 1001},
+        {"material_ids": ["mp-30"], "max_steps": 0},
+    ],
+)
+def test_invalid_batch_is_rejected(client: Any, request_body: dict[str, Any]) -> None:
+    assert client.post("/relaxations/batch", json=request_body).status_code == 422
+
+
+def test_batch_with_unknown_model_is_rejected(client: Any) -> None:
+    response = client.post("/relaxations/batch", json={"material_ids": ["mp-30"], "model": "unknown"})
+
+    assert response.status_code == 422
+    assert response.json() == {"detail": "Model or dtype is not supported"}
+
+
+def test_identical_relaxations_share_one_job(client: Any) -> None:
+    hits = MEMO_LOOKUPS.value("result", "hit")
+
+    # the same material twice in one batch
+    items = client.post("/relaxations/batch", json={"material_ids": ["mp-30", "mp-134", "mp-30"]}).json()["items"]
+    job_ids = [item["job_id"] for item in items]
+
+    assert job_ids[0] == job_ids[2] != job_ids[1]
+    assert MEMO_LOOKUPS.value("result", "hit") == hits + 1
+
+    # and again in the next batch
+    items = client.post("/relaxations/batch", json={"material_ids": ["mp-134", "mp-30"]}).json()["items"]
+
+    assert [item["job_id"] for item in items] == [job_ids[1], job_ids[0]]
+    assert MEMO_LOOKUPS.value("result", "hit") == hits + 3
+
+    container = client.app.state.container
+    assert sorted(container.relaxation_service.repository.get_ids_by_status(*JobStatus)) == sorted(job_ids[:2])
@@ -0,0 +1,93 @@
+from typing import Callable
+
+import pytest
+
+from services.relaxation.events import JobEventType, JobStatusEvent, JobStepEvent, JobSummaryEvent, apply_event
+from services.relaxation.job import FINAL_STATUSES, Job, JobStatus
+
+
+def _step(job_id: str, step: int, energy: float = -1.0, force: float = 0.5) -> JobStepEvent:
+    return JobStepEvent(
+        type=JobEventType.STEP,
+        job_id=job_id,
+        step=step,
+        energy=energy,
+        force=force,
+        positions=None,  # type: ignore[typeddict-item]
+    )
+
+
+def _status(job_id: str, status: JobStatus) -> JobStatusEvent:
+    return JobStatusEvent(type=JobEventType.STATUS, job_id=job_id, status=status)
+
+
+def test_steps_are_appended_with_progress(make_job: Callable[..., Job]) -> None:
+    job = make_job("job", status=JobStatus.RUNNING, max_steps=4)
+
+    apply_event(job, _step("job", 1, energy=-1.0, force=0.4))
+    apply_event(job, _step("job", 2, energy=-2.0, force=0.2))
+
+    assert job["energies"] == [-1.0, -2.0]
+    assert job["forces"] == [0.4, 0.2]
+    assert job["progress"] == 0.5
+
+
+def test_duplicate_steps_are_ignored(make_job: Callable[..., Job]) -> None:
+    job = make_job("job", status=JobStatus.RUNNING, max_steps=4)
+
+    apply_event(job, _step("job", 1, energy=-1.0))
+    apply_event(job, _step("job", 2, energy=-2.0))
+    # delivered again, e.g. after a failed batch write
+    apply_event(job, _step("job", 2, energy=-2.0))
+    apply_event(job, _step("job", 1, energy=-1.0))
+
+    assert job["energies"] == [-1.0, -2.0]
+    assert job["progress"] == 0.5
+
+
+def test_summary_finishes_the_job(make_job: Callable[..., Job]) -> None:
+    job = make_job("job", status=JobStatus.RUNNING)
+    apply_event(job, _step("job", 1, energy=-3.0))
+    apply_event(job, _step("job", 2, energy=-4.0))
+
+    apply_event(job, JobSummaryEvent(
+        type=JobEventType.SUMMARY,
+        job_id="job",
+        status=JobStatus.FINISHED,
+        energies=[0.1, 0.0],
+    ))
+
+    assert job["status"] == JobStatus.FINISHED
+    assert job["energies"] == [0.1, 0.0]
+    assert job["progress"] == 1
+
+
+def test_failed_job_is_complete(make_job: Callable[..., Job]) -> None:
+    job = make_job("job", status=JobStatus.RUNNING)
+
+    apply_event(job, JobStatusEvent(type=JobEventType.STATUS, job_id="job", status=JobStatus.FAILED, error="broken"))
+
+    assert job["status"] == JobStatus.FAILED
+    assert job["progress"] == 100
+    assert job["error"] == "broken"
+
+
+@pytest.mark.parametrize("final_status", sorted(FINAL_STATUSES))
+def test_final_jobs_are_not_changed(make_job: Callable[..., Job], final_status: JobStatus) -> None:
+    job = make_job("job", status=final_status, energies=[-1.0], forces=[0.5], progress=0.1, max_steps=10)
+
+    # events the worker sent before it noticed that the job was cancelled
+    apply_event(job, _step("job", 2))
+    apply_event(job, _status("job", JobStatus.RUNNING))
+    apply_event(job, _status("job", JobStatus.FAILED))
+    apply_event(job, JobSummaryEvent(
+        type=JobEventType.SUMMARY,
+        job_id="job",
+        status=JobStatus.FINISHED,
+        energies=[0.0],
+    ))
+
+    assert job["status"] == final_status
+    assert job["energies"] == [-1.0]
+    assert job["forces"] == [0.5]
+    assert job["progress"] == 0.1
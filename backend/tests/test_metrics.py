@@ -0,0 +1,92 @@
+import multiprocessing
+import queue
+from typing import Any, Callable
+
+import pytest
+
+from services.relaxation.job import Job
+from services.relaxation.worker import RelaxationWorker
+from utils.calculator_factory import create_calculator_registry
+from utils.metrics import Counter, Histogram, MetricsRegistry
+
+
+def test_counter_is_rendered_per_labels() -> None:
+    counter = Counter("lookups_total", "Number of lookups", label_names=("cache", "result"))
+    counter.inc("result", "hit")
+    counter.inc("result", "hit", value=2.0)
+    counter.inc("request", "miss")
+
+    assert counter.value("result", "hit") == 3.0
+    assert counter.value("result", "miss") == 0.0
+    assert counter.render() == [
+        "# HELP lookups_total Number of lookups",
+        "# TYPE lookups_total counter",
+        'lookups_total{cache="request",result="miss"} 1.0',
+        'lookups_total{cache="result",result="hit"} 3.0',
+    ]
+
+
+def test_histogram_buckets_are_cumulative() -> None:
+    histogram = Histogram("seconds", "Durations", buckets=(1.0, 2.0))
+    for value in (0.5, 1.5, 1.5, 5.0):
+        histogram.observe(value)
+
+    assert (histogram.count, histogram.sum) == (4, 8.5)
+    assert histogram.render()[2:] == [
+        'seconds_bucket{le="1.0"} 1',
+        'seconds_bucket{le="2.0"} 3',
+        'seconds_bucket{le="+Inf"} 4',
+        "seconds_sum 8.5",
+        "seconds_count 4",
+    ]
+
+
+def test_histogram_quantiles_are_interpolated_in_the_bucket() -> None:
+    histogram = Histogram("seconds", "Durations", buckets=(1.0, 2.0))
+    assert histogram.quantile(0.5) is None
+
+    for value in (0.5, 1.2, 1.4, 1.6, 1.8):
+        histogram.observe(value)
+
+    # the first value is in the first bucket, the other four spread over the second one
+    assert histogram.quantile(0.2) == pytest.approx(1.0)
+    assert histogram.quantile(0.6) == pytest.approx(1.5)
+    assert histogram.quantile(1.0) == pytest.approx(2.0)
+
+
+def test_broken_gauge_does_not_hide_the_other_metrics() -> None:
+    registry = MetricsRegistry()
+    registry.counter("events_total", "Number of events").inc()
+    registry.gauge("pending", "Pending jobs", lambda: 1 / 0)
+
+    assert "events_total 1.0" in registry.render()
+
+    # e.g. the service is created again
+    registry.gauge("pending", "Pending jobs", lambda: 2)
+    assert registry.render().endswith("pending 2.0\n")
+
+
+def test_worker_measures_every_hundredth_message(make_job: Callable[..., Job]) -> None:
+    messages: queue.Queue[Any] = queue.Queue()
+    worker = RelaxationWorker(create_calculator_registry("emt"), queue.Queue(), messages, multiprocessing.Event())
+
+    # the messages of all jobs of the worker are counted together
+    for job_id in range(10):
+        worker._run_job(make_job(str(job_id), fmax=1e-8, max_steps=20))
+    events = []
+    while not messages.empty():
+        events.append(messages.get())
+
+    assert len(events) > 100
+    assert all("sent_at" in event for event in events)
+    assert [i for i, event in enumerate(events) if "message_bytes" in event] == list(range(0, len(events), 100))
+    assert events[100]["message_bytes"] > 0
+
+
+def test_metrics_endpoint(client: Any) -> None:
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "# TYPE relaxation_memo_lookups_total counter" in response.text
+    assert "\nrelaxation_jobs_fetching 0.0\n" in response.text
@@ -0,0 +1,185 @@
+import os
+from typing import Any, Callable
+
+import pytest
+
+from services.relaxation.job import FINAL_STATUSES, Job, JobStatus
+from services.relaxation.repository.abstract import AbstractRelaxationJobRepository
+from services.relaxation.repository.in_memory import InMemoryRelaxationJobRepository
+from services.relaxation.repository.sqlite import SQLiteRelaxationJobRepository
+from services.relaxation.retention import RetentionManager
+from services.relaxation.trajectory_export import TrajectoryExporter
+from services.relaxation.trajectory_store import TrajectoryStore
+
+
+@pytest.fixture
+def store(tmp_path: Any) -> TrajectoryStore:
+    return TrajectoryStore(os.path.join(tmp_path, "trajectories"))
+
+
+@pytest.fixture
+def exporter(tmp_path: Any, store: TrajectoryStore) -> TrajectoryExporter:
+    return TrajectoryExporter(os.path.join(tmp_path, "exports"), store)
+
+
+def _retention(repository: AbstractRelaxationJobRepository,
+               store: TrajectoryStore,
+               exporter: TrajectoryExporter,
+               ttl: float | None = None,
+               max_jobs: int | None = None,
+               max_disk_bytes: int | None = None,
+               **kwargs: Any) -> RetentionManager:
+    return RetentionManager(repository, store, exporter, ttl, max_jobs, max_disk_bytes, **kwargs)
+
+
+def _create(repository: AbstractRelaxationJobRepository,
+            store: TrajectoryStore,
+            job: Job,
+            accessed_at: float | None = None) -> None:
+    store.create(job["id"], job["atoms_slab"], job["max_steps"])
+    repository.create(job)
+    if accessed_at is not None:
+        repository.touch([job["id"]], accessed_at)
+
+
+def test_least_recently_accessed_jobs_are_evicted(store: TrajectoryStore,
+                                                   exporter: TrajectoryExporter,
+                                                   make_job: Callable[..., Job]) -> None:
+    repository = InMemoryRelaxationJobRepository()
+    _create(repository, store, make_job("old", status=JobStatus.FINISHED), accessed_at=100.0)
+    _create(repository, store, make_job("new", status=JobStatus.FINISHED), accessed_at=300.0)
+    _create(repository, store, make_job("middle", status=JobStatus.FAILED), accessed_at=200.0)
+    retention = _retention(repository, store, exporter, max_jobs=2)
+    evicted: list[str] = []
+    retention.add_eviction_listener(evicted.append)
+
+    assert retention.compact() == 1
+
+    assert evicted == ["old"]
+    assert sorted(repository.get_ids_by_status(*JobStatus)) == ["middle", "new"]
+    assert sorted(store.job_ids()) == ["middle", "new"]
+
+
+def test_pending_and_running_jobs_are_never_evicted(store: TrajectoryStore,
+                                                    exporter: TrajectoryExporter,
+                                                    make_job: Callable[..., Job]) -> None:
+    repository = InMemoryRelaxationJobRepository()
+    _create(repository, store, make_job("pending"), accessed_at=100.0)
+    _create(repository, store, make_job("running", status=JobStatus.RUNNING), accessed_at=100.0)
+    _create(repository, store, make_job("finished", status=JobStatus.FINISHED), accessed_at=200.0)
+    retention = _retention(repository, store, exporter, ttl=1.0, max_jobs=1, max_disk_bytes=0)
+
+    assert retention.compact() == 1
+
+    # the limits are exceeded while the jobs are in flight
+    assert sorted(repository.get_ids_by_status(*JobStatus)) == ["pending", "running"]
+    assert retention.usage().jobs == 2
+
+
+def test_expired_jobs_are_evicted(store: TrajectoryStore,
+                                  exporter: TrajectoryExporter,
+                                  make_job: Callable[..., Job]) -> None:
+    repository = InMemoryRelaxationJobRepository()
+    _create(repository, store, make_job("expired", status=JobStatus.FINISHED), accessed_at=100.0)
+    _create(repository, store, make_job("accessed", status=JobStatus.FINISHED))
+    # never accessed, e.g. left from the previous run
+    _create(repository, store, make_job("left", status=JobStatus.FINISHED))
+    retention = _retention(repository, store, exporter, ttl=3600.0)
+    retention.touch("accessed")
+
+    assert retention.compact() == 1
+
+    assert sorted(repository.get_ids_by_status(*JobStatus)) == ["accessed", "left"]
+    # kept for the ttl from now on
+    assert repository.get_accessed_at(*FINAL_STATUSES)["left"] is not None
+
+
+def test_jobs_are_evicted_until_they_fit_the_disk(store: TrajectoryStore,
+                                                  exporter: TrajectoryExporter,
+                                                  make_job: Callable[..., Job]) -> None:
+    repository = InMemoryRelaxationJobRepository()
+    for accessed_at, job_id in enumerate(("a", "b", "c"), start=1):
+        _create(repository, store, make_job(job_id, status=JobStatus.FINISHED), accessed_at=float(accessed_at))
+    job_bytes = store.size_bytes("a")
+    assert job_bytes > 0
+    retention = _retention(repository, store, exporter, max_disk_bytes=2 * job_bytes)
+
+    assert retention.compact() == 1
+
+    assert sorted(repository.get_ids_by_status(*JobStatus)) == ["b", "c"]
+    usage = retention.usage()
+    assert (usage.jobs, usage.final_jobs, usage.disk_bytes, usage.evicted_jobs) == (2, 2, 2 * job_bytes, 1)
+
+
+def test_orphan_trajectories_are_removed_after_the_grace_period(store: TrajectoryStore,
+                                                                exporter: TrajectoryExporter,
+                                                                make_job: Callable[..., Job]) -> None:
+    repository = InMemoryRelaxationJobRepository()
+    _create(repository, store, make_job("job"))
+    # trajectory is created right before its job
+    orphan = make_job("orphan")
+    store.create(orphan["id"], orphan["atoms_slab"], orphan["max_steps"])
+
+    _retention(repository, store, exporter, orphan_grace_period=600.0).compact()
+    assert sorted(store.job_ids()) == ["job", "orphan"]
+
+    _retention(repository, store, exporter, orphan_grace_period=0.0).compact()
+    assert store.job_ids() == ["job"]
+
+
+def test_usage_is_measured_once_per_interval(store: TrajectoryStore,
+                                             exporter: TrajectoryExporter,
+                                             make_job: Callable[..., Job]) -> None:
+    repository = InMemoryRelaxationJobRepository()
+    _create(repository, store, make_job("a", status=JobStatus.FINISHED))
+    _create(repository, store, make_job("b", status=JobStatus.RUNNING))
+    retention = _retention(repository, store, exporter, interval=3600.0)
+    job_bytes = store.size_bytes("a")
+
+    usage = retention.usage()
+    assert (usage.jobs, usage.final_jobs, usage.disk_bytes) == (2, 1, 2 * job_bytes)
+
+    _create(repository, store, make_job("c", status=JobStatus.FINISHED))
+    assert retention.usage().jobs == 2
+
+    # the dispatcher records the size of every done job
+    retention.record_size("c")
+    usage = retention.usage()
+    assert (usage.jobs, usage.final_jobs, usage.disk_bytes) == (3, 2, 3 * job_bytes)
+
+
+def test_touch_is_written_once_per_interval(store: TrajectoryStore,
+                                            exporter: TrajectoryExporter,
+                                            make_job: Callable[..., Job]) -> None:
+    repository = InMemoryRelaxationJobRepository()
+    _create(repository, store, make_job("job", status=JobStatus.FINISHED))
+    retention = _retention(repository, store, exporter, touch_interval=3600.0)
+
+    retention.touch("job")
+    accessed_at = repository.get_accessed_at(JobStatus.FINISHED)["job"]
+    retention.touch("job")
+
+    assert accessed_at is not None
+    assert repository.get_accessed_at(JobStatus.FINISHED)["job"] == accessed_at
+
+
+def test_access_times_are_shared_by_the_processes(tmp_path: Any,
+                                                  store: TrajectoryStore,
+                                                  exporter: TrajectoryExporter,
+                                                  make_job: Callable[..., Job]) -> None:
+    path = os.path.join(tmp_path, "jobs.sqlite")
+    # the web process serves the jobs, the dispatcher process compacts them
+    web_repository = SQLiteRelaxationJobRepository(path, shared=True)
+    dispatcher_repository = SQLiteRelaxationJobRepository(path, shared=True)
+    try:
+        _create(web_repository, store, make_job("read", status=JobStatus.FINISHED), accessed_at=100.0)
+        _create(web_repository, store, make_job("unread", status=JobStatus.FINISHED), accessed_at=200.0)
+
+        _retention(web_repository, store, exporter).touch("read")
+        evicted = _retention(dispatcher_repository, store, exporter, max_jobs=1).compact()
+
+        assert evicted == 1
+        assert web_repository.get_ids_by_status(*JobStatus) == ["read"]
+    finally:
+        web_repository.close()
+        dispatcher_repository.close()
@@ -0,0 +1,134 @@
+import queue
+from types import SimpleNamespace
+from typing import Any, Callable
+
+import pytest
+
+from services.relaxation import scheduler as scheduler_module
+from services.relaxation.job import Job
+from services.relaxation.scheduler import JobPriority, JobScheduler
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(scheduler_module, "time", SimpleNamespace(monotonic=clock.monotonic))
+    return clock
+
+
+def _positions(scheduler: JobScheduler, jobs: list[Job]) -> dict[str, int | None]:
+    return {job["id"]: scheduler.schedule(job).queue_position for job in jobs}
+
+
+def test_priority_classes_go_first(clock: Clock, make_job: Callable[..., Job]) -> None:
+    scheduler = JobScheduler(queue.Queue(), capacity=1)
+    jobs = [
+        make_job("low", priority=JobPriority.LOW),
+        make_job("normal", priority=JobPriority.NORMAL),
+        make_job("high", priority=JobPriority.HIGH),
+    ]
+    for job in jobs:
+        scheduler.submit(job)
+
+    assert _positions(scheduler, jobs) == {"high": 1, "normal": 2, "low": 3}
+
+
+def test_cheaper_jobs_go_first_then_submission_order(clock: Clock, make_job: Callable[..., Job]) -> None:
+    scheduler = JobScheduler(queue.Queue(), capacity=1)
+    jobs = [make_job("large", max_steps=100), make_job("first", max_steps=10), make_job("second", max_steps=10)]
+    for job in jobs:
+        scheduler.submit(job)
+
+    assert _positions(scheduler, jobs) == {"first": 1, "second": 2, "large": 3}
+
+
+def test_owner_with_fewer_running_jobs_goes_first(make_job: Callable[..., Job]) -> None:
+    task_queue: queue.Queue[Any] = queue.Queue()
+    scheduler = JobScheduler(task_queue, capacity=1)
+    scheduler.start()
+    try:
+        scheduler.submit(make_job("busy-1", owner="busy"))
+        assert task_queue.get(timeout=5.0)["id"] == "busy-1"
+
+        # submitted first and cheaper, but its owner already has a running job
+        jobs = [make_job("busy-2", owner="busy", max_steps=5), make_job("idle-1", owner="idle")]
+        for job in jobs:
+            scheduler.submit(job)
+
+        assert _positions(scheduler, jobs) == {"idle-1": 1, "busy-2": 2}
+    finally:
+        scheduler.stop()
+
+
+def test_waiting_jobs_are_promoted_with_age(clock: Clock, make_job: Callable[..., Job]) -> None:
+    scheduler = JobScheduler(queue.Queue(), capacity=1, aging_interval=60.0)
+    low = make_job("low", priority=JobPriority.LOW)
+    scheduler.submit(low)
+
+    clock.now += 30.0
+    high = make_job("high", priority=JobPriority.HIGH)
+    scheduler.submit(high)
+    assert _positions(scheduler, [low, high]) == {"high": 1, "low": 2}
+
+    # every waiting job is promoted, the low job is two intervals older than the high job submitted now
+    clock.now += 100.0
+    later_high = make_job("later-high", priority=JobPriority.HIGH)
+    scheduler.submit(later_high)
+    assert _positions(scheduler, [low, high, later_high]) == {"high": 1, "low": 2, "later-high": 3}
+
+
+def test_jobs_are_dispatched_up_to_the_capacity(make_job: Callable[..., Job]) -> None:
+    task_queue: queue.Queue[Any] = queue.Queue()
+    scheduler = JobScheduler(task_queue, capacity=2)
+    for job_id in ("a", "b", "c"):
+        scheduler.submit(make_job(job_id))
+
+    scheduler.start()
+    try:
+        dispatched = {task_queue.get(timeout=5.0)["id"], task_queue.get(timeout=5.0)["id"]}
+        assert dispatched == {"a", "b"}
+        assert scheduler.load() == (1, 2)
+        with pytest.raises(queue.Empty):
+            task_queue.get(timeout=0.2)
+
+        scheduler.job_done("a", finished=True)
+        assert task_queue.get(timeout=5.0)["id"] == "c"
+        assert scheduler.load() == (0, 2)
+    finally:
+        scheduler.stop()
+
+
+def test_requeued_job_keeps_its_place(clock: Clock, make_job: Callable[..., Job]) -> None:
+    scheduler = JobScheduler(queue.Queue(), capacity=1)
+    jobs = [make_job("first"), make_job("second")]
+    for job in jobs:
+        scheduler.submit(job)
+
+    clock.now += 10.0
+    scheduler.requeue({**jobs[0], "progress": 0.5})
+
+    assert _positions(scheduler, jobs) == {"first": 1, "second": 2}
+
+
+def test_cancel_removes_only_waiting_jobs(make_job: Callable[..., Job]) -> None:
+    task_queue: queue.Queue[Any] = queue.Queue()
+    scheduler = JobScheduler(task_queue, capacity=1)
+    scheduler.submit(make_job("running"))
+    scheduler.start()
+    try:
+        assert task_queue.get(timeout=5.0)["id"] == "running"
+        scheduler.submit(make_job("waiting"))
+
+        assert scheduler.cancel("waiting")
+        assert not scheduler.cancel("running")
+        assert scheduler.job_ids() == ["running"]
+    finally:
+        scheduler.stop()
@@ -0,0 +1,144 @@
+import os
+from typing import Any, Callable, Iterator
+
+import numpy as np
+import pytest
+
+from services.relaxation.events import JobEvent, JobEventType, JobStatusEvent, JobStepEvent, JobSummaryEvent
+from services.relaxation.job import FINAL_STATUSES, Job, JobStatus
+from services.relaxation.repository.abstract import JobAlreadyExists, JobNotFound
+from services.relaxation.repository.sqlite import SQLiteRelaxationJobRepository
+
+
+@pytest.fixture
+def path(tmp_path: Any) -> str:
+    return os.path.join(tmp_path, "jobs.sqlite")
+
+
+@pytest.fixture
+def repository(path: str) -> Iterator[SQLiteRelaxationJobRepository]:
+    # shared repositories cache only final jobs, so the other jobs are always read from the database
+    repository = SQLiteRelaxationJobRepository(path, shared=True)
+    yield repository
+    repository.close()
+
+
+def _step(job_id: str, step: int, energy: float, force: float = 0.5) -> JobStepEvent:
+    return JobStepEvent(
+        type=JobEventType.STEP,
+        job_id=job_id,
+        step=step,
+        energy=energy,
+        force=force,
+        positions=None,  # type: ignore[typeddict-item]
+    )
+
+
+def _status(job_id: str, status: JobStatus) -> JobStatusEvent:
+    return JobStatusEvent(type=JobEventType.STATUS, job_id=job_id, status=status)
+
+
+def test_job_is_stored_and_read_back(path: str, make_job: Callable[..., Job]) -> None:
+    job = make_job("job", energies=[-1.0, -1.5], forces=[0.3, 0.2], progress=0.2)
+    repository = SQLiteRelaxationJobRepository(path)
+    repository.create(job)
+    repository.close()
+
+    stored = SQLiteRelaxationJobRepository(path).get("job")
+
+    assert stored.keys() == job.keys()
+    for key, value in job.items():
+        # atoms are dictionaries of arrays
+        np.testing.assert_equal(stored[key], value, err_msg=key)  # type: ignore[literal-required]
+
+
+def test_create_update_delete(repository: SQLiteRelaxationJobRepository, make_job: Callable[..., Job]) -> None:
+    repository.create_many([make_job("a"), make_job("b")])
+    with pytest.raises(JobAlreadyExists):
+        repository.create(make_job("a"))
+
+    job = repository.get("a")
+    job["status"] = JobStatus.RUNNING
+    job["energies"] = [-2.0]
+    job["forces"] = [0.1]
+    repository.update(job)
+
+    assert repository.get("a")["energies"] == [-2.0]
+    assert sorted(repository.get_ids_by_status(JobStatus.PENDING, JobStatus.RUNNING)) == ["a", "b"]
+    assert repository.get_ids_by_status(JobStatus.RUNNING) == ["a"]
+
+    repository.delete("a")
+    with pytest.raises(JobNotFound):
+        repository.get("a")
+    with pytest.raises(JobNotFound):
+        repository.delete("a")
+    with pytest.raises(JobNotFound):
+        repository.update(job)
+
+
+def test_events_build_the_job(repository: SQLiteRelaxationJobRepository, make_job: Callable[..., Job]) -> None:
+    repository.create(make_job("job", max_steps=4))
+
+    repository.apply_events([
+        _status("job", JobStatus.RUNNING),
+        _step("job", 1, -1.0, 0.4),
+        _step("job", 2, -2.0, 0.2),
+        # delivered again, e.g. after a failed batch write
+        _step("job", 2, -2.0, 0.2),
+    ])
+    job = repository.get("job")
+
+    assert job["status"] == JobStatus.RUNNING
+    assert job["energies"] == [-1.0, -2.0]
+    assert job["forces"] == [0.4, 0.2]
+    assert job["progress"] == 0.5
+
+    repository.apply_events([
+        JobSummaryEvent(type=JobEventType.SUMMARY, job_id="job", status=JobStatus.FINISHED, energies=[0.5, 0.0]),
+    ])
+    job = repository.get("job")
+
+    assert job["status"] == JobStatus.FINISHED
+    assert job["energies"] == [0.5, 0.0]
+    assert job["forces"] == [0.4, 0.2]
+    assert job["progress"] == 1
+
+
+def test_events_of_final_jobs_are_ignored(path: str, make_job: Callable[..., Job]) -> None:
+    repository = SQLiteRelaxationJobRepository(path)
+    repository.create(make_job("job", status=JobStatus.RUNNING, max_steps=4))
+    repository.apply_events([_step("job", 1, -1.0), _status("job", JobStatus.CANCELLED)])
+
+    # events the worker sent before it stopped the cancelled job
+    events: list[JobEvent] = [
+        _step("job", 2, -2.0),
+        _status("job", JobStatus.FAILED),
+        JobSummaryEvent(type=JobEventType.SUMMARY, job_id="job", status=JobStatus.FINISHED, energies=[0.0, 0.0]),
+    ]
+    repository.apply_events(events)
+    cached = repository.get("job")
+    repository.close()
+
+    # the cached job and the stored one are the same
+    for job in (cached, SQLiteRelaxationJobRepository(path).get("job")):
+        assert job["status"] == JobStatus.CANCELLED
+        assert job["energies"] == [-1.0]
+        assert job["progress"] == 0.25
+
+
+def test_events_of_unknown_jobs_are_rejected(repository: SQLiteRelaxationJobRepository) -> None:
+    with pytest.raises(JobNotFound):
+        repository.apply_events([_status("missing", JobStatus.RUNNING)])
+
+
+
+def test_access_times_are_stored(repository: SQLiteRelaxationJobRepository, make_job: Callable[..., Job]) -> None:
+    repository.create_many([
+        make_job("finished", status=JobStatus.FINISHED),
+        make_job("failed", status=JobStatus.FAILED),
+        make_job("running", status=JobStatus.RUNNING),
+    ])
+
+    repository.touch(["finished", "running", "missing"], 100.0)
+
+    assert repository.get_accessed_at(*FINAL_STATUSES) == {"finished": 100.0, "failed": None}
@@ -0,0 +1,85 @@
+from typing import Any, Callable
+
+import numpy as np
+import pytest
+
+from api.responses.job import JobStepsResponse, StepsWindow
+from api.responses.structure_cache import StructureCache
+from services.relaxation.job import Job, JobStatus
+from services.relaxation.trajectory_store import JobTrajectory, TrajectoryStore
+
+
+@pytest.mark.parametrize(
+    ("window", "steps", "last_step"),
+    [
+        (StepsWindow(), range(1, 6), 5),
+        (StepsWindow(since_step=2), range(3, 6), 5),
+        (StepsWindow(since_step=2, limit=2), range(3, 5), 4),
+        (StepsWindow(since_step=1, offset=2, limit=1), range(4, 5), 4),
+        # nothing newer, the client keeps its since_step
+        (StepsWindow(since_step=5), range(6, 6), 5),
+        # e.g. since_step of another job, the last step is not beyond the last taken step
+        (StepsWindow(since_step=8), range(9, 6), 5),
+    ],
+)
+def test_window_steps(window: StepsWindow, steps: range, last_step: int) -> None:
+    assert window.steps(5) == steps
+    assert window.last_step(5) == last_step
+
+
+def test_window_selects_the_values_of_its_steps() -> None:
+    values = [10.0, 20.0, 30.0, 40.0, 50.0]
+
+    assert StepsWindow(since_step=1, limit=2).select(values, 5) == [20.0, 30.0]
+    # values appended after the total was taken are not returned
+    assert StepsWindow(since_step=3).select(values + [60.0], 5) == [40.0, 50.0]
+
+
+@pytest.fixture
+def relaxed(tmp_path: Any, make_job: Callable[..., Job]) -> tuple[Job, JobTrajectory]:
+    job = make_job("job", status=JobStatus.RUNNING, max_steps=10)
+    trajectory = TrajectoryStore(str(tmp_path)).create(job["id"], job["atoms_slab"], job["max_steps"])
+
+    positions = np.asarray(job["atoms_slab"]["positions"])
+    for step in range(1, 8):
+        energy, force = -float(step), 1.0 / step
+        trajectory.write_step(step, positions + 0.01 * step, energy, force)
+        job["energies"].append(energy)
+        job["forces"].append(force)
+
+    return job, trajectory
+
+
+def test_since_step_pages_through_every_step_once(relaxed: tuple[Job, JobTrajectory]) -> None:
+    job, trajectory = relaxed
+    cache = StructureCache(max_jobs=4, max_bytes=10 * 1024 ** 2)
+
+    since_step = 0
+    steps: list[int] = []
+    energies: list[float] = []
+    for _ in range(10):
+        page = JobStepsResponse.from_job(job, trajectory, cache, StepsWindow(since_step=since_step, limit=3))
+        if not page.steps:
+            break
+
+        steps.extend(step.step for step in page.steps)
+        energies.extend(page.energies)
+        assert page.last_step == page.steps[-1].step
+        since_step = page.last_step
+
+    assert steps == list(range(1, 8))
+    assert energies == job["energies"]
+    assert since_step == 7
+
+
+def test_steps_of_the_page_are_limited_by_the_taken_steps(relaxed: tuple[Job, JobTrajectory]) -> None:
+    job, trajectory = relaxed
+    cache = StructureCache(max_jobs=4, max_bytes=10 * 1024 ** 2)
+    # energy of the next step is appended before its force, see total_steps
+    job["energies"].append(-8.0)
+
+    page = JobStepsResponse.from_job(job, trajectory, cache, StepsWindow(since_step=5))
+
+    assert [step.step for step in page.steps] == [6, 7]
+    assert page.energies == [-6.0, -7.0]
+    assert page.total_steps == 7
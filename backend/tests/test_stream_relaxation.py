@@ -0,0 +1,141 @@
+import json
+import threading
+import time
+from typing import Any
+
+import numpy as np
+
+from services.relaxation.events import JobEventType, JobStatusEvent, JobStepEvent, JobSummaryEvent
+from services.relaxation.job import JobStatus
+from services.relaxation.repository.sqlite import SQLiteRelaxationJobRepository
+from services.relaxation.trajectory_store import TrajectoryStore
+
+
+def _create_job(client: Any, material_id: str = "mp-30", max_steps: int = 10) -> str:
+    response = client.post("/relaxations", json={"material_id": material_id, "max_steps": max_steps})
+    assert response.status_code == 202
+    job_id: str = response.json()["id"]
+
+    # the structure is fetched in the background
+    deadline = time.monotonic() + 10.0
+    while client.get(f"/relaxations/{job_id}", params={"include_structures": False}).json()["status"] == "FETCHING":
+        assert time.monotonic() < deadline
+        time.sleep(0.02)
+
+    return job_id
+
+
+def _relax(settings: dict[str, str], job_id: str, steps: int) -> None:
+    """Plays the dispatcher: positions go to the trajectory before the steps are applied to the shared repository"""
+    repository = SQLiteRelaxationJobRepository(settings["DATABASE_PATH"], shared=True)
+    store = TrajectoryStore(settings["TRAJECTORY_STORE_DIR"])
+    try:
+        positions = np.asarray(repository.get(job_id)["atoms_slab"]["positions"])
+        repository.apply_events([JobStatusEvent(type=JobEventType.STATUS, job_id=job_id, status=JobStatus.RUNNING)])
+
+        for step in range(1, steps + 1):
+            step_positions = positions + 0.01 * step
+            store.write_step(job_id, step, step_positions, -float(step), 1.0 / step)
+            repository.apply_events([JobStepEvent(
+                type=JobEventType.STEP,
+                job_id=job_id,
+                step=step,
+                energy=-float(step),
+                force=1.0 / step,
+                positions=step_positions,
+            )])
+
+        repository.apply_events([JobSummaryEvent(
+            type=JobEventType.SUMMARY,
+            job_id=job_id,
+            status=JobStatus.FINISHED,
+            energies=[-float(step) for step in range(1, steps + 1)],
+        )])
+    finally:
+        repository.close()
+
+
+def _read_events(client: Any, job_id: str, **kwargs: Any) -> list[tuple[str, str | None, dict[str, Any]]]:
+    """Name, ID and data of every event until the server ends the stream"""
+    events = []
+    with client.stream("GET", f"/relaxations/{job_id}/events", **kwargs) as response:
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+
+        fields: dict[str, str] = {}
+        for line in response.iter_lines():
+            if line:
+                # keep-alive comments have no field name
+                name, _, value = line.partition(": ")
+                fields[name] = value
+                continue
+
+            if "event" in fields:
+                events.append((fields["event"], fields.get("id"), json.loads(fields["data"])))
+            fields = {}
+
+    return events
+
+
+def test_steps_are_streamed_until_the_summary(client: Any, api_settings: dict[str, str]) -> None:
+    job_id = _create_job(client)
+    # the steps are taken while the client is connected
+    dispatcher = threading.Timer(0.3, _relax, args=(api_settings, job_id, 3))
+    dispatcher.start()
+    try:
+        events = _read_events(client, job_id, params={"include_structures": False})
+    finally:
+        dispatcher.join()
+
+    steps = [(event_id, data["energy"], data["structure"]) for name, event_id, data in events if name == "step"]
+    assert steps == [("1", -1.0, None), ("2", -2.0, None), ("3", -3.0, None)]
+
+    assert events[0][0] == "status"
+    assert events[0][2]["status"] == JobStatus.PENDING
+    assert events[-1] == ("summary", None, {"status": JobStatus.FINISHED, "energies": [-1.0, -2.0, -3.0]})
+
+
+def test_reconnected_client_gets_the_steps_after_the_last_event(client: Any, api_settings: dict[str, str]) -> None:
+    job_id = _create_job(client)
+    _relax(api_settings, job_id, 4)
+
+    events = _read_events(client, job_id, headers={"Last-Event-ID": "2"})
+
+    assert [(name, event_id) for name, event_id, _ in events] == [
+        ("step", "3"), ("step", "4"), ("status", None), ("summary", None)
+    ]
+    # the structures of the replayed steps are read from the trajectory
+    assert all(data["structure"]["structure"] for name, _, data in events if name == "step")
+    assert events[2][2]["status"] == JobStatus.FINISHED
+
+
+def test_stream_of_unknown_job_is_rejected(client: Any) -> None:
+    response = client.get("/relaxations/missing/events")
+
+    assert response.status_code == 422
+    assert response.json() == {"detail": "Job not found"}
+
+
+def test_stream_follows_the_new_job_to_the_identical_job(client: Any, api_settings: dict[str, str]) -> None:
+    service = client.app.state.container.relaxation_service
+    identical_job_id = _create_job(client)
+    # the structure of the new job is fetched while the client is connected
+    service.intake.stop()
+    response = client.post("/relaxations", json={"material_id": "mp-30", "max_steps": 10, "mp_api_key": "another key"})
+    job_id = response.json()["id"]
+
+    def fetch_and_relax() -> None:
+        service._prepare_new_job(service.intake._queue.get_nowait())
+        _relax(api_settings, identical_job_id, 2)
+
+    dispatcher = threading.Timer(0.3, fetch_and_relax)
+    dispatcher.start()
+    try:
+        events = _read_events(client, job_id, params={"include_structures": False})
+    finally:
+        dispatcher.join()
+
+    assert events[0][0] == "status"
+    assert events[0][2]["status"] == JobStatus.FETCHING
+    assert [event_id for name, event_id, _ in events if name == "step"] == ["1", "2"]
+    assert events[-1] == ("summary", None, {"status": JobStatus.FINISHED, "energies": [-1.0, -2.0]})
@@ -0,0 +1,126 @@
+import os
+from types import SimpleNamespace
+from typing import Any, Iterator
+
+import pytest
+
+from services.structures import store as store_module
+from services.structures.source.abstract import MaterialMalformedName, MaterialNotFound
+from services.structures.source.cached import CachedStructureSource
+from services.structures.source.local import LocalStructureSource
+from services.structures.store import SQLiteStructureStore
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(store_module, "time", SimpleNamespace(time=clock.time))
+    return clock
+
+
+class CountingSource(LocalStructureSource):
+    """Local source that records the materials it was asked for"""
+    def __init__(self, directory: str) -> None:
+        super().__init__(directory, database_version="v1")
+        self.fetched: list[str] = []
+
+    def fetch(self, material_id: str, api_key: str) -> Any:
+        self.fetched.append(material_id)
+        return super().fetch(material_id, api_key)
+
+
+@pytest.fixture
+def store(tmp_path: Any) -> Iterator[SQLiteStructureStore]:
+    store = SQLiteStructureStore(os.path.join(tmp_path, "structures.sqlite3"), ttl=3600.0, max_entries=2)
+    yield store
+    store.close()
+
+
+def test_structures_are_stored_per_database_version(store: SQLiteStructureStore, structures_dir: str) -> None:
+    structure = LocalStructureSource(structures_dir).fetch("mp-30", "key")
+    store.put("mp-30", "v1", structure)
+
+    stored = store.get("mp-30", "v1")
+
+    assert stored is not None
+    assert stored.composition == structure.composition
+    assert stored.lattice == structure.lattice
+    assert store.get("mp-30", "v2") is None
+
+
+def test_stale_structures_expire_unless_pinned(clock: Clock, store: SQLiteStructureStore, structures_dir: str) -> None:
+    source = LocalStructureSource(structures_dir)
+    store.put("mp-30", "v1", source.fetch("mp-30", "key"))
+    store.put_many("v1", {"mp-134": source.fetch("mp-134", "key")}, pinned=True)
+
+    clock.now += 3600.0 + 1.0
+
+    assert store.get("mp-30", "v1") is None
+    assert store.get("mp-134", "v1") is not None
+
+
+def test_least_recently_used_structures_are_evicted(clock: Clock,
+                                                    store: SQLiteStructureStore,
+                                                    structures_dir: str) -> None:
+    structure = LocalStructureSource(structures_dir).fetch("mp-30", "key")
+    # pinned entries don't count towards max_entries
+    store.put_many("v1", {"pinned": structure}, pinned=True)
+    store.put("a", "v1", structure)
+    clock.now += 1.0
+    store.put("b", "v1", structure)
+    clock.now += 1.0
+    assert store.get("a", "v1") is not None
+
+    clock.now += 1.0
+    store.put("c", "v1", structure)
+
+    assert [material_id for material_id in ("pinned", "a", "b", "c") if store.get(material_id, "v1")] == [
+        "pinned", "a", "c"
+    ]
+
+
+def test_pinned_structures_stay_pinned_when_fetched_again(clock: Clock,
+                                                          store: SQLiteStructureStore,
+                                                          structures_dir: str) -> None:
+    structure = LocalStructureSource(structures_dir).fetch("mp-30", "key")
+    store.put_many("v1", {"mp-30": structure}, pinned=True)
+    store.put("mp-30", "v1", structure)
+
+    clock.now += 3600.0 + 1.0
+
+    assert store.get("mp-30", "v1") is not None
+
+
+def test_cached_source_fetches_only_the_missing_structures(store: SQLiteStructureStore, structures_dir: str) -> None:
+    wrapped = CountingSource(structures_dir)
+    source = CachedStructureSource(wrapped, store)
+
+    source.fetch("mp-30", "key")
+    assert source.fetch("mp-30", "key").composition.reduced_formula == "Cu"
+    assert wrapped.fetched == ["mp-30"]
+
+    results = source.fetch_many(["mp-30", "mp-134", "mp-missing"], "key")
+    assert isinstance(results["mp-missing"], MaterialNotFound)
+    assert results["mp-134"].composition.reduced_formula == "Al"  # type: ignore[union-attr]
+    assert wrapped.fetched == ["mp-30", "mp-134", "mp-missing"]
+
+    # materials that were not found are not stored, they are asked for again
+    source.fetch_many(["mp-134", "mp-missing"], "key")
+    assert wrapped.fetched == ["mp-30", "mp-134", "mp-missing", "mp-missing"]
+
+
+@pytest.mark.parametrize(
+    ("material_id", "error"),
+    [("mp-missing", MaterialNotFound), ("../mp-30", MaterialMalformedName), (".hidden", MaterialMalformedName)],
+)
+def test_local_source_errors(structures_dir: str, material_id: str, error: type[Exception]) -> None:
+    with pytest.raises(error):
+        LocalStructureSource(structures_dir).fetch(material_id, "key")
@@ -0,0 +1,135 @@
+import multiprocessing
+import socket
+import threading
+import time
+from multiprocessing import AuthenticationError
+from typing import Callable, Iterator
+
+import pytest
+
+from services.relaxation.events import JobEventType, JobStatusEvent, JobSummaryEvent
+from services.relaxation.job import Job, JobStatus
+from services.relaxation.transport.tcp import TcpJobTransport, TcpWorkerConnection
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port: int = sock.getsockname()[1]
+        return port
+
+
+def _wait_until(condition: Callable[[], bool]) -> None:
+    deadline = time.monotonic() + 10.0
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.02)
+
+
+def _status(job_id: str, status: JobStatus) -> JobStatusEvent:
+    return JobStatusEvent(type=JobEventType.STATUS, job_id=job_id, status=status)
+
+
+@pytest.fixture
+def transport() -> Iterator[TcpJobTransport]:
+    transport = TcpJobTransport("127.0.0.1", _free_port(), authkey="secret")
+    transport.start()
+    yield transport
+    transport.stop(timeout=0.0)
+
+
+@pytest.fixture
+def connection(transport: TcpJobTransport) -> Iterator[TcpWorkerConnection]:
+    connection = TcpWorkerConnection(transport.address, "secret", slots=2, drain_event=multiprocessing.Event())
+    yield connection
+    connection.close()
+
+
+def test_remote_worker_takes_jobs_and_sends_their_events(transport: TcpJobTransport,
+                                                         connection: TcpWorkerConnection,
+                                                         make_job: Callable[..., Job]) -> None:
+    _wait_until(lambda: transport.remote_slots == 2)
+    transport.task_queue.put(make_job("job"))
+
+    assert connection.task_queue.get(timeout=5.0)["id"] == "job"
+    assert transport.remote_active_jobs == 1
+
+    connection.message_queue.put(_status("job", JobStatus.RUNNING))
+    connection.message_queue.put(
+        JobSummaryEvent(type=JobEventType.SUMMARY, job_id="job", status=JobStatus.FINISHED, energies=[0.0])
+    )
+
+    events = [transport.message_queue.get(timeout=5.0) for _ in range(2)]
+    assert [event["type"] for event in events] == [JobEventType.STATUS, JobEventType.SUMMARY]
+    # the finished job is not leased anymore
+    _wait_until(lambda: transport.remote_active_jobs == 0)
+
+
+def test_cancel_is_sent_to_the_worker_of_the_job(transport: TcpJobTransport,
+                                                 connection: TcpWorkerConnection,
+                                                 make_job: Callable[..., Job]) -> None:
+    cancelled: list[str] = []
+    connection.add_cancel_listener(cancelled.append)
+    transport.task_queue.put(make_job("job"))
+    connection.task_queue.get(timeout=5.0)
+
+    transport.cancel("not leased")
+    transport.cancel("job")
+
+    # the cancel is received with the next message of the worker
+    def message_sent() -> bool:
+        connection.message_queue.put(_status("job", JobStatus.RUNNING))
+        return bool(cancelled)
+
+    _wait_until(message_sent)
+    assert cancelled == ["job"]
+
+
+def test_jobs_of_lost_workers_are_resumed_by_other_workers(transport: TcpJobTransport,
+                                                           connection: TcpWorkerConnection,
+                                                           make_job: Callable[..., Job]) -> None:
+    lost: list[str] = []
+    transport.add_lost_job_listener(lost.append)
+    for job_id in ("checkpointed", "running"):
+        transport.task_queue.put(make_job(job_id))
+        connection.task_queue.get(timeout=5.0)
+
+    # e.g. the host of the worker is shut down, the job is checkpointed and given back
+    connection.message_queue.put(_status("checkpointed", JobStatus.PENDING))
+    _wait_until(lambda: lost == ["checkpointed"])
+
+    connection.close()
+
+    _wait_until(lambda: lost == ["checkpointed", "running"])
+    assert (transport.remote_slots, transport.remote_active_jobs) == (0, 0)
+
+
+def test_stop_drains_the_remote_workers(transport: TcpJobTransport,
+                                        connection: TcpWorkerConnection,
+                                        make_job: Callable[..., Job]) -> None:
+    lost: list[str] = []
+    transport.add_lost_job_listener(lost.append)
+    transport.task_queue.put(make_job("job"))
+    connection.task_queue.get(timeout=5.0)
+
+    stopping = threading.Thread(target=transport.stop, args=(10.0,))
+    stopping.start()
+
+    def message_sent() -> bool:
+        connection.message_queue.put(_status("job", JobStatus.RUNNING))
+        return connection.drain_event.is_set()
+
+    _wait_until(message_sent)
+    connection.message_queue.put(_status("job", JobStatus.PENDING))
+    stopping.join(timeout=10.0)
+
+    assert not stopping.is_alive()
+    # drained jobs are resumed by the next dispatcher
+    assert lost == []
+
+
+def test_worker_with_another_authkey_is_refused(transport: TcpJobTransport) -> None:
+    with pytest.raises(AuthenticationError):
+        TcpWorkerConnection(transport.address, "wrong", slots=1, drain_event=multiprocessing.Event())
+
+    assert transport.remote_slots == 0
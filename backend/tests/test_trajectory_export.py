@@ -0,0 +1,133 @@
+import gzip
+import io
+import os
+from typing import Any, Callable
+
+import numpy as np
+import pytest
+from ase.io import read
+
+from services.relaxation.job import Job, JobStatus
+from services.relaxation.trajectory_export import TrajectoryExport, TrajectoryExporter, TrajectoryFormat, \
+    TrajectoryIsEmpty
+from services.relaxation.trajectory_store import TrajectoryStore
+
+
+@pytest.fixture
+def store(tmp_path: Any) -> TrajectoryStore:
+    return TrajectoryStore(os.path.join(tmp_path, "trajectories"))
+
+
+@pytest.fixture
+def exporter(tmp_path: Any, store: TrajectoryStore) -> TrajectoryExporter:
+    return TrajectoryExporter(os.path.join(tmp_path, "exports"), store)
+
+
+def _relaxed(store: TrajectoryStore, job: Job, steps: int) -> Job:
+    trajectory = store.create(job["id"], job["atoms_slab"], job["max_steps"])
+    positions = np.asarray(job["atoms_slab"]["positions"])
+    for step in range(1, steps + 1):
+        trajectory.write_step(step, positions + 0.01 * step, -float(step), 1.0 / step)
+
+    return job
+
+
+def _read(export: TrajectoryExport) -> bytes:
+    if export.path is not None:
+        with open(export.path, "rb") as file:
+            return file.read()
+
+    assert export.chunks is not None
+    return b"".join(export.chunks)
+
+
+@pytest.mark.parametrize("structure_format", [TrajectoryFormat.XYZ, TrajectoryFormat.EXTXYZ])
+def test_every_step_is_exported(store: TrajectoryStore,
+                                exporter: TrajectoryExporter,
+                                make_job: Callable[..., Job],
+                                structure_format: TrajectoryFormat) -> None:
+    job = _relaxed(store, make_job("job", status=JobStatus.RUNNING), steps=3)
+
+    export = exporter.export(job, structure_format, compress=False)
+    frames = read(io.StringIO(_read(export).decode()), index=":", format=structure_format.value)
+
+    assert export.filename == f"trajectory_job.{structure_format.value}"
+    assert len(frames) == 3
+    np.testing.assert_allclose(
+        frames[2].positions, np.asarray(job["atoms_slab"]["positions"]) + 0.03, atol=1e-6
+    )
+    if structure_format == TrajectoryFormat.EXTXYZ:
+        assert [frame.info["step"] for frame in frames] == [1, 2, 3]
+        assert frames[1].get_potential_energy() == -2.0
+
+
+def test_npz_and_gzip_exports(store: TrajectoryStore,
+                              exporter: TrajectoryExporter,
+                              make_job: Callable[..., Job]) -> None:
+    job = _relaxed(store, make_job("job", status=JobStatus.RUNNING), steps=4)
+
+    plain = _read(exporter.export(job, TrajectoryFormat.NPZ, compress=False))
+    compressed = exporter.export(job, TrajectoryFormat.NPZ, compress=True)
+
+    assert (compressed.filename, compressed.media_type) == ("trajectory_job.npz.gz", "application/gzip")
+    assert gzip.decompress(_read(compressed)) == plain
+    with np.load(io.BytesIO(plain)) as data:
+        assert data["positions"].shape == (4, len(job["atoms_slab"]["numbers"]), 3)
+        np.testing.assert_array_equal(data["energies"], [-1.0, -2.0, -3.0, -4.0])
+        np.testing.assert_array_equal(data["numbers"], job["atoms_slab"]["numbers"])
+
+
+def test_export_of_finished_job_is_cached(store: TrajectoryStore,
+                                          exporter: TrajectoryExporter,
+                                          make_job: Callable[..., Job]) -> None:
+    written: list[str] = []
+    exporter.add_write_listener(written.append)
+    running = _relaxed(store, make_job("job", status=JobStatus.RUNNING), steps=2)
+    finished = {**running, "status": JobStatus.FINISHED}
+
+    # trajectory of the running job may still grow
+    _read(exporter.export(running, TrajectoryFormat.XYZ, compress=False))
+    assert exporter.job_ids() == []
+
+    # an export that is not sent to the end is not cached
+    chunks = exporter.export(finished, TrajectoryFormat.XYZ, compress=False).chunks
+    assert chunks is not None
+    next(chunks)
+    chunks.close()
+    assert exporter.size_bytes("job") == 0
+
+    streamed = _read(exporter.export(finished, TrajectoryFormat.XYZ, compress=False))
+    cached = exporter.export(finished, TrajectoryFormat.XYZ, compress=False)
+
+    assert cached.path is not None
+    assert _read(cached) == streamed
+    assert written == ["job"]
+    assert exporter.size_bytes("job") > 0
+
+    exporter.evict("job")
+    assert exporter.job_ids() == []
+
+
+def test_empty_trajectory_is_not_exported(store: TrajectoryStore,
+                                          exporter: TrajectoryExporter,
+                                          make_job: Callable[..., Job]) -> None:
+    # the structure is not fetched yet
+    with pytest.raises(TrajectoryIsEmpty):
+        exporter.export(make_job("fetching"), TrajectoryFormat.XYZ, compress=False)
+
+    job = _relaxed(store, make_job("pending"), steps=0)
+    with pytest.raises(TrajectoryIsEmpty):
+        exporter.export(job, TrajectoryFormat.XYZ, compress=False)
+
+
+@pytest.mark.parametrize(
+    ("accept", "structure_format"),
+    [
+        (None, TrajectoryFormat.XYZ),
+        ("*/*", TrajectoryFormat.XYZ),
+        ("chemical/x-extxyz", TrajectoryFormat.EXTXYZ),
+        ("application/json, application/x-npz;q=0.9", TrajectoryFormat.NPZ),
+    ],
+)
+def test_format_is_negotiated(accept: str | None, structure_format: TrajectoryFormat) -> None:
+    assert TrajectoryExporter.format_from_accept(accept) == structure_format
@@ -0,0 +1,125 @@
+import multiprocessing
+import queue
+from functools import partial
+from typing import Any, Callable
+
+import numpy as np
+import pytest
+from ase import Atoms
+from ase.build import bulk
+from ase.calculators.calculator import Calculator, all_changes
+
+from services.relaxation.events import JobEventType
+from services.relaxation.job import Job, JobStatus
+from services.relaxation.worker import RelaxationWorker
+from utils.calculator_factory import CalculatorRegistry, MACECalculatorFactory, create_calculator_registry
+
+try:
+    import torch
+except ImportError:
+    torch = None
+
+
+def _reference() -> Atoms:
+    return bulk("Cu", cubic=True).repeat((2, 2, 2))
+
+
+class TorchHarmonic(Calculator):
+    """
+    Harmonic potential around the lattice sites, evaluated with torch like MACE:
+        inputs are created in the default dtype and fail against the weights of another dtype.
+    """
+    implemented_properties = ["energy", "free_energy", "forces"]
+
+    def __init__(self, dtype: str, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self.weights = torch.eye(3, dtype=getattr(torch, dtype))
+        self.sites = torch.tensor(_reference().positions, dtype=getattr(torch, dtype))
+
+    def calculate(self,
+                  atoms: Atoms | None = None,
+                  properties: list[str] | None = None,
+                  system_changes: list[str] = all_changes) -> None:
+        super().calculate(atoms, properties, system_changes)
+
+        positions = torch.tensor(self.atoms.positions, dtype=torch.get_default_dtype())
+        displacements = positions @ self.weights - self.sites
+        energy = 0.5 * float((displacements ** 2).sum())
+
+        self.results = {"energy": energy, "free_energy": energy, "forces": -displacements.numpy().astype(np.float64)}
+
+
+class TorchHarmonicFactory(MACECalculatorFactory):
+    """Sets the default dtype of the whole process when the calculator is created, like mace_mp"""
+    def create(self) -> Calculator:
+        torch.set_default_dtype(getattr(torch, self.dtype))
+        return TorchHarmonic(self.dtype)
+
+
+def _rattled_reference() -> dict[str, Any]:
+    atoms = _reference()
+    atoms.rattle(0.05, seed=1)
+    return atoms.todict()
+
+
+def _sent_events(messages: 'queue.Queue[Any]') -> list[Any]:
+    events = []
+    while not messages.empty():
+        events.append(messages.get())
+
+    return events
+
+
+@pytest.mark.skipif(torch is None, reason="torch is not installed")
+def test_models_with_different_dtypes_in_one_worker(make_job: Callable[..., Job]) -> None:
+    registry = CalculatorRegistry("harmonic")
+    registry.register("harmonic", partial(TorchHarmonicFactory, "harmonic", None))
+    messages: queue.Queue[Any] = queue.Queue()
+    worker = RelaxationWorker(registry, queue.Queue(), messages, multiprocessing.Event())
+
+    previous_dtype = torch.get_default_dtype()
+    # the float64 model is loaded after the float32 one and sets its dtype for the whole process
+    for job_id, dtype in (("first", "float32"), ("second", "float64"), ("third", "float32")):
+        job = make_job(job_id, atoms_slab=_rattled_reference(), model="harmonic", dtype=dtype, fmax=0.01, max_steps=20)
+        worker._run_job(job)
+
+    events = _sent_events(messages)
+    statuses = {event["job_id"]: event["status"] for event in events if event["type"] != JobEventType.STEP}
+    assert statuses == {"first": JobStatus.FINISHED, "second": JobStatus.FINISHED, "third": JobStatus.FINISHED}
+    assert torch.get_default_dtype() == previous_dtype
+
+
+def test_prerelaxation_shares_the_step_budget_with_the_refinement(make_job: Callable[..., Job]) -> None:
+    messages: queue.Queue[Any] = queue.Queue()
+    worker = RelaxationWorker(create_calculator_registry("emt"), queue.Queue(), messages, multiprocessing.Event())
+
+    stages = []
+    relax_stage = worker._relax_stage
+
+    def record_stage(*args: Any, **kwargs: Any) -> int:
+        last_step = relax_stage(*args, **kwargs)
+        stages.append((kwargs["stage"], kwargs["start_step"], last_step))
+        return last_step
+
+    worker._relax_stage = record_stage  # type: ignore[method-assign]
+
+    # the refinement doesn't converge, so the job runs out of its steps
+    max_steps = 8
+    single = make_job("single", atoms_slab=_rattled_reference(), fmax=1e-8, max_steps=max_steps)
+    staged = {**single, "id": "staged", "prerelaxation": {"model": "lj", "dtype": "float64", "fmax": 0.5}}
+    worker._run_job(single)
+    worker._run_job(staged)
+
+    steps: dict[str, list[int]] = {"single": [], "staged": []}
+    for event in _sent_events(messages):
+        if event["type"] == JobEventType.STEP:
+            steps[event["job_id"]].append(event["step"])
+
+    # the pre-relaxation converges early and the refinement continues from its last step
+    (_, _, single_last_step), (_, _, prerelaxed_step), (refinement, refinement_start, staged_last_step) = stages
+    assert 1 < prerelaxed_step < max_steps
+    assert (refinement, refinement_start) == (1, prerelaxed_step)
+
+    # the initial structure and max_steps optimizer steps, however many stages there are
+    assert steps["single"] == steps["staged"] == list(range(1, max_steps + 2))
+    assert single_last_step == staged_last_step == max_steps + 1
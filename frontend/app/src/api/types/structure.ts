@@ -18,6 +18,10 @@ export type StructureDetails = {
   structure: string;
 };
 
+export type StepDetails = StructureDetails & {
+  step: number;
+};
+
 export type Structures = {
   chemical_formula: string;
   bulk: StructureDetails;
@@ -26,8 +30,15 @@ export type Structures = {
 
 export type Structure = {
   id: string;
-  status: 'PENDING' | 'RUNNING' | 'FINISHED' | 'FAILED';
+  material_id: string | null;
+  status: 'FETCHING' | 'PENDING' | 'RUNNING' | 'FINISHED' | 'FAILED' | 'CANCELLED' | 'TIMED_OUT';
+  error: string | null;
   optimization: Optimization;
-  structures: Structures;
-  steps: StructureDetails[];
+  // null until the structure is fetched
+  structures: Structures | null;
+  steps: StepDetails[];
+  total_steps: number;
+  last_step: number;
+  queue_position: number | null;
+  eta_seconds: number | null;
 };